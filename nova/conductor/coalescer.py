@@ -0,0 +1,139 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Coalescing of the service heartbeats and compute node resource updates.
+
+Every compute host reports a service heartbeat and its compute node
+resources periodically. Written one by one, these small transactions
+dominate the write load of large deployments. When
+heartbeat_flush_interval is set, the conductor buffers them instead and
+flushes all the updates received during the interval as a few multi-row
+UPDATEs, so the write load per interval does not grow with the number of
+hosts. Successive updates of the same row within an interval are merged.
+
+The updates carry the time the conductor received them as their
+updated_at, and a row is only written if it was not updated since, so
+the update flushed late by a conductor worker does not overwrite the
+newer one written by another worker.
+"""
+
+from eventlet import greenthread
+from oslo.config import cfg
+
+from nova import context as nova_context
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+coalescer_opts = [
+    cfg.FloatOpt('heartbeat_flush_interval',
+                 default=0,
+                 help='Interval in seconds during which the service '
+                      'heartbeats and compute node resource updates are '
+                      'buffered, before being written in batch. 0 writes '
+                      'each update immediately. It is capped to a tenth of '
+                      'service_down_time so the buffered heartbeats do not '
+                      'make the services look down'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(coalescer_opts, 'conductor')
+
+# Fields of a service update which are part of its heartbeat.
+HEARTBEAT_FIELDS = frozenset(['report_count'])
+
+# Largest fraction of service_down_time the heartbeats may be buffered.
+MAX_FLUSH_DOWN_TIME_RATIO = 0.1
+
+
+class UpdateCoalescer(object):
+    """Buffers the service and compute node updates for batched writes."""
+
+    def __init__(self, db):
+        self.db = db
+        self.services = {}
+        self.compute_nodes = {}
+        self._flusher = None
+        self.check_flush_interval()
+
+    @staticmethod
+    def check_flush_interval():
+        """Cap heartbeat_flush_interval to a fraction of service_down_time."""
+        max_interval = CONF.service_down_time * MAX_FLUSH_DOWN_TIME_RATIO
+        if CONF.conductor.heartbeat_flush_interval > max_interval:
+            LOG.warn(_("Heartbeat flush interval must be less than a tenth "
+                       "of service down time. Current config: "
+                       "<heartbeat_flush_interval: %(interval)s, "
+                       "service_down_time: %(service_down_time)s>. Setting "
+                       "heartbeat_flush_interval to: %(max_interval)s"),
+                     {'interval': CONF.conductor.heartbeat_flush_interval,
+                      'service_down_time': CONF.service_down_time,
+                      'max_interval': max_interval})
+            CONF.set_override('heartbeat_flush_interval', max_interval,
+                              group='conductor')
+
+    @staticmethod
+    def enabled():
+        return CONF.conductor.heartbeat_flush_interval > 0
+
+    @staticmethod
+    def _merge(pending, row_id, values):
+        pending.setdefault(row_id, {}).update(values)
+
+    def _schedule_flush(self):
+        if self._flusher is None:
+            self._flusher = greenthread.spawn_after(
+                CONF.conductor.heartbeat_flush_interval, self.flush)
+
+    def service_update(self, service_id, values):
+        self._merge(self.services, service_id, values)
+        self._schedule_flush()
+
+    def compute_node_update(self, compute_id, values):
+        self._merge(self.compute_nodes, compute_id, values)
+        self._schedule_flush()
+
+    def _flush(self, context, name, pending, update_all):
+        try:
+            missing = update_all(context, pending)
+        except Exception:
+            LOG.exception(_("Failed to write %(count)d buffered %(name)s "
+                            "updates, retrying"),
+                          {'count': len(pending), 'name': name})
+            # Keep the newer values of the rows updated meanwhile.
+            buffered = getattr(self, name)
+            for row_id, values in pending.iteritems():
+                buffered[row_id] = dict(values, **buffered.get(row_id, {}))
+            self._schedule_flush()
+            return
+        if missing:
+            LOG.warn(_("Dropped the buffered updates of the deleted "
+                       "%(name)s %(ids)s"),
+                     {'name': name, 'ids': sorted(missing)})
+
+    def flush(self):
+        """Write the buffered updates."""
+        self._flusher = None
+        services, self.services = self.services, {}
+        compute_nodes, self.compute_nodes = self.compute_nodes, {}
+        context = nova_context.get_admin_context()
+        if services:
+            self._flush(context, 'services', services,
+                        self.db.service_update_all)
+        if compute_nodes:
+            self._flush(context, 'compute_nodes', compute_nodes,
+                        self.db.compute_node_update_all)
@@ -25,6 +25,7 @@ from nova.compute import rpcapi as compute_rpcapi
 from nova.compute import task_states
 from nova.compute import utils as compute_utils
 from nova.compute import vm_states
+from nova.conductor import coalescer
 from nova.conductor.tasks import live_migrate
 from nova.db import base
 from nova import exception
@@ -88,9 +89,13 @@ class ConductorManager(manager.Manager):
         self._compute_api = None
         self.compute_task_mgr = ComputeTaskManager()
         self.cells_rpcapi = cells_rpcapi.CellsAPI()
+        self.coalescer = coalescer.UpdateCoalescer(self.db)
         self.additional_endpoints.append(self.compute_task_mgr)
         self.additional_endpoints.append(_ConductorManagerV2Proxy(self))
 
+    def cleanup_host(self):
+        self.coalescer.flush()
+
     @property
     def network_api(self):
         # NOTE(danms): We need to instantiate our network_api on first use
@@ -479,6 +484,14 @@ class ConductorManager(manager.Manager):
             # in version 2.0 of the RPC API
             values['stats'] = jsonutils.dumps(values['stats'])
 
+        if self.coalescer.enabled():
+            # The compute node is written by the next flush, unless it was
+            # updated since, return it as it will be.
+            values = dict(values, updated_at=timeutils.utcnow())
+            self.coalescer.compute_node_update(node['id'], values)
+            result = dict(node)
+            result.update(values)
+            return jsonutils.to_primitive(result)
         result = self.db.compute_node_update(context, node['id'], values)
         return jsonutils.to_primitive(result)
 
@@ -488,6 +501,15 @@ class ConductorManager(manager.Manager):
 
     @messaging.expected_exceptions(exception.ServiceNotFound)
     def service_update(self, context, service, values):
+        if (self.coalescer.enabled() and
+                set(values).issubset(coalescer.HEARTBEAT_FIELDS)):
+            # Heartbeats are written by the next flush, other updates are
+            # written immediately.
+            values = dict(values, updated_at=timeutils.utcnow())
+            self.coalescer.service_update(service['id'], values)
+            svc = dict(service)
+            svc.update(values)
+            return jsonutils.to_primitive(svc)
         svc = self.db.service_update(context, service['id'], values)
         return jsonutils.to_primitive(svc)
 
@@ -148,6 +148,17 @@ def service_update(context, service_id, values):
     return IMPL.service_update(context, service_id, values)
 
 
+def service_update_all(context, updates):
+    """Apply a batch of updates to services in one transaction.
+
+    :param updates: dict of the values to update keyed by service id
+                    The values carrying an updated_at are only written if
+                    the row was not updated since.
+    :returns: set of the ids of the services not found
+    """
+    return IMPL.service_update_all(context, updates)
+
+
 ###################
 
 
@@ -179,7 +190,7 @@ def compute_node_get_by_service_id(context, service_id):
     return IMPL.compute_node_get_by_service_id(context, service_id)
 
 
-def compute_node_get_all(context, no_date_fields=False):
+def compute_node_get_all(context, no_date_fields=False, updated_since=None):
     """Get all computeNodes.
 
     :param context: The security context
@@ -187,11 +198,16 @@ def compute_node_get_all(context, no_date_fields=False):
                            'deleted_at' and 'deleted' fields from the output,
                            thus significantly reducing its size.
                            Set to False by default
+    :param updated_since: If set, only the compute nodes created or updated
+                          at or after this time are returned in full. The
+                          others only contain their 'id', 'service_id' and
+                          'service', and 'unchanged' set to True.
 
     :returns: List of dictionaries each containing compute node properties,
               including corresponding service
     """
-    return IMPL.compute_node_get_all(context, no_date_fields)
+    return IMPL.compute_node_get_all(context, no_date_fields,
+                                     updated_since=updated_since)
 
 
 def compute_node_search_by_hypervisor(context, hypervisor_match):
@@ -233,6 +249,17 @@ def compute_node_update(context, compute_id, values):
     return IMPL.compute_node_update(context, compute_id, values)
 
 
+def compute_node_update_all(context, updates):
+    """Apply a batch of updates to compute nodes in one transaction.
+
+    :param updates: dict of the values to update keyed by compute node id
+                    The values carrying an updated_at are only written if
+                    the row was not updated since.
+    :returns: set of the ids of the compute nodes not found
+    """
+    return IMPL.compute_node_update_all(context, updates)
+
+
 def compute_node_delete(context, compute_id):
     """Delete a compute node from the database.
 
@@ -1105,6 +1132,23 @@ def quota_reserve(context, resources, quotas, user_quotas, deltas, expire,
                               project_id=project_id, user_id=user_id)
 
 
+def quota_reserve_optimistic(context, resources, quotas, user_quotas,
+                             deltas, expire, until_refresh, max_age,
+                             project_id=None, user_id=None):
+    """Check quotas and create appropriate reservations without locking
+    the quota usages.
+
+    The usages are updated by compare-and-swap UPDATEs on their version,
+    retried on conflict. The reservation falls back to quota_reserve when
+    a usage needs a refresh or stays contended.
+    """
+    return IMPL.quota_reserve_optimistic(context, resources, quotas,
+                                         user_quotas, deltas, expire,
+                                         until_refresh, max_age,
+                                         project_id=project_id,
+                                         user_id=user_id)
+
+
 def reservation_commit(context, reservations, project_id=None, user_id=None):
     """Commit quota reservations."""
     return IMPL.reservation_commit(context, reservations,
@@ -1906,6 +1950,52 @@ def task_log_get(context, task_name, period_beginning,
 ####################
 
 
+def kvmha_evacuation_create(context, values):
+    """Record a new evacuation of an instance from a failed host."""
+    return IMPL.kvmha_evacuation_create(context, values)
+
+
+def kvmha_evacuation_update(context, evacuation_id, values):
+    """Set the given properties on an evacuation record and update it.
+
+    Raises NotFound if the evacuation record does not exist.
+    """
+    return IMPL.kvmha_evacuation_update(context, evacuation_id, values)
+
+
+def kvmha_evacuation_get_all_by_source_host(context, source_host,
+                                            statuses=None):
+    """Get all evacuations from a failed host, highest priority first.
+
+    :param statuses: if given, only return evacuations in these statuses.
+    """
+    return IMPL.kvmha_evacuation_get_all_by_source_host(context, source_host,
+                                                        statuses=statuses)
+
+
+def kvmha_host_claim(context, host, owner, timeout):
+    """Atomically claim the recovery of a failed host for owner.
+
+    The claim succeeds if the host is not claimed yet, is already claimed
+    by owner or its claim was not renewed for timeout seconds.
+
+    :returns: True if owner holds the claim, False otherwise.
+    """
+    return IMPL.kvmha_host_claim(context, host, owner, timeout)
+
+
+def kvmha_host_release(context, host, owner=None):
+    """Release the claim on the recovery of a host.
+
+    :param owner: if given, only release the claim held by owner.
+    :returns: True if a claim was released, False otherwise.
+    """
+    return IMPL.kvmha_host_release(context, host, owner=owner)
+
+
+####################
+
+
 def archive_deleted_rows(context, max_rows=None):
     """Move up to max_rows rows from production tables to corresponding shadow
     tables.
@@ -1923,3 +2013,30 @@ def archive_deleted_rows_for_table(context, tablename, max_rows=None):
     """
     return IMPL.archive_deleted_rows_for_table(context, tablename,
                                                max_rows=max_rows)
+
+
+def archive_deleted_rows_batch(context, tablename, max_rows, marker=None):
+    """Move up to max_rows deleted rows following marker from tablename to
+    the corresponding shadow table, in a single transaction.
+
+    :returns: dict with the number of rows archived and the marker of the
+              next batch.
+    :raises: ArchiveRowReferenced if a row of the batch is still
+             referenced by another table.
+    """
+    return IMPL.archive_deleted_rows_batch(context, tablename, max_rows,
+                                           marker=marker)
+
+
+def archive_table_names(context):
+    """Return the names of the archived tables, the tables referencing
+    another one first.
+    """
+    return IMPL.archive_table_names(context)
+
+
+def replica_lag(context):
+    """Return the replication lag of the most lagging replica database, in
+    seconds, or None if no replica is configured.
+    """
+    return IMPL.replica_lag(context)
@@ -0,0 +1,208 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Continuous archiving of the deleted rows to the shadow tables.
+
+The archiver walks the tables in foreign key order, the tables referencing
+another one first, and moves the deleted rows of each table to its shadow
+table in small transactions until the table is drained. It is run by the
+nova-archiver service.
+
+The batches are paced so archiving does not compete with the production
+load: the batch size adapts to keep each transaction around
+archive_batch_time seconds, the archiver sleeps archive_sleep_ratio times
+the duration of a batch after it, and it waits while the replica databases
+lag by more than archive_max_replica_lag seconds.
+
+Each table is archived from a watermark, the key of the last row archived,
+which is saved to archive_watermark_file so a restarted archiver resumes
+where it stopped. A deleted row still referenced by another table is
+skipped, once the batch holding it is down to that row, instead of
+blocking the table.
+"""
+
+import collections
+import os
+import time
+
+from oslo.config import cfg
+
+from nova import context as nova_context
+from nova import db
+from nova import exception
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import jsonutils
+from nova.openstack.common import log as logging
+from nova import paths
+
+LOG = logging.getLogger(__name__)
+
+archiver_opts = [
+    cfg.IntOpt('archive_max_batch_size',
+               default=1000,
+               help='Maximum number of deleted rows moved to the shadow '
+                    'tables in a single transaction'),
+    cfg.FloatOpt('archive_batch_time',
+                 default=0.5,
+                 help='Target duration in seconds of an archiving '
+                      'transaction. The batch size is halved after a '
+                      'slower batch and doubled after a faster one'),
+    cfg.FloatOpt('archive_sleep_ratio',
+                 default=1.0,
+                 help='Time to sleep after each archiving transaction, as '
+                      'a multiple of its duration'),
+    cfg.IntOpt('archive_max_replica_lag',
+               default=10,
+               help='Pause archiving while the replica databases lag by '
+                    'more than this many seconds'),
+    cfg.IntOpt('archive_interval',
+               default=300,
+               help='Interval in seconds between the archiving passes '
+                    'which found no deleted rows'),
+    cfg.StrOpt('archive_watermark_file',
+               default=paths.state_path_def('archive_watermarks.json'),
+               help='File the archiving watermarks are saved to, so a '
+                    'restarted archiver resumes where it stopped'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(archiver_opts)
+
+
+class Archiver(object):
+    """Moves the deleted rows of every table to its shadow table."""
+
+    def __init__(self, context=None, sleep=time.sleep):
+        self.context = context or nova_context.get_admin_context()
+        self.sleep = sleep
+        self.batch_size = CONF.archive_max_batch_size
+        self.watermarks = self._load_watermarks()
+        self.rows = collections.defaultdict(int)
+
+    def _load_watermarks(self):
+        path = CONF.archive_watermark_file
+        if not path or not os.path.exists(path):
+            return {}
+        try:
+            with open(path) as f:
+                return jsonutils.loads(f.read())
+        except (IOError, ValueError) as e:
+            LOG.warn(_("Ignoring the archiving watermarks of %(path)s: "
+                       "%(error)s"), {'path': path, 'error': e})
+            return {}
+
+    def _save_watermarks(self):
+        path = CONF.archive_watermark_file
+        if not path:
+            return
+        with open(path + '.tmp', 'w') as f:
+            f.write(jsonutils.dumps(self.watermarks))
+        os.rename(path + '.tmp', path)
+
+    def _wait_for_replicas(self):
+        while True:
+            lag = db.replica_lag(self.context)
+            if lag is None or lag <= CONF.archive_max_replica_lag:
+                return
+            LOG.debug(_("Replica databases lag by %ds, pausing archiving"),
+                      lag)
+            self.sleep(lag)
+
+    def _throttle(self, elapsed):
+        if elapsed > CONF.archive_batch_time:
+            self.batch_size = max(1, self.batch_size // 2)
+        else:
+            self.batch_size = min(CONF.archive_max_batch_size,
+                                  self.batch_size * 2)
+        self.sleep(elapsed * CONF.archive_sleep_ratio)
+        self._wait_for_replicas()
+
+    def archive_batch(self, tablename):
+        """Archive a batch of the deleted rows of a table.
+
+        :returns: number of rows archived, None when the table is drained
+        """
+        marker = self.watermarks.get(tablename)
+        start = time.time()
+        try:
+            result = db.archive_deleted_rows_batch(self.context, tablename,
+                                                   self.batch_size,
+                                                   marker=marker)
+        except exception.ArchiveRowReferenced as e:
+            if self.batch_size > 1:
+                # Retry smaller batches until the referenced row is alone.
+                self.batch_size = max(1, self.batch_size // 2)
+                return 0
+            LOG.warn(_("Skipping deleted row %(key)s of table %(table)s "
+                       "which is still referenced"), e.kwargs)
+            result = {'rows': 0, 'marker': e.kwargs['key']}
+        else:
+            self._throttle(time.time() - start)
+        if result['marker'] == marker:
+            return None
+        self.watermarks[tablename] = result['marker']
+        self._save_watermarks()
+        self.rows[tablename] += result['rows']
+        return result['rows']
+
+    def archive_table(self, tablename):
+        """Archive all the deleted rows of a table.
+
+        :returns: number of rows archived
+        """
+        rows = 0
+        while True:
+            batch = self.archive_batch(tablename)
+            if batch is None:
+                break
+            rows += batch
+        # The rows deleted behind the watermark are archived by the next
+        # pass.
+        if self.watermarks.pop(tablename, None) is not None:
+            self._save_watermarks()
+        return rows
+
+    def archive_pass(self):
+        """Archive the deleted rows of every table.
+
+        :returns: number of rows archived
+        """
+        start = time.time()
+        self.rows.clear()
+        for tablename in db.archive_table_names(self.context):
+            self.archive_table(tablename)
+        rows = sum(self.rows.itervalues())
+        elapsed = time.time() - start
+        if rows:
+            LOG.info(_("Archived %(rows)d deleted rows in %(time).1fs "
+                       "(%(rate).1f rows/s): %(tables)s"),
+                     {'rows': rows, 'time': elapsed,
+                      'rate': rows / max(elapsed, 0.001),
+                      'tables': ', '.join('%s=%d' % item for item in
+                                          sorted(self.rows.iteritems())
+                                          if item[1])})
+        return rows
+
+    def run(self):
+        """Archive the deleted rows continuously."""
+        while True:
+            try:
+                rows = self.archive_pass()
+            except Exception:
+                LOG.exception(_("Archiving pass failed"))
+                rows = 0
+            if not rows:
+                self.sleep(CONF.archive_interval)
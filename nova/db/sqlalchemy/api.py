@@ -21,7 +21,9 @@ import collections
 import copy
 import datetime
 import functools
+import inspect
 import sys
+import threading
 import time
 import uuid
 
@@ -29,6 +31,7 @@ from oslo.config import cfg
 import six
 from sqlalchemy import and_
 from sqlalchemy import Boolean
+from sqlalchemy import event
 from sqlalchemy.exc import DataError
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.exc import NoSuchTableError
@@ -41,7 +44,9 @@ from sqlalchemy.orm import joinedload_all
 from sqlalchemy.orm import noload
 from sqlalchemy.schema import Table
 from sqlalchemy.sql.expression import asc
+from sqlalchemy.sql.expression import case
 from sqlalchemy.sql.expression import desc
+from sqlalchemy.sql.expression import literal
 from sqlalchemy.sql.expression import select
 from sqlalchemy.sql import func
 from sqlalchemy import String
@@ -57,6 +62,7 @@ from nova.openstack.common.db.sqlalchemy import session as db_session
 from nova.openstack.common.db.sqlalchemy import utils as sqlalchemyutils
 from nova.openstack.common import excutils
 from nova.openstack.common.gettextutils import _
+from nova.openstack.common import local
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova.openstack.common import uuidutils
@@ -68,6 +74,16 @@ db_opts = [
                help='When set, compute API will consider duplicate hostnames '
                     'invalid within the specified scope, regardless of case. '
                     'Should be empty, "project" or "global".'),
+    cfg.IntOpt('quota_reserve_attempts',
+               default=10,
+               help='Number of compare-and-swap attempts of an optimistic '
+                    'quota reservation before it falls back to locking '
+                    'the quota usages'),
+    cfg.IntOpt('quota_usage_ledger_size',
+               default=1000,
+               help='Number of projects whose quota usages are kept in '
+                    'memory by each worker for the optimistic quota '
+                    'reservations'),
 ]
 
 connection_opts = [
@@ -75,6 +91,23 @@ connection_opts = [
                secret=True,
                help='The SQLAlchemy connection string used to connect to the '
                     'slave database'),
+    cfg.MultiStrOpt('replica_connection',
+                    default=[],
+                    secret=True,
+                    help='The SQLAlchemy connection strings of the replica '
+                         'databases the read-only DB API calls are routed '
+                         'to. The slave_connection is used as a replica '
+                         'too. (multi valued)'),
+    cfg.IntOpt('replica_max_lag',
+               default=30,
+               help='Maximum replication lag in seconds of a replica '
+                    'database to route reads to it. It is also how long '
+                    'the reads of a request go to the primary database '
+                    'after the request wrote to it'),
+    cfg.IntOpt('replica_check_interval',
+               default=10,
+               help='Interval in seconds between two checks of the '
+                    'replication lag of a replica database'),
 ]
 
 CONF = cfg.CONF
@@ -89,28 +122,129 @@ LOG = logging.getLogger(__name__)
 
 
 _MASTER_FACADE = None
-_SLAVE_FACADE = None
+_REPLICA_POOL = None
+
+# Routing of the current greenthread to the replica databases.
+_ROUTING = threading.local()
+
+_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def _replica_connections():
+    connections = list(CONF.database.replica_connection)
+    if CONF.database.slave_connection:
+        connections.append(CONF.database.slave_connection)
+    return connections
+
+
+def _record_write(conn, cursor, statement, parameters, exec_context,
+                  executemany):
+    """Remember when the current request last wrote to the primary."""
+    if statement.lstrip()[:7].upper().startswith(_WRITE_STATEMENTS):
+        request_context = getattr(local.store, 'context', None)
+        if request_context is not None:
+            request_context.db_last_write = time.time()
+
+
+def _replication_lag(engine):
+    """Return the replication lag of a replica in seconds.
+
+    None is returned when the replication is stopped.
+    """
+    if engine.dialect.name == 'mysql':
+        status = engine.execute('SHOW SLAVE STATUS').first()
+        return status['Seconds_Behind_Master'] if status else 0
+    elif engine.dialect.name == 'postgresql':
+        return engine.execute(
+            'SELECT COALESCE(EXTRACT(EPOCH FROM '
+            'now() - pg_last_xact_replay_timestamp()), 0)').scalar()
+    engine.execute('SELECT 1')
+    return 0
+
+
+class _Replica(object):
+    """A replica database and its last measured replication lag."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._facade = None
+        self.lag = None
+        self.checked_at = None
+
+    @property
+    def facade(self):
+        if self._facade is None:
+            self._facade = db_session.EngineFacade(
+                self.connection, **dict(CONF.database.iteritems()))
+        return self._facade
+
+    def is_usable(self):
+        if (self.checked_at is None or
+                time.time() - self.checked_at >=
+                CONF.database.replica_check_interval):
+            try:
+                self.lag = _replication_lag(self.facade.get_engine())
+            except Exception as e:
+                LOG.warn(_("Replica database check failed: %s"), e)
+                self.lag = None
+            self.checked_at = time.time()
+        return (self.lag is not None and
+                self.lag <= CONF.database.replica_max_lag)
+
+    def failed(self):
+        self.lag = None
+        self.checked_at = time.time()
+
+
+class _ReplicaPool(object):
+    """Replica databases the read-only calls are balanced over.
+
+    Replicas are skipped while they lag by more than replica_max_lag or
+    after a connection failure, until their next check.
+    """
+
+    def __init__(self, connections):
+        self.replicas = [_Replica(connection) for connection in connections]
+        self._next = 0
+
+    def get_replica(self):
+        """Return the next usable replica, or None to use the primary."""
+        for i in xrange(len(self.replicas)):
+            replica = self.replicas[(self._next + i) % len(self.replicas)]
+            if replica.is_usable():
+                self._next = (self._next + i + 1) % len(self.replicas)
+                return replica
+        return None
+
+
+def _get_replica_pool():
+    global _REPLICA_POOL
+
+    if _REPLICA_POOL is None:
+        _REPLICA_POOL = _ReplicaPool(_replica_connections())
+    return _REPLICA_POOL
 
 
 def _create_facade_lazily(use_slave=False):
     global _MASTER_FACADE
-    global _SLAVE_FACADE
-
-    return_slave = use_slave and CONF.database.slave_connection
-    if not return_slave:
-        if _MASTER_FACADE is None:
-            _MASTER_FACADE = db_session.EngineFacade(
-                CONF.database.connection,
-                **dict(CONF.database.iteritems())
-            )
-        return _MASTER_FACADE
-    else:
-        if _SLAVE_FACADE is None:
-            _SLAVE_FACADE = db_session.EngineFacade(
-                CONF.database.slave_connection,
-                **dict(CONF.database.iteritems())
-            )
-        return _SLAVE_FACADE
+
+    # The replica chosen for the current read-only call, False when it
+    # uses the primary.
+    replica = getattr(_ROUTING, 'replica', None)
+    if replica is None and use_slave:
+        replica = _get_replica_pool().get_replica()
+    if replica:
+        return replica.facade
+
+    if _MASTER_FACADE is None:
+        _MASTER_FACADE = db_session.EngineFacade(
+            CONF.database.connection,
+            **dict(CONF.database.iteritems())
+        )
+        if _replica_connections():
+            event.listen(_MASTER_FACADE.get_engine(),
+                         'before_cursor_execute', _record_write)
+    return _MASTER_FACADE
 
 
 def get_engine(use_slave=False):
@@ -123,6 +257,62 @@ def get_session(use_slave=False, **kwargs):
     return facade.get_session(**kwargs)
 
 
+def read_replica(f):
+    """Decorator declaring a DB API call as read-only.
+
+    When replica databases are configured, the queries of the call are
+    routed to a replica, unless the request context wrote to the primary
+    in the last replica_max_lag seconds so a request reads its own
+    writes. The call is retried on the primary if the replica fails.
+
+    A call taking a use_slave argument is only routed to a replica when
+    its caller passes use_slave=True. The other decorated calls are
+    listings which tolerate the replica lag: the service liveness and the
+    HA recovery must never be decided from a replica. The writes are only
+    recorded on the context of the current request, they are not known
+    to the services it calls over RPC.
+
+    The first argument to the wrapped function must be the context.
+    """
+    argnames = inspect.getargspec(f).args
+    use_slave_index = (argnames.index('use_slave')
+                       if 'use_slave' in argnames else None)
+
+    def use_slave(args, kwargs):
+        # args excludes the context.
+        if use_slave_index is None:
+            return True
+        if 'use_slave' in kwargs:
+            return kwargs['use_slave']
+        return (len(args) >= use_slave_index and
+                args[use_slave_index - 1])
+
+    @functools.wraps(f)
+    def wrapper(context, *args, **kwargs):
+        if (getattr(_ROUTING, 'replica', None) is not None or
+                not _replica_connections() or
+                not use_slave(args, kwargs) or
+                time.time() - getattr(context, 'db_last_write', 0) <
+                CONF.database.replica_max_lag):
+            return f(context, *args, **kwargs)
+
+        _ROUTING.replica = _get_replica_pool().get_replica()
+        try:
+            return f(context, *args, **kwargs)
+        except db_exc.DBConnectionError:
+            if not _ROUTING.replica:
+                raise
+            LOG.warn(_("Replica database failed, retrying "
+                       "'%(func_name)s' on the primary"),
+                     {'func_name': f.__name__})
+            _ROUTING.replica.failed()
+            _ROUTING.replica = False
+            return f(context, *args, **kwargs)
+        finally:
+            _ROUTING.replica = None
+    return wrapper
+
+
 _SHADOW_TABLE_PREFIX = 'shadow_'
 _DEFAULT_QUOTA_NAME = 'default'
 PER_PROJECT_QUOTAS = ['fixed_ips', 'floating_ips', 'networks']
@@ -536,6 +726,76 @@ def service_update(context, service_id, values):
     return service_ref
 
 
+# Maximum number of bound parameters of a multi-row UPDATE.
+_UPDATE_ALL_MAX_PARAMS = 900
+
+
+def _update_all_by_id(model, updates):
+    """Apply a batch of updates to the rows of a model in one transaction.
+
+    :param updates: dict of the values to update keyed by row id. Values
+                    carrying an updated_at are only written to a row not
+                    updated since.
+    :returns: set of the ids of the rows not found
+
+    The rows updating the same columns are written by a single UPDATE,
+    the values differing between the rows being selected by a CASE on
+    the id, so the number of statements does not grow with the number of
+    rows.
+    """
+    table = model.__table__
+    now = timeutils.utcnow()
+    rows_by_columns = collections.defaultdict(dict)
+    for row_id, values in updates.iteritems():
+        conditional = values.get('updated_at') is not None
+        values = dict((key, value) for key, value in values.iteritems()
+                      if key in table.c and key != 'id')
+        values.setdefault('updated_at', now)
+        convert_objects_related_datetimes(values, 'created_at', 'deleted_at',
+                                          'updated_at')
+        rows_by_columns[(tuple(sorted(values)), conditional)][row_id] = values
+
+    session = get_session()
+    with session.begin():
+        for (columns, conditional), rows in rows_by_columns.iteritems():
+            ids = sorted(rows)
+            step = max(1, _UPDATE_ALL_MAX_PARAMS // (2 * len(columns) + 1))
+            for start in xrange(0, len(ids), step):
+                chunk = ids[start:start + step]
+                values = {}
+                for column in columns:
+                    column_values = [rows[row_id][column] for row_id in chunk]
+                    if all(value == column_values[0]
+                           for value in column_values):
+                        values[column] = column_values[0]
+                        continue
+                    values[column] = case(
+                        [(table.c.id == row_id,
+                          literal(rows[row_id][column],
+                                  type_=table.c[column].type))
+                         for row_id in chunk],
+                        else_=table.c[column])
+                query = table.update().\
+                            where(table.c.id.in_(chunk)).\
+                            where(table.c.deleted == 0)
+                if conditional:
+                    # Skip the rows updated since, by the updates flushed
+                    # first by another process.
+                    query = query.where(
+                        or_(table.c.updated_at == None,
+                            table.c.updated_at < values['updated_at']))
+                session.execute(query.values(values))
+        found = session.execute(select([table.c.id]).
+                                where(table.c.id.in_(list(updates))).
+                                where(table.c.deleted == 0)).fetchall()
+    return set(updates) - set(row[0] for row in found)
+
+
+@require_admin_context
+def service_update_all(context, updates):
+    return _update_all_by_id(models.Service, updates)
+
+
 ###################
 
 def compute_node_get(context, compute_id):
@@ -567,7 +827,7 @@ def compute_node_get_by_service_id(context, service_id):
 
 
 @require_admin_context
-def compute_node_get_all(context, no_date_fields):
+def compute_node_get_all(context, no_date_fields, updated_since=None):
 
     # NOTE(msdubov): Using lower-level 'select' queries and joining the tables
     #                manually here allows to gain 3x speed-up and to have 5x
@@ -586,8 +846,22 @@ def compute_node_get_all(context, no_date_fields):
         def filter_columns(table):
             return [c for c in table.c if c.name not in redundant_columns]
 
+        live = compute_node.c.deleted == 0
+        unchanged_rows = []
+        if updated_since is not None:
+            changed = or_(compute_node.c.updated_at == None,
+                          compute_node.c.updated_at >= updated_since,
+                          compute_node.c.created_at >= updated_since)
+            # Only the keys of the nodes not updated since are returned.
+            unchanged_query = select([compute_node.c.id,
+                                      compute_node.c.service_id]).\
+                                where(live & ~changed).\
+                                order_by(compute_node.c.service_id)
+            unchanged_rows = conn.execute(unchanged_query).fetchall()
+            live = live & changed
+
         compute_node_query = select(filter_columns(compute_node)).\
-                                where(compute_node.c.deleted == 0).\
+                                where(live).\
                                 order_by(compute_node.c.service_id)
         compute_node_rows = conn.execute(compute_node_query).fetchall()
 
@@ -607,6 +881,12 @@ def compute_node_get_all(context, no_date_fields):
         node = dict(proxy.items())
         node['service'] = services.get(proxy['service_id'])
 
+        compute_nodes.append(node)
+    for proxy in unchanged_rows:
+        node = dict(proxy.items())
+        node['service'] = services.get(proxy['service_id'])
+        node['unchanged'] = True
+
         compute_nodes.append(node)
 
     return compute_nodes
@@ -655,6 +935,11 @@ def compute_node_update(context, compute_id, values):
     return compute_ref
 
 
+@require_admin_context
+def compute_node_update_all(context, updates):
+    return _update_all_by_id(models.ComputeNode, updates)
+
+
 @require_admin_context
 def compute_node_delete(context, compute_id):
     """Delete a ComputeNode record."""
@@ -1796,6 +2081,7 @@ def _manual_join_columns(columns_to_join):
 
 
 @require_context
+@read_replica
 def instance_get_all(context, columns_to_join=None):
     if columns_to_join is None:
         columns_to_join = ['info_cache', 'security_groups']
@@ -1816,6 +2102,7 @@ def instance_get_all(context, columns_to_join=None):
 
 
 @require_context
+@read_replica
 def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
                                 limit=None, marker=None, columns_to_join=None,
                                 use_slave=False):
@@ -1853,8 +2140,6 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
                          vm_state is SOFT_DELETED.
     """
 
-    sort_fn = {'desc': desc, 'asc': asc}
-
     if CONF.database.slave_connection == '':
         use_slave = False
 
@@ -1870,9 +2155,6 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
     for column in columns_to_join:
         query_prefix = query_prefix.options(joinedload(column))
 
-    query_prefix = query_prefix.order_by(sort_fn[sort_dir](
-            getattr(models.Instance, sort_key)))
-
     # Make a copy of the filters dictionary to use going forward, as we'll
     # be modifying it and we shouldn't affect the caller's use of it.
     filters = filters.copy()
@@ -1939,20 +2221,78 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
                               filters)
 
     # paginate query
+    sort_keys = [sort_key]
+    for key in ('created_at', 'id'):
+        if key not in sort_keys:
+            sort_keys.append(key)
     if marker is not None:
-        try:
-            marker = _instance_get_by_uuid(context, marker, session=session)
-        except exception.InstanceNotFound:
-            raise exception.MarkerNotFound(marker)
-    query_prefix = sqlalchemyutils.paginate_query(query_prefix,
-                           models.Instance, limit,
-                           [sort_key, 'created_at', 'id'],
-                           marker=marker,
-                           sort_dir=sort_dir)
+        marker = _instance_get_marker_values(context, marker, sort_keys,
+                                             session)
+    query_prefix = _keyset_paginate(query_prefix, models.Instance, limit,
+                                    sort_keys, marker, sort_dir)
 
     return _instances_fill_metadata(context, query_prefix.all(), manual_joins)
 
 
+def _instance_get_marker_values(context, marker, sort_keys, session):
+    """Return the values of the sort keys of the marker instance.
+
+    Only the sort key columns of the marker are loaded.
+    """
+    try:
+        columns = [getattr(models.Instance, key) for key in sort_keys]
+    except AttributeError:
+        raise sqlalchemyutils.InvalidSortKey()
+    values = model_query(context, *columns, session=session,
+                         project_only=True, base_model=models.Instance).\
+                filter_by(uuid=marker).\
+                first()
+    if values is None:
+        raise exception.MarkerNotFound(marker)
+    return list(values)
+
+
+def _keyset_paginate(query, model, limit, sort_keys, marker_values=None,
+                     sort_dir='asc'):
+    """Returns a query sorted by sort_keys and seeking past the marker.
+
+    The rows following the marker values in the (k1, k2, ...) order are
+    selected with (k1 >= X1) and ((k1 > X1) or (k1 == X1 and k2 > X2) or
+    ...). The leading range on k1 lets the database seek into an index
+    starting with the filtered columns and k1 instead of scanning the
+    rows before the marker.
+    """
+    try:
+        sort_attrs = [getattr(model, key) for key in sort_keys]
+    except AttributeError:
+        raise sqlalchemyutils.InvalidSortKey()
+    sort_fn = {'desc': desc, 'asc': asc}[sort_dir]
+    query = query.order_by(*[sort_fn(attr) for attr in sort_attrs])
+
+    if marker_values is not None:
+        criteria_list = []
+        for i, attr in enumerate(sort_attrs):
+            crit_attrs = [sort_attrs[j] == marker_values[j]
+                          for j in range(i)]
+            if sort_dir == 'desc':
+                crit_attrs.append(attr < marker_values[i])
+            else:
+                crit_attrs.append(attr > marker_values[i])
+            criteria_list.append(and_(*crit_attrs))
+        criteria = or_(*criteria_list)
+        if marker_values[0] is not None:
+            if sort_dir == 'desc':
+                seek = sort_attrs[0] <= marker_values[0]
+            else:
+                seek = sort_attrs[0] >= marker_values[0]
+            criteria = and_(seek, criteria)
+        query = query.filter(criteria)
+
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
 def tag_filter(context, query, model, model_metadata,
                model_uuid, filters):
     """Applies tag filtering to a query.
@@ -2045,6 +2385,7 @@ def regex_filter(query, model, filters):
 
 
 @require_context
+@read_replica
 def instance_get_active_by_window_joined(context, begin, end=None,
                                          project_id=None, host=None):
     """Return instances and joins that were active during window."""
@@ -2080,6 +2421,7 @@ def _instance_get_all_query(context, project_only=False,
 
 
 @require_admin_context
+@read_replica
 def instance_get_all_by_host(context, host,
                              columns_to_join=None,
                              use_slave=False):
@@ -2106,6 +2448,7 @@ def _instance_get_all_uuids_by_host(context, host, session=None):
 
 
 @require_admin_context
+@read_replica
 def instance_get_all_by_host_and_node(context, host, node):
     return _instances_fill_metadata(context,
         _instance_get_all_query(context, joins=[]).filter_by(host=host).
@@ -2113,6 +2456,7 @@ def instance_get_all_by_host_and_node(context, host, node):
 
 
 @require_admin_context
+@read_replica
 def instance_get_all_by_host_and_not_type(context, host, type_id=None):
     return _instances_fill_metadata(context,
         _instance_get_all_query(context).filter_by(host=host).
@@ -2165,6 +2509,7 @@ def instance_floating_address_get_all(context, instance_uuid):
 
 # NOTE(hanlind): This method can be removed as conductor RPC API moves to v2.0.
 @require_admin_context
+@read_replica
 def instance_get_all_hung_in_rebooting(context, reboot_window):
     reboot_window = (timeutils.utcnow() -
                      datetime.timedelta(seconds=reboot_window))
@@ -2990,6 +3335,7 @@ def quota_usage_update(context, project_id, user_id, resource, **kwargs):
     for key in ['in_use', 'reserved', 'until_refresh']:
         if key in kwargs:
             updates[key] = kwargs[key]
+    updates['version'] = models.QuotaUsage.version + 1
 
     result = model_query(context, models.QuotaUsage, read_deleted="no").\
                      filter_by(project_id=project_id).\
@@ -3035,17 +3381,25 @@ def _get_project_user_quota_usages(context, session, project_id,
                    filter_by(project_id=project_id).\
                    with_lockmode('update').\
                    all()
+    return _sum_quota_usages(rows, user_id)
+
+
+def _sum_quota_usages(rows, user_id):
+    """Return the usages of a project summed by resource and the usage
+    rows of the user, by resource.
+    """
     proj_result = dict()
     user_result = dict()
     # Get the total count of in_use,reserved
     for row in rows:
-        proj_result.setdefault(row.resource,
+        proj_result.setdefault(row['resource'],
                                dict(in_use=0, reserved=0, total=0))
-        proj_result[row.resource]['in_use'] += row.in_use
-        proj_result[row.resource]['reserved'] += row.reserved
-        proj_result[row.resource]['total'] += (row.in_use + row.reserved)
-        if row.user_id is None or row.user_id == user_id:
-            user_result[row.resource] = row
+        proj_result[row['resource']]['in_use'] += row['in_use']
+        proj_result[row['resource']]['reserved'] += row['reserved']
+        proj_result[row['resource']]['total'] += (row['in_use'] +
+                                                  row['reserved'])
+        if row['user_id'] is None or row['user_id'] == user_id:
+            user_result[row['resource']] = row
     return proj_result, user_result
 
 
@@ -3172,15 +3526,8 @@ def quota_reserve(context, resources, project_quotas, user_quotas, deltas,
         #            If a project has gone over quota, we want them to
         #            be able to reduce their usage without any
         #            problems.
-        for key, value in user_usages.items():
-            if key not in project_usages:
-                project_usages[key] = value
-        overs = [res for res, delta in deltas.items()
-                 if user_quotas[res] >= 0 and delta >= 0 and
-                 (project_quotas[res] < delta +
-                  project_usages[res]['total'] or
-                  user_quotas[res] < delta +
-                  user_usages[res].total)]
+        overs = _get_over_quota(deltas, project_quotas, user_quotas,
+                                project_usages, user_usages)
 
         # NOTE(Vek): The quota check needs to be in the transaction,
         #            but the transaction doesn't fail just because
@@ -3225,39 +3572,271 @@ def quota_reserve(context, resources, project_quotas, user_quotas, deltas,
         LOG.warning(_("Change will make usage less than 0 for the following "
                       "resources: %s"), unders)
     if overs:
-        if project_quotas == user_quotas:
-            usages = project_usages
-        else:
-            usages = user_usages
-        usages = dict((k, dict(in_use=v['in_use'], reserved=v['reserved']))
-                      for k, v in usages.items())
-        headroom = dict((res, user_quotas[res] -
-                             (usages[res]['in_use'] + usages[res]['reserved']))
-                        for res in user_quotas.keys())
-
-        # If quota_cores is unlimited [-1]:
-        # - set cores headroom based on instances headroom:
-        if user_quotas.get('cores') == -1:
-            if deltas['cores']:
-                hc = headroom['instances'] * deltas['cores']
-                headroom['cores'] = hc / deltas['instances']
-            else:
-                headroom['cores'] = headroom['instances']
-
-        # If quota_ram is unlimited [-1]:
-        # - set ram headroom based on instances headroom:
-        if user_quotas.get('ram') == -1:
-            if deltas['ram']:
-                hr = headroom['instances'] * deltas['ram']
-                headroom['ram'] = hr / deltas['instances']
-            else:
-                headroom['ram'] = headroom['instances']
-        raise exception.OverQuota(overs=sorted(overs), quotas=user_quotas,
-                                  usages=usages, headroom=headroom)
+        _raise_over_quota(overs, project_quotas, user_quotas, deltas,
+                          project_usages, user_usages)
 
     return reservations
 
 
+class _QuotaUsageConflict(Exception):
+    """A quota usage was updated since it was read."""
+
+
+class _QuotaUsageLedger(object):
+    """Last known quota usages of the projects reserved by this worker.
+
+    The optimistic reservations check the quotas against the ledger and
+    swap the usages without reading them first. A stale entry only costs
+    a failed swap, after which the usages are read again. The least
+    recently used projects are evicted beyond quota_usage_ledger_size.
+    """
+
+    def __init__(self):
+        self._usages = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, project_id):
+        with self._lock:
+            rows = self._usages.pop(project_id, None)
+            if rows is None:
+                return None
+            self._usages[project_id] = rows
+            return [dict(row) for row in rows]
+
+    def put(self, project_id, rows):
+        with self._lock:
+            self._usages.pop(project_id, None)
+            self._usages[project_id] = rows
+            while len(self._usages) > CONF.quota_usage_ledger_size:
+                self._usages.popitem(last=False)
+
+    def invalidate(self, project_id):
+        with self._lock:
+            self._usages.pop(project_id, None)
+
+
+_QUOTA_USAGE_LEDGER = _QuotaUsageLedger()
+
+
+@event.listens_for(models.QuotaUsage, 'before_update')
+def _bump_quota_usage_version(mapper, connection, target):
+    """Bump the version of the quota usages updated through the ORM.
+
+    The version is incremented in the UPDATE rather than checked, so the
+    locking quota paths are not affected by the optimistic reservations.
+    """
+    target.version = models.QuotaUsage.version + 1
+
+_QUOTA_USAGE_FIELDS = ('id', 'user_id', 'resource', 'in_use', 'reserved',
+                       'until_refresh', 'updated_at', 'version')
+
+
+def _quota_usage_snapshot(context, project_id):
+    rows = model_query(context, models.QuotaUsage, read_deleted="no").\
+                   filter_by(project_id=project_id).\
+                   all()
+    return [dict((field, row[field]) for field in _QUOTA_USAGE_FIELDS)
+            for row in rows]
+
+
+def _quota_usages_need_refresh(deltas, user_usages, max_age):
+    for resource in deltas:
+        usage = user_usages.get(resource)
+        if usage is None or usage['in_use'] < 0:
+            return True
+        if usage['until_refresh'] is not None:
+            # The countdown of the usage reaches 0 with this reservation.
+            if usage['until_refresh'] <= 1:
+                return True
+        elif max_age and (usage['updated_at'] is None or
+                          (usage['updated_at'] -
+                           timeutils.utcnow()).seconds >= max_age):
+            return True
+    return False
+
+
+def _quota_reserve_swap(rows, project_quotas, user_quotas, deltas, expire,
+                        max_age, project_id, user_id):
+    """Reserve the deltas against a snapshot of the project usages.
+
+    The reserved quantity of a usage is incremented, and its until_refresh
+    countdown decremented, by a single UPDATE which also checks that the
+    usages its quotas were checked against are still at the version read,
+    and bumps their version. The usages of the users inserted since the
+    snapshot are caught by a count of the project usages in the same
+    transaction.
+
+    :returns: the reservation uuids or None if a usage needs a refresh,
+              which is left to quota_reserve
+    :raises: _QuotaUsageConflict if a usage was updated since read
+    """
+    for row in rows:
+        row['total'] = row['in_use'] + row['reserved']
+    project_usages, user_usages = _sum_quota_usages(rows, user_id)
+    if _quota_usages_need_refresh(deltas, user_usages, max_age):
+        return None
+    overs = _get_over_quota(deltas, project_quotas, user_quotas,
+                            project_usages, user_usages)
+    if overs:
+        _raise_over_quota(overs, project_quotas, user_quotas, deltas,
+                          project_usages, user_usages)
+
+    table = models.QuotaUsage.__table__
+    reservations = []
+    checked = []
+    session = get_session()
+    with session.begin():
+        for res, delta in deltas.items():
+            usage = user_usages[res]
+            swapped = []
+            if user_quotas[res] >= 0 and delta >= 0:
+                # The project quota is checked against the usages of all
+                # the users of the project.
+                if project_quotas[res] >= 0:
+                    checked.append(res)
+                swapped = [row for row in rows if row is usage or
+                           (project_quotas[res] >= 0 and
+                            row['resource'] == res)]
+                condition = or_(*[and_(table.c.id == row['id'],
+                                       table.c.version == row['version'])
+                                  for row in swapped])
+            elif delta > 0 or usage['until_refresh'] is not None:
+                swapped = [usage]
+                condition = table.c.id == usage['id']
+            if swapped:
+                values = {'reserved': table.c.reserved +
+                          case([(table.c.id == usage['id'],
+                                 max(delta, 0))], else_=0),
+                          'version': table.c.version + 1}
+                if usage['until_refresh'] is not None:
+                    values['until_refresh'] = case(
+                        [(table.c.id == usage['id'],
+                          table.c.until_refresh - 1)],
+                        else_=table.c.until_refresh)
+                result = session.execute(
+                    table.update().
+                    where(table.c.deleted == 0).
+                    where(condition).
+                    values(values))
+                if result.rowcount != len(swapped):
+                    raise _QuotaUsageConflict()
+                for row in swapped:
+                    row['version'] += 1
+                usage['reserved'] += max(delta, 0)
+                if usage['until_refresh'] is not None:
+                    usage['until_refresh'] -= 1
+            reservations.append({'uuid': str(uuid.uuid4()),
+                                 'usage_id': usage['id'],
+                                 'project_id': project_id,
+                                 'user_id': user_id,
+                                 'resource': res,
+                                 'delta': delta,
+                                 'expire': expire,
+                                 'created_at': timeutils.utcnow(),
+                                 'deleted': 0})
+        if checked:
+            # A concurrent quota_reserve inserting a usage of another
+            # user locks the project usages, so it either committed
+            # before the UPDATEs above and is counted here, or waits for
+            # this transaction and sees its reservations.
+            count = session.execute(
+                select([func.count(table.c.id)]).
+                where(table.c.project_id == project_id).
+                where(table.c.deleted == 0).
+                where(table.c.resource.in_(checked))).scalar()
+            if count != len([row for row in rows
+                             if row['resource'] in checked]):
+                raise _QuotaUsageConflict()
+        session.execute(models.Reservation.__table__.insert(), reservations)
+    return [reservation['uuid'] for reservation in reservations]
+
+
+@require_context
+def quota_reserve_optimistic(context, resources, project_quotas,
+                             user_quotas, deltas, expire, until_refresh,
+                             max_age, project_id=None, user_id=None):
+    if project_id is None:
+        project_id = context.project_id
+    if user_id is None:
+        user_id = context.user_id
+
+    for attempt in xrange(CONF.quota_reserve_attempts):
+        rows = _QUOTA_USAGE_LEDGER.get(project_id)
+        from_ledger = rows is not None
+        if not from_ledger:
+            rows = _quota_usage_snapshot(context, project_id)
+        try:
+            reservations = _quota_reserve_swap(rows, project_quotas,
+                                               user_quotas, deltas, expire,
+                                               max_age, project_id, user_id)
+        except _QuotaUsageConflict:
+            _QUOTA_USAGE_LEDGER.invalidate(project_id)
+            continue
+        except exception.OverQuota:
+            _QUOTA_USAGE_LEDGER.invalidate(project_id)
+            if from_ledger:
+                # Check the quotas against the current usages.
+                continue
+            raise
+        if reservations is None:
+            break
+        _QUOTA_USAGE_LEDGER.put(project_id, rows)
+        return reservations
+
+    # The usages need a refresh or are too contended.
+    _QUOTA_USAGE_LEDGER.invalidate(project_id)
+    return quota_reserve(context, resources, project_quotas, user_quotas,
+                         deltas, expire, until_refresh, max_age,
+                         project_id=project_id, user_id=user_id)
+
+
+def _get_over_quota(deltas, project_quotas, user_quotas, project_usages,
+                    user_usages):
+    """Return the resources the deltas would take over quota."""
+    for key, value in user_usages.items():
+        if key not in project_usages:
+            project_usages[key] = value
+    return [res for res, delta in deltas.items()
+            if user_quotas[res] >= 0 and delta >= 0 and
+            (project_quotas[res] < delta +
+             project_usages[res]['total'] or
+             user_quotas[res] < delta +
+             user_usages[res]['total'])]
+
+
+def _raise_over_quota(overs, project_quotas, user_quotas, deltas,
+                      project_usages, user_usages):
+    if project_quotas == user_quotas:
+        usages = project_usages
+    else:
+        usages = user_usages
+    usages = dict((k, dict(in_use=v['in_use'], reserved=v['reserved']))
+                  for k, v in usages.items())
+    headroom = dict((res, user_quotas[res] -
+                         (usages[res]['in_use'] + usages[res]['reserved']))
+                    for res in user_quotas.keys())
+
+    # If quota_cores is unlimited [-1]:
+    # - set cores headroom based on instances headroom:
+    if user_quotas.get('cores') == -1:
+        if deltas['cores']:
+            hc = headroom['instances'] * deltas['cores']
+            headroom['cores'] = hc / deltas['instances']
+        else:
+            headroom['cores'] = headroom['instances']
+
+    # If quota_ram is unlimited [-1]:
+    # - set ram headroom based on instances headroom:
+    if user_quotas.get('ram') == -1:
+        if deltas['ram']:
+            hr = headroom['instances'] * deltas['ram']
+            headroom['ram'] = hr / deltas['instances']
+        else:
+            headroom['ram'] = headroom['instances']
+    raise exception.OverQuota(overs=sorted(overs), quotas=user_quotas,
+                              usages=usages, headroom=headroom)
+
+
 def _quota_reservations_query(session, context, reservations):
     """Return the relevant reservations."""
 
@@ -3779,7 +4358,8 @@ def security_group_ensure_default(context):
                                     None,
                                     session=session)
             else:
-                usage.update({'in_use': int(usage.first().in_use) + 1})
+                usage.update({'in_use': int(usage.first().in_use) + 1,
+                              'version': models.QuotaUsage.version + 1})
 
             default_rules = _security_group_rule_get_default_query(context,
                                 session=session).all()
@@ -4065,6 +4645,7 @@ def migration_get_unconfirmed_by_dest_compute(context, confirm_window,
 
 
 @require_admin_context
+@read_replica
 def migration_get_in_progress_by_host_and_node(context, host, node):
 
     return model_query(context, models.Migration).\
@@ -4760,6 +5341,7 @@ def bw_usage_get(context, uuid, start_period, mac, use_slave=False):
 
 
 @require_context
+@read_replica
 def bw_usage_get_by_uuids(context, uuids, start_period):
     return model_query(context, models.BandwidthUsage, read_deleted="yes").\
                    filter(models.BandwidthUsage.uuid.in_(uuids)).\
@@ -5157,6 +5739,7 @@ def aggregate_delete(context, aggregate_id):
                     soft_delete()
 
 
+@read_replica
 def aggregate_get_all(context):
     return _aggregate_get_query(context, models.Aggregate).all()
 
@@ -5539,6 +6122,79 @@ def task_log_end_task(context, task_name, period_beginning, period_ending,
             raise exception.TaskNotRunning(task_name=task_name, host=host)
 
 
+@require_admin_context
+def kvmha_evacuation_create(context, values):
+    evacuation = models.KvmhaEvacuation()
+    evacuation.update(values)
+    evacuation.save()
+    return evacuation
+
+
+@require_admin_context
+def kvmha_evacuation_update(context, evacuation_id, values):
+    session = get_session()
+    with session.begin():
+        evacuation = model_query(context, models.KvmhaEvacuation,
+                                 session=session, read_deleted="no").\
+                        filter_by(id=evacuation_id).\
+                        first()
+        if not evacuation:
+            raise exception.NotFound(_("Evacuation %s not found") %
+                                     evacuation_id)
+        evacuation.update(values)
+    return evacuation
+
+
+@require_admin_context
+def kvmha_evacuation_get_all_by_source_host(context, source_host,
+                                            statuses=None):
+    query = model_query(context, models.KvmhaEvacuation, read_deleted="no").\
+                filter_by(source_host=source_host)
+    if statuses:
+        query = query.filter(models.KvmhaEvacuation.status.in_(statuses))
+    return query.order_by(desc(models.KvmhaEvacuation.priority),
+                          asc(models.KvmhaEvacuation.id)).all()
+
+
+@require_admin_context
+def kvmha_host_claim(context, host, owner, timeout):
+    now = timeutils.utcnow()
+    expired = now - datetime.timedelta(seconds=timeout)
+    values = {'owner': owner, 'updated_at': now}
+    session = get_session()
+    with session.begin():
+        # Compare and swap: take over the claim only if we hold it
+        # already or its owner stopped renewing it.
+        claimed = model_query(context, models.KvmhaHostClaim,
+                              session=session, read_deleted="no").\
+                        filter_by(host=host).\
+                        filter(or_(models.KvmhaHostClaim.owner == owner,
+                                   models.KvmhaHostClaim.updated_at <
+                                   expired)).\
+                        update(values, synchronize_session=False)
+    if claimed:
+        return True
+
+    claim = models.KvmhaHostClaim()
+    claim.update(values)
+    claim.host = host
+    try:
+        claim.save()
+    except db_exc.DBDuplicateEntry:
+        # Either claimed by another worker or we lost the race to insert.
+        return False
+    return True
+
+
+@require_admin_context
+def kvmha_host_release(context, host, owner=None):
+    query = model_query(context, models.KvmhaHostClaim, read_deleted="no").\
+                filter_by(host=host)
+    if owner is not None:
+        query = query.filter_by(owner=owner)
+    return bool(query.soft_delete(synchronize_session=False))
+
+
 def _get_default_deleted_value(table):
     # TODO(dripton): It would be better to introspect the actual default value
     # from the column, but I don't see a way to do that in the low-level APIs
@@ -5558,12 +6214,13 @@ def _get_default_deleted_value(table):
         return None
 
 
-@require_admin_context
-def archive_deleted_rows_for_table(context, tablename, max_rows):
-    """Move up to max_rows rows from one tables to the corresponding
-    shadow table. The context argument is only used for the decorator.
+def _archive_deleted_rows_batch(tablename, max_rows, marker=None):
+    """Move up to max_rows deleted rows following marker from one table to
+    the corresponding shadow table, in a single transaction.
 
-    :returns: number of rows archived
+    :returns: number of rows archived and the key of the last one
+    :raises: ArchiveRowReferenced if a row is still referenced by a
+             foreign key
     """
     # NOTE(guochbo): There is a circular import, nova.db.sqlalchemy.utils
     # imports nova.db.sqlalchemy.api.
@@ -5576,48 +6233,83 @@ def archive_deleted_rows_for_table(context, tablename, max_rows):
     table = Table(tablename, metadata, autoload=True)
     default_deleted_value = _get_default_deleted_value(table)
     shadow_tablename = _SHADOW_TABLE_PREFIX + tablename
-    rows_archived = 0
     try:
         shadow_table = Table(shadow_tablename, metadata, autoload=True)
     except NoSuchTableError:
         # No corresponding shadow table; skip it.
-        return rows_archived
+        return 0, marker
 
     if tablename == "dns_domains":
         # We have one table (dns_domains) where the key is called
         # "domain" rather than "id"
         column = table.c.domain
-        column_name = "domain"
     else:
         column = table.c.id
-        column_name = "id"
-    # NOTE(guochbo): Use InsertFromSelect and DeleteFromSelect to avoid
-    # database's limit of maximum parameter in one SQL statement.
-    query_insert = select([table],
-                          table.c.deleted != default_deleted_value).\
-                          order_by(column).limit(max_rows)
-    query_delete = select([column],
-                          table.c.deleted != default_deleted_value).\
-                          order_by(column).limit(max_rows)
-
-    insert_statement = db_utils.InsertFromSelect(shadow_table, query_insert)
-    delete_statement = db_utils.DeleteFromSelect(table, query_delete, column)
+    where = table.c.deleted != default_deleted_value
+    if marker is not None:
+        where = and_(where, column > marker)
+    # The batch is the range of keys up to the max_rows-th deleted row, so
+    # the insert and the delete walk the primary key index and need
+    # neither a LIMIT nor a list of keys.
+    keys = select([column], where).order_by(column).limit(max_rows).alias()
+    last_key = conn.execute(select([func.max(keys.c[column.name])])).scalar()
+    if last_key is None:
+        return 0, marker
+    where = and_(where, column <= last_key)
+
+    # NOTE(guochbo): Use InsertFromSelect to avoid database's limit of
+    # maximum parameter in one SQL statement.
+    insert_statement = db_utils.InsertFromSelect(shadow_table,
+                                                 select([table], where))
     try:
         # Group the insert and delete in a transaction.
         with conn.begin():
-            result_insert = conn.execute(insert_statement)
-            result_delete = conn.execute(delete_statement)
+            conn.execute(insert_statement)
+            result_delete = conn.execute(table.delete().where(where))
     except IntegrityError:
+        raise exception.ArchiveRowReferenced(table=tablename, key=last_key)
+    return result_delete.rowcount, last_key
+
+
+@require_admin_context
+def archive_deleted_rows_batch(context, tablename, max_rows, marker=None):
+    """Move up to max_rows deleted rows following marker from one table to
+    the corresponding shadow table. The context argument is only used for
+    the decorator.
+
+    :returns: dict with the number of rows archived and the marker of the
+              next batch
+    """
+    rows, marker = _archive_deleted_rows_batch(tablename, max_rows, marker)
+    return {'rows': rows, 'marker': marker}
+
+
+@require_admin_context
+def archive_deleted_rows_for_table(context, tablename, max_rows):
+    """Move up to max_rows rows from one tables to the corresponding
+    shadow table. The context argument is only used for the decorator.
+
+    :returns: number of rows archived
+    """
+    try:
+        rows_archived = _archive_deleted_rows_batch(tablename, max_rows)[0]
+    except exception.ArchiveRowReferenced:
         # A foreign key constraint keeps us from deleting some of
         # these rows until we clean up a dependent table.  Just
         # skip this table for now; we'll come back to it later.
         msg = _("IntegrityError detected when archiving table %s") % tablename
         LOG.warn(msg)
-        return rows_archived
+        return 0
+    return rows_archived
 
-    rows_archived = result_delete.rowcount
 
-    return rows_archived
+@require_admin_context
+def archive_table_names(context):
+    """Return the names of the archived tables, the tables referencing
+    another one first.
+    """
+    return [table.name for table in
+            reversed(models.BASE.metadata.sorted_tables)]
 
 
 @require_admin_context
@@ -5628,12 +6320,8 @@ def archive_deleted_rows(context, max_rows=None):
     :returns: Number of rows archived.
     """
     # The context argument is only used for the decorator.
-    tablenames = []
-    for model_class in models.__dict__.itervalues():
-        if hasattr(model_class, "__tablename__"):
-            tablenames.append(model_class.__tablename__)
     rows_archived = 0
-    for tablename in tablenames:
+    for tablename in archive_table_names(context):
         rows_archived += archive_deleted_rows_for_table(context, tablename,
                                          max_rows=max_rows - rows_archived)
         if rows_archived >= max_rows:
@@ -5641,6 +6329,22 @@ def archive_deleted_rows(context, max_rows=None):
     return rows_archived
 
 
+def replica_lag(context):
+    """Return the replication lag of the most lagging replica database, in
+    seconds, or None if no replica is configured.
+    """
+    if not _replica_connections():
+        return None
+    lags = [0]
+    for replica in _get_replica_pool().replicas:
+        # Refreshes the lag every replica_check_interval seconds.
+        replica.is_usable()
+        if replica.lag is not None:
+            # NOTE: a failed replica does not hold back the callers.
+            lags.append(replica.lag)
+    return max(lags)
+
+
 ####################
 
 
@@ -0,0 +1,61 @@
+# Copyright 2014 Hewlett-Packard Development Company, L.P.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Index
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import String
+from sqlalchemy import Table
+
+from nova.db.sqlalchemy import api
+from nova.db.sqlalchemy import utils
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    kvmha_evacuations = Table('kvmha_evacuations', meta,
+            Column('created_at', DateTime),
+            Column('updated_at', DateTime),
+            Column('deleted_at', DateTime),
+            Column('deleted', Integer, default=0),
+            Column('id', Integer, primary_key=True, nullable=False),
+            Column('instance_uuid', String(36), nullable=False),
+            Column('source_host', String(255), nullable=False),
+            Column('dest_host', String(255)),
+            Column('status', String(36), nullable=False),
+            Column('priority', Integer, default=0),
+            Index('kvmha_evacuations_source_host_status_idx',
+                  'source_host', 'status', 'deleted'),
+            Index('kvmha_evacuations_instance_uuid_idx', 'instance_uuid'),
+            mysql_engine='InnoDB',
+            mysql_charset='utf8'
+    )
+    kvmha_evacuations.create()
+
+    utils.create_shadow_table(migrate_engine, table=kvmha_evacuations)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    table_names = ('kvmha_evacuations',
+                   api._SHADOW_TABLE_PREFIX + 'kvmha_evacuations')
+    for table_name in table_names:
+        table = Table(table_name, meta, autoload=True)
+        table.drop()
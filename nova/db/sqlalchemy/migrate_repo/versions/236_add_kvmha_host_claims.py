@@ -0,0 +1,57 @@
+# Copyright 2014 Hewlett-Packard Development Company, L.P.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import UniqueConstraint
+
+from nova.db.sqlalchemy import api
+from nova.db.sqlalchemy import utils
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    kvmha_host_claims = Table('kvmha_host_claims', meta,
+            Column('created_at', DateTime),
+            Column('updated_at', DateTime),
+            Column('deleted_at', DateTime),
+            Column('deleted', Integer, default=0),
+            Column('id', Integer, primary_key=True, nullable=False),
+            Column('host', String(255), nullable=False),
+            Column('owner', String(255), nullable=False),
+            UniqueConstraint('host', 'deleted',
+                             name='uniq_kvmha_host_claims0host0deleted'),
+            mysql_engine='InnoDB',
+            mysql_charset='utf8'
+    )
+    kvmha_host_claims.create()
+
+    utils.create_shadow_table(migrate_engine, table=kvmha_host_claims)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    table_names = ('kvmha_host_claims',
+                   api._SHADOW_TABLE_PREFIX + 'kvmha_host_claims')
+    for table_name in table_names:
+        table = Table(table_name, meta, autoload=True)
+        table.drop()
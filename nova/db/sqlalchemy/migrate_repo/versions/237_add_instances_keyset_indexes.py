@@ -0,0 +1,47 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Index, MetaData, Table
+
+# Based on the keyset pagination of instance_get_all_by_filters, sorted by
+# created_at and id, for a project and across all projects.
+INDEXES = [
+    ('instances_project_id_deleted_created_at_idx',
+     ['project_id', 'deleted', 'created_at', 'id']),
+    ('instances_deleted_created_at_idx',
+     ['deleted', 'created_at', 'id']),
+]
+
+
+def _get_indexes(meta):
+    instances = Table('instances', meta, autoload=True)
+    return [Index(name, *[instances.c[column] for column in columns])
+            for name, columns in INDEXES]
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    for index in _get_indexes(meta):
+        index.create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    for index in _get_indexes(meta):
+        index.drop(migrate_engine)
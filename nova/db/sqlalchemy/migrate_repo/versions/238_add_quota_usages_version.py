@@ -0,0 +1,41 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import Table
+
+
+def upgrade(engine):
+    meta = MetaData()
+    meta.bind = engine
+
+    # The version of a quota usage is incremented by every update, the
+    # optimistic quota reservations swap it to detect concurrent updates.
+    for table_name in ('quota_usages', 'shadow_quota_usages'):
+        table = Table(table_name, meta, autoload=True)
+        version = Column('version', Integer, nullable=False,
+                         server_default='0')
+        table.create_column(version)
+
+
+def downgrade(engine):
+    meta = MetaData()
+    meta.bind = engine
+
+    for table_name in ('quota_usages', 'shadow_quota_usages'):
+        table = Table(table_name, meta, autoload=True)
+        table.drop_column('version')
@@ -166,6 +166,10 @@ class Instance(BASE, NovaBase):
               'host', 'node', 'deleted'),
         Index('instances_host_deleted_cleaned_idx',
               'host', 'deleted', 'cleaned'),
+        Index('instances_project_id_deleted_created_at_idx',
+              'project_id', 'deleted', 'created_at', 'id'),
+        Index('instances_deleted_created_at_idx',
+              'deleted', 'created_at', 'id'),
     )
     injected_files = []
 
@@ -469,6 +473,8 @@ class QuotaUsage(BASE, NovaBase):
         return self.in_use + self.reserved
 
     until_refresh = Column(Integer)
+    # Incremented by every update, see quota_reserve_optimistic.
+    version = Column(Integer, nullable=False, server_default='0')
 
 
 class Reservation(BASE, NovaBase):
@@ -1395,3 +1401,35 @@ class PciDevice(BASE, NovaBase):
                             primaryjoin='and_('
                             'PciDevice.instance_uuid == Instance.uuid,'
                             'PciDevice.deleted == 0)')
+
+
+class KvmhaEvacuation(BASE, NovaBase):
+    """Represents the evacuation of an instance from a failed host."""
+    __tablename__ = 'kvmha_evacuations'
+    __table_args__ = (
+        Index('kvmha_evacuations_source_host_status_idx',
+              'source_host', 'status', 'deleted'),
+        Index('kvmha_evacuations_instance_uuid_idx', 'instance_uuid'),
+    )
+    id = Column(Integer, primary_key=True, nullable=False)
+    instance_uuid = Column(String(36), nullable=False)
+    source_host = Column(String(255), nullable=False)
+    dest_host = Column(String(255))
+    # queued, running, done, error, failed or timeout
+    status = Column(String(36), nullable=False)
+    # Evacuations with a higher priority are dispatched first
+    priority = Column(Integer, default=0)
+    # Number of times the evacuation was attempted
+    attempts = Column(Integer, nullable=False, server_default='0')
+
+
+class KvmhaHostClaim(BASE, NovaBase):
+    """Represents the kvmha worker owning the recovery of a failed host."""
+    __tablename__ = 'kvmha_host_claims'
+    __table_args__ = (
+        schema.UniqueConstraint("host", "deleted",
+                                name="uniq_kvmha_host_claims0host0deleted"),
+    )
+    id = Column(Integer, primary_key=True, nullable=False)
+    host = Column(String(255), nullable=False)
+    owner = Column(String(255), nullable=False)
@@ -1551,3 +1551,8 @@ class InvalidWatchdogAction(Invalid):
 class NoBlockMigrationForConfigDriveInLibVirt(NovaException):
     msg_fmt = _("Block migration of instances with config drives is not "
                 "supported in libvirt.")
+
+
+class ArchiveRowReferenced(NovaException):
+    msg_fmt = _("Deleted rows of table %(table)s up to %(key)s are still "
+                "referenced by another table.")
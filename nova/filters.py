@@ -17,6 +17,8 @@
 Filter support
 """
 
+import time
+
 from nova import loadables
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
@@ -64,6 +66,13 @@ class BaseFilterHandler(loadables.BaseLoader):
     This class should be subclassed where one needs to use filters.
     """
 
+    def _filter_done(self, cls_name, elapsed, objs_in, objs_out):
+        """Called after each filter run with its timing and object counts.
+
+        Override in a subclass to instrument the filters.
+        """
+        pass
+
     def get_filtered_objects(self, filter_classes, objs,
             filter_properties, index=0):
         list_objs = list(objs)
@@ -73,13 +82,17 @@ class BaseFilterHandler(loadables.BaseLoader):
             filter = filter_cls()
 
             if filter.run_filter_for_index(index):
+                start = time.time()
                 objs = filter.filter_all(list_objs,
                                                filter_properties)
                 if objs is None:
                     LOG.debug(_("Filter %(cls_name)s says to stop filtering"),
                           {'cls_name': cls_name})
                     return
+                objs_in = len(list_objs)
                 list_objs = list(objs)
+                self._filter_done(cls_name, time.time() - start, objs_in,
+                                  len(list_objs))
                 if not list_objs:
                     LOG.info(_("Filter %s returned 0 hosts"), cls_name)
                     break
@@ -0,0 +1,98 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Capacity snapshot of the compute hosts for KVMHA.
+
+The snapshot is built from a single compute_node_get_all query through the
+scheduler host manager, indexed by host name and kept for a short time.
+Capacity consumed by planned evacuations is applied to the cached
+HostStates so it is seen until the compute nodes report newer data.
+"""
+
+import collections
+
+from oslo.config import cfg
+
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import importutils
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+
+
+capacity_opts = [
+    cfg.IntOpt('kvmha_capacity_cache_ttl',
+               default=10,
+               help='Number of seconds a capacity snapshot of the compute '
+                    'hosts is reused before it is reloaded from the '
+                    'database'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(capacity_opts)
+CONF.import_opt('scheduler_host_manager', 'nova.scheduler.driver')
+
+LOG = logging.getLogger(__name__)
+
+
+class CapacitySnapshot(object):
+    """Cached, host-indexed view of compute node capacity."""
+
+    def __init__(self):
+        self.host_manager = importutils.import_object(
+                CONF.scheduler_host_manager)
+        self._hosts = {}
+        self._loaded_at = None
+
+    def _expired(self):
+        if self._loaded_at is None:
+            return True
+        return timeutils.is_older_than(self._loaded_at,
+                                       CONF.kvmha_capacity_cache_ttl)
+
+    def refresh(self, context, force=False):
+        """Reload the snapshot if it is older than the cache TTL."""
+        if not force and not self._expired():
+            return
+        hosts = collections.defaultdict(list)
+        for host_state in self.host_manager.get_all_host_states(context):
+            hosts[host_state.host].append(host_state)
+        self._hosts = dict(hosts)
+        self._loaded_at = timeutils.utcnow()
+        LOG.debug(_("Loaded capacity snapshot of %d host(s)"),
+                  len(self._hosts))
+
+    def get_host_states(self, context, exclude=None):
+        """Return the HostStates of all hosts but the excluded one."""
+        self.refresh(context)
+        return [host_state
+                for host, host_states in self._hosts.iteritems()
+                if host != exclude
+                for host_state in host_states]
+
+    def get(self, context, host):
+        """Return the list of HostStates (one per node) of a host."""
+        self.refresh(context)
+        return self._hosts.get(host, [])
+
+    def get_available_memory(self, context, host):
+        """Return the free memory of a host in MB, None if unknown."""
+        host_states = self.get(context, host)
+        if not host_states:
+            return None
+        return sum(host_state.free_ram_mb for host_state in host_states)
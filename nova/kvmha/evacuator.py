@@ -0,0 +1,231 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Bounded-concurrency evacuation engine for KVMHA.
+
+Instances are evacuated through a green thread pool. Each target host has
+its own concurrency limit and dispatching to a host is held back while the
+host reports too many in-flight build/rebuild operations. Completion of an
+evacuation is tracked through the instance task_state instead of a fixed
+sleep.
+
+When an evacuation record is given for an instance its status is kept in
+the kvmha_evacuations table, so an evacuation already running when kvmha
+was restarted is waited for instead of being issued again.
+"""
+
+import collections
+import datetime
+
+from eventlet import greenpool
+from eventlet import greenthread
+from eventlet import semaphore
+from oslo.config import cfg
+
+from nova.compute import task_states
+from nova.compute import vm_states
+from nova import db
+from nova import exception
+from nova.objects import instance as instance_obj
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+
+
+evacuator_opts = [
+    cfg.IntOpt('kvmha_evacuate_workers',
+               default=16,
+               help='Maximum number of instances evacuated concurrently'),
+    cfg.IntOpt('kvmha_max_evacuations_per_host',
+               default=4,
+               help='Maximum number of concurrent evacuations targeting '
+                    'a single compute host'),
+    cfg.IntOpt('kvmha_target_max_workload',
+               default=8,
+               help='Hold back evacuations to a target host while its '
+                    'compute node reports at least this many in-flight '
+                    'build, rebuild, resize or migration operations. '
+                    '0 disables back-pressure'),
+    cfg.IntOpt('kvmha_evacuate_poll_interval',
+               default=2,
+               help='Interval in seconds between task_state checks of an '
+                    'instance being evacuated'),
+    cfg.IntOpt('kvmha_evacuate_timeout',
+               default=600,
+               help='Maximum time in seconds to wait for a single '
+                    'evacuation to finish'),
+    cfg.IntOpt('kvmha_evacuate_max_attempts',
+               default=3,
+               help='Maximum number of evacuation attempts of an instance '
+                    'from a failed host, after which its evacuation is '
+                    'abandoned'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(evacuator_opts)
+
+LOG = logging.getLogger(__name__)
+
+# Statuses of evacuation records not finished yet
+EVACUATE_QUEUED = 'queued'
+EVACUATE_RUNNING = 'running'
+EVACUATE_UNFINISHED = (EVACUATE_QUEUED, EVACUATE_RUNNING)
+
+# Evacuation outcomes reported by Evacuator.evacuate()
+EVACUATE_DONE = 'done'
+EVACUATE_ERROR = 'error'
+EVACUATE_FAILED = 'failed'
+EVACUATE_TIMEOUT = 'timeout'
+# Statuses of finished evacuation records which can be retried
+EVACUATE_RETRYABLE = (EVACUATE_ERROR, EVACUATE_FAILED, EVACUATE_TIMEOUT)
+# Status of the evacuation records out of attempts
+EVACUATE_ABANDONED = 'abandoned'
+
+_IN_PROGRESS_TASK_STATES = (task_states.REBUILDING,
+                            task_states.REBUILD_BLOCK_DEVICE_MAPPING,
+                            task_states.REBUILD_SPAWNING)
+
+
+class Evacuator(object):
+    """Evacuate instances concurrently with per-target limits.
+
+    :param evacuate_fn: callable taking (context, instance, host) which
+                        issues the evacuate request for a single instance.
+    """
+
+    def __init__(self, evacuate_fn):
+        self.evacuate_fn = evacuate_fn
+        self.pool = greenpool.GreenPool(CONF.kvmha_evacuate_workers)
+        self._host_semaphores = collections.defaultdict(
+            lambda: semaphore.Semaphore(CONF.kvmha_max_evacuations_per_host))
+
+    def _get_target_workload(self, context, host):
+        try:
+            service = db.service_get_by_compute_host(context, host)
+        except exception.ComputeHostNotFound:
+            return 0
+        return sum(node['current_workload'] or 0
+                   for node in service['compute_node'])
+
+    def _wait_for_capacity(self, context, host, deadline):
+        """Apply back-pressure until the target host has spare capacity.
+
+        :returns: False if the deadline passed first.
+        """
+        max_workload = CONF.kvmha_target_max_workload
+        if max_workload <= 0:
+            return True
+        while timeutils.utcnow() < deadline:
+            workload = self._get_target_workload(context, host)
+            if workload < max_workload:
+                return True
+            LOG.debug(_("Target host %(host)s is busy (workload %(load)d), "
+                        "delaying evacuation"),
+                      {'host': host, 'load': workload})
+            greenthread.sleep(CONF.kvmha_evacuate_poll_interval)
+        return False
+
+    def _wait_for_completion(self, context, instance, host, deadline):
+        """Poll the instance task_state until the rebuild has finished."""
+        while timeutils.utcnow() < deadline:
+            greenthread.sleep(CONF.kvmha_evacuate_poll_interval)
+            try:
+                inst = instance_obj.Instance.get_by_uuid(context,
+                                                         instance['uuid'])
+            except exception.InstanceNotFound:
+                return EVACUATE_ERROR
+            if inst.vm_state == vm_states.ERROR:
+                return EVACUATE_ERROR
+            if (inst.task_state not in _IN_PROGRESS_TASK_STATES and
+                    inst.host == host):
+                return EVACUATE_DONE
+        return EVACUATE_TIMEOUT
+
+    def _set_status(self, context, record, status):
+        if record is None:
+            return
+        try:
+            db.kvmha_evacuation_update(context, record['id'],
+                                       {'status': status})
+        except Exception:
+            LOG.exception(_("Failed to record status %(status)s of "
+                            "evacuation %(id)s"),
+                          {'status': status, 'id': record['id']})
+
+    def _evacuate_one(self, context, instance, host, record=None):
+        with self._host_semaphores[host]:
+            # The time spent queued behind the other evacuations to the
+            # same host does not count.
+            deadline = timeutils.utcnow() + datetime.timedelta(
+                seconds=CONF.kvmha_evacuate_timeout)
+            if record is not None and record['status'] == EVACUATE_RUNNING:
+                LOG.audit(_("Resuming evacuation of instance %(uuid)s to "
+                            "host %(host)s"),
+                          {'uuid': instance['uuid'], 'host': host})
+            else:
+                if not self._wait_for_capacity(context, host, deadline):
+                    LOG.error(_("Target host %(host)s stayed busy, not "
+                                "evacuating instance %(uuid)s"),
+                              {'uuid': instance['uuid'], 'host': host})
+                    self._set_status(context, record, EVACUATE_TIMEOUT)
+                    return instance['uuid'], EVACUATE_TIMEOUT
+                self._set_status(context, record, EVACUATE_RUNNING)
+                try:
+                    self.evacuate_fn(context, instance, host)
+                except Exception as e:
+                    LOG.error(_("Failed to evacuate instance %(uuid)s to "
+                                "%(host)s: %(error)s"),
+                              {'uuid': instance['uuid'], 'host': host,
+                               'error': e})
+                    self._set_status(context, record, EVACUATE_FAILED)
+                    return instance['uuid'], EVACUATE_FAILED
+            result = self._wait_for_completion(context, instance, host,
+                                               deadline)
+        self._set_status(context, record, result)
+        LOG.audit(_("Evacuation of instance %(uuid)s to host %(host)s "
+                    "finished: %(result)s"),
+                  {'uuid': instance['uuid'], 'host': host, 'result': result})
+        return instance['uuid'], result
+
+    def evacuate(self, context, placements, records=None):
+        """Evacuate instances and wait for all of them to finish.
+
+        Evacuations are dispatched in the order of placements, so when
+        more are pending than there are workers the first ones start first.
+
+        :param placements: list of (instance, target host) tuples.
+        :param records: optional dict of instance uuid to the evacuation
+                        record kept up to date with its status.
+        :returns: dict of instance uuid to evacuation outcome.
+        """
+        records = records or {}
+        start = timeutils.utcnow()
+        results = {}
+        threads = [self.pool.spawn(self._evacuate_one, context, instance,
+                                   host, records.get(instance['uuid']))
+                   for instance, host in placements]
+        for thread in threads:
+            uuid, result = thread.wait()
+            results[uuid] = result
+        elapsed = timeutils.delta_seconds(start, timeutils.utcnow())
+        done = len([r for r in results.values() if r == EVACUATE_DONE])
+        LOG.audit(_("Evacuated %(done)d of %(total)d instance(s) in "
+                    "%(elapsed).1f seconds"),
+                  {'done': done, 'total': len(results), 'elapsed': elapsed})
+        return results
@@ -0,0 +1,325 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Event driven detection of compute node failures.
+
+Instead of sweeping every service on each kvmha_proxy_run, a watcher
+green thread follows servicegroup membership every few seconds and
+pushes confirmed failures to a callback registered by the manager.
+
+With the ZooKeeper servicegroup driver the membership is maintained by
+ZooKeeper watches, so a tick is a local read. For the db and memcache
+drivers each host is kept in a heartbeat timeout queue ordered by the
+time its service can first be considered down, and only hosts whose
+deadline has passed are checked against the servicegroup.
+
+Enable with kvmha_driver=nova.kvmha.event_driver.
+"""
+
+import datetime
+import heapq
+
+from oslo.config import cfg
+
+from nova import context
+from nova import db
+from nova.kvmha import internal_driver
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova.openstack.common import loopingcall
+from nova.openstack.common import timeutils
+from nova import servicegroup
+from nova import utils
+
+event_driver_opts = [
+    cfg.IntOpt('kvmha_watch_interval',
+               default=1,
+               help='Interval in seconds between two checks of the '
+                    'servicegroup membership by the failure watcher'),
+    cfg.IntOpt('kvmha_watch_resync_interval',
+               default=60,
+               help='Interval in seconds between full reloads of the '
+                    'compute services by the failure watcher, used to '
+                    'discover new and recovered hosts'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(event_driver_opts)
+CONF.import_opt('compute_topic', 'nova.compute.rpcapi')
+CONF.import_opt('kvmha_failure_threshold', 'nova.kvmha.internal_driver')
+CONF.import_opt('kvmha_fence_failed_hosts', 'nova.kvmha.internal_driver')
+CONF.import_opt('service_down_time', 'nova.service')
+CONF.import_opt('report_interval', 'nova.service')
+CONF.import_opt('servicegroup_driver', 'nova.servicegroup.api')
+
+LOG = logging.getLogger(__name__)
+
+
+class HeartbeatTimeouts(object):
+    """Queue of hosts ordered by the deadline of their next heartbeat."""
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+
+    def __contains__(self, host):
+        return host in self._deadlines
+
+    def schedule(self, host, deadline):
+        self._deadlines[host] = deadline
+        heapq.heappush(self._heap, (deadline, host))
+
+    def pop_expired(self, now):
+        """Return the hosts whose deadline is not later than now."""
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, host = heapq.heappop(self._heap)
+            # Skip stale entries left behind by rescheduling a host.
+            if self._deadlines.get(host) == deadline:
+                del self._deadlines[host]
+                expired.append(host)
+        return expired
+
+
+class FailureWatcher(object):
+    """Follow compute service membership and report failed hosts."""
+
+    def __init__(self):
+        self.timeouts = HeartbeatTimeouts()
+        self.known_hosts = set()
+        self.missed_heartbeats = {}
+        self.failed_hosts = set()
+        self.pending = []
+        self.callback = None
+        # Only hosts accepted by this filter are monitored.
+        self.host_filter = None
+        self._last_resync = None
+        self._timer = None
+
+    def _next_check(self, now):
+        return now + datetime.timedelta(seconds=CONF.kvmha_watch_interval)
+
+    def _heartbeat_deadline(self, service, now):
+        last_heartbeat = service.get('updated_at') or service.get('created_at')
+        if CONF.servicegroup_driver == 'db' and last_heartbeat:
+            deadline = last_heartbeat.replace(tzinfo=None) + \
+                datetime.timedelta(seconds=CONF.service_down_time)
+        else:
+            deadline = now + datetime.timedelta(seconds=CONF.report_interval)
+        return max(deadline, self._next_check(now))
+
+    def _owns(self, host):
+        return self.host_filter is None or self.host_filter(host)
+
+    def _get_compute_services(self, ctxt, hosts=None):
+        services = {}
+        for service in db.service_get_all_by_topic(ctxt,
+                                                   CONF.compute_topic):
+            if hosts is None or service['host'] in hosts:
+                services.setdefault(service['host'], service)
+        return services
+
+    def _missed(self, host):
+        """Count a missed heartbeat, return True once host is failed."""
+        missed = self.missed_heartbeats.get(host, 0) + 1
+        if missed < CONF.kvmha_failure_threshold:
+            self.missed_heartbeats[host] = missed
+            return False
+        self.missed_heartbeats.pop(host, None)
+        self.failed_hosts.add(host)
+        return True
+
+    def _alive(self, ctxt, host):
+        self.missed_heartbeats.pop(host, None)
+        if host in self.failed_hosts:
+            internal_driver.host_recovered(ctxt, host)
+            self.failed_hosts.discard(host)
+
+    def _fence(self, ctxt, services):
+        if not CONF.kvmha_fence_failed_hosts:
+            return
+        for service in services:
+            internal_driver.fence_service(ctxt, service)
+
+    def _resync(self, ctxt, now):
+        """Reload all compute services to find new and removed hosts."""
+        self._last_resync = now
+        services = dict((host, service) for host, service in
+                        self._get_compute_services(ctxt).iteritems()
+                        if self._owns(host))
+        self.known_hosts = set(services)
+        for host in set(self.missed_heartbeats) - self.known_hosts:
+            del self.missed_heartbeats[host]
+        self.failed_hosts &= self.known_hosts
+        return services
+
+    def _needs_resync(self):
+        return (self._last_resync is None or timeutils.is_older_than(
+            self._last_resync, CONF.kvmha_watch_resync_interval))
+
+    def _watch_membership(self, ctxt, servicegroup_api, now):
+        """Check the hosts missing from the pushed membership."""
+        if self._needs_resync():
+            self._resync(ctxt, now)
+        members = set(servicegroup_api.get_all(CONF.compute_topic))
+        for host in members:
+            self._alive(ctxt, host)
+        # Failed hosts still down are reported again.
+        still_failed = [host for host in
+                        (self.known_hosts - members) & self.failed_hosts
+                        if self._owns(host)]
+        failure_hosts = [host for host in
+                         self.known_hosts - members - self.failed_hosts
+                         if self._owns(host) and self._missed(host)]
+        if failure_hosts:
+            services = self._get_compute_services(ctxt, failure_hosts)
+            self._fence(ctxt, services.values())
+        return still_failed + failure_hosts
+
+    def _watch_heartbeats(self, ctxt, servicegroup_api, now):
+        """Check the hosts whose heartbeat deadline has passed."""
+        services = None
+        # Hosts handed to another worker are dropped when they expire.
+        hosts = set(host for host in self.timeouts.pop_expired(now)
+                    if self._owns(host))
+        if self._needs_resync():
+            services = self._resync(ctxt, now)
+            # Hosts already queued keep their deadline.
+            hosts |= set(host for host in services
+                         if host not in self.timeouts)
+        if not hosts:
+            return []
+        if services is None:
+            services = self._get_compute_services(ctxt, hosts)
+        for host in hosts - set(services):
+            self.missed_heartbeats.pop(host, None)
+        services = dict((host, service)
+                        for host, service in services.iteritems()
+                        if host in hosts)
+
+        failure_hosts = []
+        failure_services = []
+        for host, service in services.iteritems():
+            if servicegroup_api.service_is_up(service):
+                self._alive(ctxt, host)
+                self.timeouts.schedule(
+                    host, self._heartbeat_deadline(service, now))
+            elif host in self.failed_hosts:
+                # Reported again until it is seen back up.
+                failure_hosts.append(host)
+                self.timeouts.schedule(host, self._next_check(now))
+            elif self._missed(host):
+                failure_hosts.append(host)
+                failure_services.append(service)
+                self.timeouts.schedule(host, self._next_check(now))
+            else:
+                self.timeouts.schedule(host, self._next_check(now))
+        self._fence(ctxt, failure_services)
+        return failure_hosts
+
+    def tick(self):
+        """
+        Run one check of the membership.
+
+        Return: List of names of the failed compute nodes, the hosts
+                still down are reported on every check.
+        """
+
+        servicegroup_api = servicegroup.API()
+        ctxt = context.get_admin_context()
+        now = timeutils.utcnow()
+        if CONF.servicegroup_driver == 'zk':
+            failure_hosts = self._watch_membership(ctxt, servicegroup_api,
+                                                   now)
+        else:
+            failure_hosts = self._watch_heartbeats(ctxt, servicegroup_api,
+                                                   now)
+        if failure_hosts:
+            LOG.audit(_("Failure hosts have been detected: %s") %
+                      ', '.join(failure_hosts))
+            if self.callback:
+                utils.spawn_n(self.callback, failure_hosts)
+            else:
+                self.pending.extend(failure_hosts)
+        return failure_hosts
+
+    def _tick(self):
+        try:
+            self.tick()
+        except Exception:
+            LOG.exception(_("Error while watching compute services"))
+
+    def start(self, callback):
+        self.callback = callback
+        self._timer = loopingcall.FixedIntervalLoopingCall(self._tick)
+        self._timer.start(interval=CONF.kvmha_watch_interval)
+
+    def stop(self):
+        if self._timer:
+            self._timer.stop()
+            self._timer = None
+        self.callback = None
+
+
+failure_watcher = FailureWatcher()
+
+
+def start_watching(callback):
+    """
+    Push failure hosts to callback as soon as they are detected.
+    """
+
+    failure_watcher.start(callback)
+
+
+def stop_watching():
+    failure_watcher.stop()
+
+
+def set_host_filter(host_filter):
+    """
+    Only monitor the compute hosts for which host_filter(host) is True.
+    """
+
+    failure_watcher.host_filter = host_filter
+
+
+def detect_failure_hosts():
+    """
+    Return: List of names of the failure compute nodes detected since the
+            previous call when no callback is registered.
+    """
+
+    if not failure_watcher.callback:
+        failure_watcher.tick()
+    failure_hosts = failure_watcher.pending
+    failure_watcher.pending = []
+    return failure_hosts
+
+
+def detect_failure_host():
+    """
+    Return: Name of the first failure compute node if detected.
+            None if everything going fine.
+    """
+
+    failure_hosts = detect_failure_hosts()
+    if failure_hosts:
+        return failure_hosts[0]
+    return None
@@ -24,51 +24,172 @@ Detect failure of compute nodes. Provides the scheduler with
 useful information about availability through kinds of approach.
 """
 
+from oslo.config import cfg
+
 from nova import servicegroup
 from nova import db
 from nova import context
-from nova import availability_zones
+from nova import exception
 from nova.openstack.common import log as logging
-from nova.openstack.common import timeutils
-from nova.openstack.common import uuidutils
 from nova.openstack.common.gettextutils import _
 
+internal_driver_opts = [
+    cfg.IntOpt('kvmha_failure_threshold',
+               default=3,
+               help='Number of consecutive detection runs a compute '
+                    'service has to be seen down before its host is '
+                    'declared failed'),
+    cfg.BoolOpt('kvmha_fence_failed_hosts',
+                default=False,
+                help='Disable the compute service of a failed host so no '
+                     'new instances are scheduled to it while it is down. '
+                     'The service is enabled again once the host is seen '
+                     'up'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(internal_driver_opts)
+CONF.import_opt('compute_topic', 'nova.compute.rpcapi')
+CONF.import_opt('host', 'nova.netconf')
+
 LOG = logging.getLogger(__name__)
 
+FENCED_REASON = 'kvmha: host failure detected'
+
+
+def fence_service(ctxt, service):
+    """
+    Disable the compute service of a failure host.
+    """
+
+    if service['disabled']:
+        return
+    LOG.audit(_("Fencing failure host: %s") % service['host'])
+    db.service_update(ctxt, service['id'],
+                      {'disabled': True,
+                       'disabled_reason': FENCED_REASON})
+
+
+def host_recovered(ctxt, host):
+    """
+    Release the recovery claim this worker holds on a failure host seen
+    up again, so it is recovered again if it fails again, and enable its
+    compute service again if it was fenced. A claim held by another
+    worker is left to it.
+    """
+
+    LOG.audit(_("Compute host %s is back up") % host)
+    db.kvmha_host_release(ctxt, host, CONF.host)
+    try:
+        service = db.service_get_by_compute_host(ctxt, host)
+    except exception.ComputeHostNotFound:
+        return
+    if service['disabled'] and service['disabled_reason'] == FENCED_REASON:
+        LOG.audit(_("Unfencing recovered host: %s") % host)
+        db.service_update(ctxt, service['id'],
+                          {'disabled': False, 'disabled_reason': None})
+
 
 class MonitorManager(object):
     """
     Monitor module by checking OpenStack service to detect
     host failure.
     """
-    pass
 
+    def __init__(self):
+        # Number of consecutive runs each compute host was seen down.
+        self.missed_heartbeats = {}
+        # Hosts declared failed and not seen up since.
+        self.failed_hosts = set()
+        # Only hosts accepted by this filter are monitored.
+        self.host_filter = None
 
-def detect_failure_host():
+    def _get_compute_services(self, ctxt):
+        services = {}
+        for service in db.service_get_all_by_topic(ctxt,
+                                                   CONF.compute_topic):
+            if self.host_filter and not self.host_filter(service['host']):
+                continue
+            services.setdefault(service['host'], service)
+        return services
+
+    def detect_failure_hosts(self):
+        """
+        Sweep all compute services once.
+
+        Return: List of names of the compute nodes seen down for
+                kvmha_failure_threshold consecutive runs. A failure host
+                is reported on every run until it is seen up, so the
+                evacuations which failed are retried.
+        """
+
+        servicegroup_api = servicegroup.API()
+        ctxt = context.get_admin_context()
+        services = self._get_compute_services(ctxt)
+        LOG.debug(_("Current compute services: %s"), services.keys())
+
+        failure_hosts = []
+        for host, service in services.iteritems():
+            if servicegroup_api.service_is_up(service):
+                self.missed_heartbeats.pop(host, None)
+                if host in self.failed_hosts:
+                    self.failed_hosts.discard(host)
+                    host_recovered(ctxt, host)
+                continue
+            if host in self.failed_hosts:
+                failure_hosts.append(host)
+                continue
+            missed = self.missed_heartbeats.get(host, 0) + 1
+            self.missed_heartbeats[host] = missed
+            if missed < CONF.kvmha_failure_threshold:
+                LOG.debug(_("Compute host %(host)s missed %(missed)d "
+                            "heartbeat check(s)"),
+                          {'host': host, 'missed': missed})
+                continue
+            del self.missed_heartbeats[host]
+            if CONF.kvmha_fence_failed_hosts:
+                fence_service(ctxt, service)
+            self.failed_hosts.add(host)
+            failure_hosts.append(host)
+
+        # Forget hosts whose service has been removed.
+        for host in set(self.missed_heartbeats) - set(services):
+            del self.missed_heartbeats[host]
+        self.failed_hosts &= set(services)
+
+        return failure_hosts
+
+
+monitor_manager = MonitorManager()
+
+
+def set_host_filter(host_filter):
+    """
+    Only monitor the compute hosts for which host_filter(host) is True.
+    """
+
+    monitor_manager.host_filter = host_filter
+
+
+def detect_failure_hosts():
     """
     Periodicly check in kvm_proxy_run() for status of compute hosts.
     Approach via service status.
 
-    Return: Name of the failure compute node if detected.
-            None if everything going fine.
+    Return: List of names of all the failure compute nodes detected,
+            empty if everything going fine.
     """
 
-    servicegroup_api = servicegroup.API()
-    ctxt = context.get_admin_context()
-    services = db.service_get_all(ctxt)
-    services = availability_zones.set_availability_zones(ctxt, services)
-    compute_services = []
-    for service in services:
-        if (service['binary'] == 'nova-compute'):
-            if not [cs for cs in compute_services if cs['host'] == service['host']]:
-                compute_services.append(service)
-    LOG.debug(_("Current compute services: %s" % compute_services))
-
-    for s in compute_services:
-        alive = servicegroup_api.service_is_up(s)
-        if not alive:
-            return s['host']
+    return monitor_manager.detect_failure_hosts()
 
-    return None
 
-monitor_manager = MonitorManager()
+def detect_failure_host():
+    """
+    Return: Name of the first failure compute node if detected.
+            None if everything going fine.
+    """
+
+    failure_hosts = detect_failure_hosts()
+    if failure_hosts:
+        return failure_hosts[0]
+    return None
@@ -29,11 +29,12 @@ import operator
 import os
 import sys
 import testtools
-import time
 import traceback
 import uuid
 import atexit
 
+from eventlet import greenpool
+from eventlet import semaphore
 import mox
 from oslo.config import cfg
 from oslo import messaging
@@ -41,8 +42,6 @@ import six
 from testtools import matchers as testtools_matchers
 from signal import SIGTERM
 
-import nova
-from nova import availability_zones
 from nova import block_device
 from nova import compute
 from nova import manager
@@ -57,7 +56,13 @@ from nova.compute import utils as compute_utils
 from nova.compute import vm_states
 from nova.conductor import manager as conductor_manager
 from nova.kvmha import rpcapi as kvmha_rpcai
+from nova.kvmha import capacity
 from nova.kvmha import driver 
+from nova.kvmha import evacuator
+from nova.kvmha import partition
+from nova.kvmha import planner
+from nova.kvmha import priority
+from nova.kvmha import storage
 from nova import context
 from nova import db
 from nova import exception
@@ -99,10 +104,20 @@ kvmha_opts = [
                default='root',
                help='Password for authorization of keystoneclient session '
                'Will get from config file, hardcode here for now'),
+    cfg.BoolOpt('kvmha_evacuate_via_api',
+                default=True,
+                help='Evacuate instances through the internal compute API '
+                     'instead of the novaclient REST API'),
+    cfg.IntOpt('kvmha_claim_timeout',
+               default=3600,
+               help='Number of seconds after which the recovery of a failed '
+                    'host claimed by a kvmha worker can be taken over by '
+                    'another one'),
     ]
 
 CONF = cfg.CONF
 CONF.register_opts(kvmha_opts)
+CONF.import_opt('kvmha_evacuate_max_attempts', 'nova.kvmha.evacuator')
 
 LOG = logging.getLogger(__name__)
 QUOTAS = quota.QUOTAS
@@ -117,11 +132,36 @@ class KvmhaManager(manager.Manager):
         # driver for each way of monitoring.
 
         self.driver = driver.load_kvmha_driver(kvmha_driver)
+        self.compute_api = compute.API()
+        self.capacity = capacity.CapacitySnapshot()
+        self.planner = planner.EvacuationPlanner(self.capacity)
+        self.shared_storage = storage.SharedStorage()
+        self.evacuator = evacuator.Evacuator(self._evacuate_instance)
+        self._plan_lock = semaphore.Semaphore()
+        # Failure hosts being evacuated, in the background of the
+        # failure detection.
+        self._recovery_pool = greenpool.GreenPool()
+        self._recovering = set()
         super(KvmhaManager, self).__init__(service_name='kvmha',
                                            *args, **kwargs)
+        self.partitioner = partition.Partitioner(self.host)
 
     def init_host(self):
-        pass
+        # With several kvmha workers each one monitors its own share of
+        # the compute hosts.
+        set_host_filter = getattr(self.driver, 'set_host_filter', None)
+        if set_host_filter:
+            set_host_filter(self.partitioner.owns)
+        # Drivers which can push failures start watching right away,
+        # the periodic task then only picks up what they queued.
+        start_watching = getattr(self.driver, 'start_watching', None)
+        if start_watching:
+            start_watching(self._handle_failure_hosts)
+
+    def cleanup_host(self):
+        stop_watching = getattr(self.driver, 'stop_watching', None)
+        if stop_watching:
+            stop_watching()
 
     def kvmha_get_version(self, context):
         pass
@@ -142,141 +182,196 @@ class KvmhaManager(manager.Manager):
 
         return instances_list
 
-    def _sum_instances_memory(self, failure_node):
+    def _evacuate_instance(self, ctxt, instance, host):
         """
-        Sumlize the total memory for all of the instances that need
-        to be evacuated.
+        Issue the evacuate request for a single instance.
 
-        :param failure_node: the failure host that has been detected.
-        :returns: Integer as total memory needed by all of the
-                  instances on that host.
+        :param ctxt: admin request context.
+        :param instance: the instance to be evacuated.
+        :param host: name of the target host.
         """
 
-        instances_list = self._get_target_instances(failure_node)
-        total_memory = 0
-        for instance in instances_list:
-            instance_memory = instance['memory_mb']
-            total_memory += instance_memory
-
-        return total_memory
+        if CONF.kvmha_evacuate_via_api:
+            instance = self.compute_api.get(ctxt, instance['uuid'])
+        # Instances sharing storage with the target keep their disk
+        # instead of being rebuilt from their image.
+        on_shared_storage = self.shared_storage.is_shared(instance['host'],
+                                                          host)
+        if CONF.kvmha_evacuate_via_api:
+            self.compute_api.evacuate(ctxt, instance, host,
+                                      on_shared_storage=on_shared_storage)
+        else:
+            # NOTE: we do the import here otherwise we get import error
+            # (novaclient not found) issues between the nova and nova
+            # client, which will lead to a failure running for our kvmha
+            # test cases.
+            from nova.kvmha import utils as kvmha_utils
+
+            nova_evacuate = kvmha_utils.get_client(
+                auth_url=CONF.kvmha_admin_auth_url, password=CONF.password)
+
+            res = nova_evacuate.servers.evacuate(
+                instance['uuid'], host=host,
+                on_shared_storage=on_shared_storage, password=None)
+            if type(res) is dict:
+                utils.print_dict(res)
+
+        LOG.audit(_("Instance: %(name)s is being restarted on host: "
+                    "%(host)s, shared storage: %(shared)s"),
+                  {'name': instance['display_name'], 'host': host,
+                   'shared': on_shared_storage})
 
-    def _get_hosts(self):
+    def _evacuate(self, failure_host):
         """
-        Get the list of all the hosts.
+        Evacuate VM(s) on the failure node to target host.
 
-        :return: a list of all the hosts.
+        :param failure_host: name of the failure host.
+        :return: dict of instance uuid to evacuation outcome.
         """
 
         ctxt = context.get_admin_context()
-        services = db.service_get_all(ctxt)
-        services = availability_zones.set_availability_zones(ctxt, services)
-
-        hosts = []
-        for service in services:
-            if not [h for h in hosts if h['host'] == service['host']]:
-                hosts.append(service)
-        hosts_list = []
-        for host in hosts:
-            hosts_list.append(host['host'].encode("utf-8"))
-
-        return hosts_list
-
-    def _get_available_memory(self, host):
+        if not db.kvmha_host_claim(ctxt, failure_host, self.host,
+                                   CONF.kvmha_claim_timeout):
+            LOG.audit(_("Failure host %s is recovered by another kvmha "
+                        "worker") % failure_host)
+            return {}
+        try:
+            return self._evacuate_claimed(ctxt, failure_host)
+        finally:
+            # The host may fail again after it recovered, or be handed to
+            # another worker, which must be able to claim it right away.
+            db.kvmha_host_release(ctxt, failure_host, self.host)
+
+    def _evacuate_claimed(self, ctxt, failure_host):
         """
-        Get available memory of gaven host.
+        Evacuate VM(s) on a failure node claimed by this worker.
 
-        :param host: name of the target host.
-        :return: Integer as the current memory available on the
-                 target host.
+        :param ctxt: admin request context.
+        :param failure_host: name of the failure host.
+        :return: dict of instance uuid to evacuation outcome.
         """
 
-        ctxt = context.get_admin_context()
-        service_resource = db.service_get_by_compute_host(ctxt, host)
-        node_resource = service_resource['compute_node'][0]
-        current_memory = node_resource['memory_mb'] - node_resource['memory_mb_used']
-        if current_memory < 0:
-            LOG.exception(_("Failed to get available node resource"))
-        else:
-            return current_memory
-
-    def _lookup_available_node(self, failure_node):
+        instances_list = self._get_target_instances(failure_host)
+        records = dict((record['instance_uuid'], record) for record in
+                       db.kvmha_evacuation_get_all_by_source_host(
+                           ctxt, failure_host,
+                           statuses=evacuator.EVACUATE_UNFINISHED))
+        if not instances_list and not records:
+            LOG.audit(_("No instance there needs to be evacuated"))
+            return {}
+
+        # Evacuations recorded before a restart are resumed to their
+        # planned target, only the other instances are planned.
+        placements = self._get_resumed_placements(ctxt, instances_list,
+                                                  records)
+        instances_list, failed = self._get_retried_instances(
+            ctxt, failure_host, [instance for instance in instances_list
+                                 if instance['uuid'] not in records])
+        priorities = priority.get_priorities(ctxt, instances_list)
+        # NOTE: failed hosts are evacuated concurrently, planning is
+        # serialized so plans do not consume the same capacity twice.
+        with self._plan_lock:
+            planned, unplaced = self.planner.plan(
+                ctxt, failure_host, instances_list, priorities=priorities,
+                preferred_hosts=self.shared_storage.get_hosts_sharing(
+                    failure_host))
+        for instance in unplaced:
+            LOG.error(_("Failed to lookup available node for instance: %s") %
+                      instance['uuid'])
+
+        for instance, host in planned:
+            values = {'dest_host': host,
+                      'status': evacuator.EVACUATE_QUEUED,
+                      'priority': priorities[instance['uuid']]}
+            record = failed.get(instance['uuid'])
+            if record is None:
+                values.update({'instance_uuid': instance['uuid'],
+                               'source_host': failure_host,
+                               'attempts': 1})
+                record = db.kvmha_evacuation_create(ctxt, values)
+            else:
+                values['attempts'] = record['attempts'] + 1
+                record = db.kvmha_evacuation_update(ctxt, record['id'],
+                                                    values)
+            records[instance['uuid']] = record
+        placements.extend(planned)
+        # Stable sort, planned instances keep their placement order
+        # within the same priority.
+        placements.sort(key=lambda p: records[p[0]['uuid']]['priority'],
+                        reverse=True)
+
+        return self.evacuator.evacuate(ctxt, placements, records=records)
+
+    def _get_retried_instances(self, ctxt, failure_host, instances_list):
         """
-        Look up an available compute node. Mainly based on memory
-        capability.
+        Get the instances to be planned, the evacuations which failed
+        kvmha_evacuate_max_attempts times are abandoned and their
+        instances are not planned again.
 
-        :param failure_node: name of the failure host.
-        :return: string of host name which is selected.
+        :param ctxt: admin request context.
+        :param failure_host: name of the failure host.
+        :param instances_list: instances without unfinished evacuation.
+        :return: list of the instances to be planned and dict of instance
+                 uuid to the record of its failed evacuation, which is
+                 reused by the next attempt.
         """
-  
-        host_list = self._get_hosts()
-        #target_hosts = host_list.remove(failure_node)
-        #target_memory = self._sum_instances_memory(failure_node)
-
-        #for host in target_hosts:
-        #    current_memory = _get_available_memory(host)
-        #    if target_memory < current_memory:
-        #        return host
-        #    else:
-        #        pop_error
-
-        target_memory = self._sum_instances_memory(failure_node)
-        for host in host_list:
-            if host is not failure_node:
-                current_memory = self._get_available_memory(host)
-                if target_memory < current_memory:
-                    return host
-                else:
-                    LOG.exception(_("No available resource"))
-            else:
+
+        failed = dict((record['instance_uuid'], record) for record in
+                      db.kvmha_evacuation_get_all_by_source_host(
+                          ctxt, failure_host,
+                          statuses=evacuator.EVACUATE_RETRYABLE +
+                          (evacuator.EVACUATE_ABANDONED,)))
+        retried = []
+        for instance in instances_list:
+            record = failed.get(instance['uuid'])
+            if (record is not None and
+                    record['status'] == evacuator.EVACUATE_ABANDONED):
+                del failed[instance['uuid']]
+                continue
+            if (record is not None and
+                    record['attempts'] >= CONF.kvmha_evacuate_max_attempts):
+                LOG.error(_("Abandoning the evacuation of instance "
+                            "%(uuid)s after %(attempts)d attempts"),
+                          {'uuid': instance['uuid'],
+                           'attempts': record['attempts']})
+                db.kvmha_evacuation_update(
+                    ctxt, record['id'],
+                    {'status': evacuator.EVACUATE_ABANDONED})
+                del failed[instance['uuid']]
                 continue
+            retried.append(instance)
+        return retried, failed
 
-    def _evacuate(self, failure_host):
+    def _get_resumed_placements(self, ctxt, instances_list, records):
         """
-        Evacuate VM(s) on the failure node to target host.
+        Get the placements of the evacuations recorded as unfinished.
 
-        :param failure_host: name of the failure host.
-        :return: None if everything going fine. 
+        :param ctxt: admin request context.
+        :param instances_list: instances still on the failure host.
+        :param records: dict of instance uuid to unfinished evacuation.
+        :return: list of (instance, host) placements to be resumed.
         """
 
-        # NOTE: we do the import here otherwise we get import error
-        # (novaclient not found) issues between the nova and nova
-        # client, which will lead to a failure running for our kvmha
-        # test cases.
-        from nova.kvmha import utils as kvmha_utils
-        available_node = self._lookup_available_node(failure_host)
-        if available_node:
-
-            instances_list = self._get_target_instances(failure_host)
-            if instances_list:
-
-                for instance in instances_list:
-                # Will point target host when enable shared storage later.
-
-                    ctxt = nova.context.get_admin_context()
-                    compute_api = compute.API()
-                    #name = instance['display_name']
-                    instance_final = compute_api.get(ctxt, instance['id'])
-                    check_host = instance_final['host']
-
-                    LOG.audit(_("Checking host: %s") % check_host)
-
-                    nova_evacuate = kvmha_utils.auth_client(auth_url=CONF.kvmha_admin_auth_url,
-                                                            password=CONF.password) 
-
-                    res = nova_evacuate.servers.evacuate(instance['uuid'],
-                                                         host=available_node,
-                                                         on_shared_storage=False,
-                                                         password=None)
-                    if type(res) is dict:
-                        utils.print_dict(res)
-
-                    LOG.audit(_("Instance: %s has been restarted on host: %s") %
-                              (instance['display_name'], available_node))
-                    time.sleep(15)
-        else:
-            LOG.exception(_("Failed to lookup available node"))
-
-        LOG.audit(_("No instance there needs to be evacuated"))
+        instances = dict((instance['uuid'], instance)
+                         for instance in instances_list)
+        placements = []
+        for instance_uuid, record in records.items():
+            instance = instances.get(instance_uuid)
+            if instance is not None:
+                placements.append((instance, record['dest_host']))
+            elif record['status'] == evacuator.EVACUATE_RUNNING:
+                # The instance already moved, only wait for the rebuild.
+                placements.append(({'uuid': instance_uuid},
+                                   record['dest_host']))
+            else:
+                # Queued instances gone from the host were deleted or
+                # moved by someone else, do not evacuate them.
+                LOG.warn(_("Instance %s is no longer on the failure host, "
+                           "dropping its queued evacuation") % instance_uuid)
+                db.kvmha_evacuation_update(
+                    ctxt, record['id'], {'status': evacuator.EVACUATE_ERROR})
+                del records[instance_uuid]
+        return placements
 
     @periodic_task.periodic_task
     def kvmha_proxy_run(self, context, start_time=None):
@@ -286,8 +381,34 @@ class KvmhaManager(manager.Manager):
 
         LOG.audit(_("KVM HA proxy run"))
 
-        failure_host = self.driver.detect_failure_host()
-        if failure_host:
-            LOG.audit(_("Failure host has been detected: %s" % failure_host))
+        failure_hosts = self.driver.detect_failure_hosts()
+        if failure_hosts:
+            self._handle_failure_hosts(failure_hosts)
+
+    def _recover(self, failure_host):
+        # A failure host is reported again while it is down, the
+        # evacuations which failed here are retried then.
+        try:
             self._evacuate(failure_host)
+        except Exception:
+            LOG.exception(_("Failed to evacuate failure host %s") %
+                          failure_host)
+        finally:
+            self._recovering.discard(failure_host)
+
+    def _handle_failure_hosts(self, failure_hosts):
+        """
+        Evacuate all the failure hosts concurrently, without waiting for
+        the evacuations so the detection of new failures goes on.
+
+        :param failure_hosts: list of names of the failure hosts.
+        """
 
+        LOG.audit(_("Failure hosts have been detected: %s") %
+                  ', '.join(failure_hosts))
+        for failure_host in failure_hosts:
+            if (failure_host in self._recovering or
+                    not self.partitioner.owns(failure_host)):
+                continue
+            self._recovering.add(failure_host)
+            self._recovery_pool.spawn_n(self._recover, failure_host)
@@ -0,0 +1,125 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Partitioning of the compute hosts between active kvmha workers.
+
+Every nova-kvmha service joins the servicegroup under kvmha_topic. The
+live members are placed on a consistent hash ring and each compute host
+is monitored and recovered by the worker owning it on the ring, so adding
+or losing a worker only moves the hosts of that worker. The recovery of
+a failed host is additionally claimed through the database, so two
+workers never evacuate the same host while the membership changes.
+"""
+
+import bisect
+import hashlib
+
+from oslo.config import cfg
+
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+from nova import servicegroup
+
+
+partition_opts = [
+    cfg.IntOpt('kvmha_hash_replicas',
+               default=32,
+               help='Number of points each kvmha worker has on the hash '
+                    'ring partitioning the compute hosts'),
+    cfg.IntOpt('kvmha_membership_refresh_interval',
+               default=10,
+               help='Number of seconds the membership of the kvmha '
+                    'workers is reused before it is reloaded from the '
+                    'servicegroup'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(partition_opts)
+CONF.import_opt('kvmha_topic', 'nova.kvmha.rpcapi')
+
+LOG = logging.getLogger(__name__)
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:8], 16)
+
+
+class HashRing(object):
+    """Consistent hash ring mapping keys to members.
+
+    :param members: names of the members of the ring.
+    :param replicas: number of points of each member on the ring.
+    """
+
+    def __init__(self, members, replicas):
+        self.members = frozenset(members)
+        ring = sorted((_hash('%s-%d' % (member, i)), member)
+                      for member in self.members
+                      for i in xrange(replicas))
+        self._points = [point for point, member in ring]
+        self._owners = [member for point, member in ring]
+
+    def get_owner(self, key):
+        """Return the member owning key, None if the ring is empty."""
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[i]
+
+
+class Partitioner(object):
+    """Tell which compute hosts a kvmha worker is responsible for.
+
+    :param host: name of the host running this kvmha worker.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.ring = HashRing([host], CONF.kvmha_hash_replicas)
+        self._loaded_at = None
+
+    def _expired(self):
+        if self._loaded_at is None:
+            return True
+        return timeutils.is_older_than(self._loaded_at,
+                                       CONF.kvmha_membership_refresh_interval)
+
+    def refresh(self, force=False):
+        """Reload the live kvmha workers if the membership is too old."""
+        if not force and not self._expired():
+            return
+        try:
+            members = set(servicegroup.API().get_all(CONF.kvmha_topic))
+        except Exception:
+            LOG.exception(_("Failed to get the kvmha workers, keeping "
+                            "the previous membership"))
+            members = set(self.ring.members)
+        # A worker always counts itself, so the hosts never go unowned.
+        members.add(self.host)
+        if members != self.ring.members:
+            LOG.info(_("kvmha workers changed to: %s"),
+                     ', '.join(sorted(members)))
+            self.ring = HashRing(members, CONF.kvmha_hash_replicas)
+        self._loaded_at = timeutils.utcnow()
+
+    def owns(self, host):
+        """Return True if this worker monitors and recovers host."""
+        self.refresh()
+        return self.ring.get_owner(host) == self.host
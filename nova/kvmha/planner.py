@@ -0,0 +1,188 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Evacuation placement planner for KVMHA.
+
+Spreads the instances of a failed host over the remaining compute hosts
+using a decreasing bin-packing heuristic. Candidate hosts are checked with
+the regular scheduler filters and capacity is consumed through
+HostState.consume_from_instance, so the plan agrees with what the real
+scheduler would accept. Host states come from a shared CapacitySnapshot,
+so consumption by one plan is seen by the next until the snapshot expires.
+"""
+
+from oslo.config import cfg
+
+from nova.compute import flavors
+from nova.objects import instance_group as instance_group_obj
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+
+
+planner_opts = [
+    cfg.ListOpt('kvmha_evacuate_filters',
+                default=[
+                  'AvailabilityZoneFilter',
+                  'RamFilter',
+                  'CoreFilter',
+                  'DiskFilter',
+                  'ComputeFilter',
+                  'ServerGroupAntiAffinityFilter',
+                  'ServerGroupAffinityFilter',
+                  ],
+                help='Scheduler filter class names used to check targets '
+                     'of evacuated instances'),
+    cfg.StrOpt('kvmha_placement_strategy',
+               default='spread',
+               help='How evacuated instances are packed onto targets: '
+                    '"spread" places each instance on the candidate with '
+                    'the most capacity left, "pack" on the one with the '
+                    'least'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(planner_opts)
+
+LOG = logging.getLogger(__name__)
+
+_GROUP_POLICIES = set(('anti-affinity', 'affinity'))
+
+
+def _instance_size(instance):
+    return (instance['memory_mb'], instance['vcpus'],
+            instance['root_gb'] + instance['ephemeral_gb'])
+
+
+def _free_ratio(free, total):
+    if not total:
+        return 0.0
+    return float(free) / total
+
+
+class EvacuationPlanner(object):
+    """Build a placement plan for all instances of a failed host.
+
+    :param capacity: the CapacitySnapshot providing target host states.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+    def _get_instance_groups(self, context, instances):
+        """Map instance uuids to their affinity/anti-affinity group."""
+        uuids = set(instance['uuid'] for instance in instances)
+        groups = {}
+        for group in instance_group_obj.InstanceGroupList.get_all(context):
+            if not _GROUP_POLICIES & set(group.policies):
+                continue
+            members = uuids & set(group.members)
+            if not members:
+                continue
+            group_hosts = set(group.get_hosts(context, exclude=members))
+            for uuid in members:
+                groups[uuid] = (group.policies, group_hosts)
+        return groups
+
+    def _fit_score(self, host_state, instance):
+        """Sum of the free RAM, vCPU and disk ratios left after placement."""
+        ram_mb, vcpus, disk_gb = _instance_size(instance)
+        free_vcpus = host_state.vcpus_total - host_state.vcpus_used - vcpus
+        return (_free_ratio(host_state.free_ram_mb - ram_mb,
+                            host_state.total_usable_ram_mb) +
+                _free_ratio(free_vcpus, host_state.vcpus_total) +
+                _free_ratio(host_state.free_disk_mb - disk_gb * 1024,
+                            host_state.total_usable_disk_gb * 1024))
+
+    def _choose_host(self, hosts, instance):
+        if CONF.kvmha_placement_strategy == 'pack':
+            return min(hosts, key=lambda h: self._fit_score(h, instance))
+        return max(hosts, key=lambda h: self._fit_score(h, instance))
+
+    def _build_filter_properties(self, context, instance):
+        instance_type = flavors.extract_flavor(instance)
+        return {'context': context,
+                'instance_type': instance_type,
+                'request_spec': {'instance_properties': instance,
+                                 'instance_type': instance_type},
+                'project_id': instance['project_id'],
+                'os_type': instance['os_type']}
+
+    def plan(self, context, failure_host, instances, priorities=None,
+             preferred_hosts=None):
+        """Place every instance of the failed host in a single pass.
+
+        Instances are placed by decreasing priority, largest first within
+        the same priority. For each instance the
+        candidate hosts are filtered, one is chosen according to
+        kvmha_placement_strategy and its resources are consumed before
+        the next instance is placed. Preferred hosts are chosen over the
+        other candidates whenever one of them passes the filters.
+
+        :param context: admin request context.
+        :param failure_host: name of the failed host.
+        :param instances: instances to be evacuated.
+        :param priorities: optional dict of instance uuid to evacuation
+                           priority.
+        :param preferred_hosts: optional set of host names to place the
+                                instances on first.
+        :returns: tuple of a list of (instance, host) placements in
+                  placement order and a list of instances that could not
+                  be placed.
+        """
+        priorities = priorities or {}
+        preferred_hosts = preferred_hosts or set()
+
+        def _order(instance):
+            return (priorities.get(instance['uuid'], 0),
+                    _instance_size(instance))
+
+        host_states = self.capacity.get_host_states(context,
+                                                    exclude=failure_host)
+        groups = self._get_instance_groups(context, instances)
+
+        placements = []
+        unplaced = []
+        for instance in sorted(instances, key=_order, reverse=True):
+            filter_properties = self._build_filter_properties(context,
+                                                              instance)
+            group = groups.get(instance['uuid'])
+            if group:
+                filter_properties['group_policies'] = group[0]
+                filter_properties['group_hosts'] = group[1]
+
+            hosts = self.capacity.host_manager.get_filtered_hosts(
+                host_states, filter_properties,
+                filter_class_names=CONF.kvmha_evacuate_filters)
+            if not hosts:
+                unplaced.append(instance)
+                continue
+
+            preferred = [host for host in hosts
+                         if host.host in preferred_hosts]
+            chosen = self._choose_host(preferred or hosts, instance)
+            chosen.consume_from_instance(instance)
+            if group:
+                group[1].add(chosen.host)
+            placements.append((instance, chosen.host))
+
+        LOG.audit(_("Planned evacuation of %(placed)d instance(s) from "
+                    "%(host)s, %(unplaced)d without a valid target"),
+                  {'placed': len(placements), 'host': failure_host,
+                   'unplaced': len(unplaced)})
+        return placements, unplaced
@@ -0,0 +1,95 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Evacuation priorities for KVMHA.
+
+The priority of an instance is read from, in order, the instance metadata,
+the properties of the image it was booted from and the extra specs of its
+flavor, using the key set by kvmha_priority_key. Instances with a higher
+priority are evacuated first, instances without one default to 0.
+"""
+
+from oslo.config import cfg
+
+from nova.compute import flavors
+from nova import db
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova import utils
+
+
+priority_opts = [
+    cfg.StrOpt('kvmha_priority_key',
+               default='ha_priority',
+               help='Instance metadata, image property or flavor extra '
+                    'spec holding the integer evacuation priority of an '
+                    'instance. Higher priorities are evacuated first'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(priority_opts)
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_PRIORITY = 0
+
+
+def _get_flavor_priority(context, instance, flavor_specs):
+    try:
+        flavorid = flavors.extract_flavor(instance)['flavorid']
+    except KeyError:
+        return None
+    if flavorid not in flavor_specs:
+        flavor_specs[flavorid] = db.flavor_extra_specs_get(context, flavorid)
+    return flavor_specs[flavorid].get(CONF.kvmha_priority_key)
+
+
+def _get_priority(context, instance, flavor_specs):
+    key = CONF.kvmha_priority_key
+    value = utils.instance_meta(instance).get(key)
+    if value is None:
+        value = utils.instance_sys_meta(instance).get('image_' + key)
+    if value is None:
+        value = _get_flavor_priority(context, instance, flavor_specs)
+    if value is None:
+        return DEFAULT_PRIORITY
+    try:
+        return int(value)
+    except ValueError:
+        LOG.warn(_("Invalid %(key)s %(value)s of instance %(uuid)s, "
+                   "using %(default)d"),
+                 {'key': key, 'value': value, 'uuid': instance['uuid'],
+                  'default': DEFAULT_PRIORITY})
+        return DEFAULT_PRIORITY
+
+
+def get_priorities(context, instances):
+    """
+    Get the evacuation priority of instances.
+
+    :param context: admin request context.
+    :param instances: instances with metadata and system_metadata.
+    :returns: dict of instance uuid to integer priority.
+    """
+
+    # Flavor extra specs are loaded once per flavor.
+    flavor_specs = {}
+    return dict((instance['uuid'],
+                 _get_priority(context, instance, flavor_specs))
+                for instance in instances)
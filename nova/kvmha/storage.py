@@ -0,0 +1,95 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Shared instance storage detection for KVMHA.
+
+Compute hosts record themselves in the compute_nodes registry of their
+instances_path (see nova.virt.storage_users). Two hosts found in the same
+registry share instance storage, so an instance can be evacuated between
+them with on_shared_storage=True and keeps its disk instead of being
+rebuilt from its image.
+"""
+
+from oslo.config import cfg
+
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+from nova.virt import storage_users
+
+
+storage_opts = [
+    cfg.BoolOpt('kvmha_detect_shared_storage',
+                default=True,
+                help='Evacuate instances with their existing disk when the '
+                     'failed and the target host share instance storage'),
+    cfg.StrOpt('kvmha_instances_path',
+               default='$instances_path',
+               help='Shared instances_path of the compute hosts as mounted '
+                    'on the kvmha host. Its compute_nodes registry tells '
+                    'which hosts share instance storage'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(storage_opts)
+CONF.import_opt('instances_path', 'nova.compute.manager')
+CONF.import_opt('kvmha_capacity_cache_ttl', 'nova.kvmha.capacity')
+
+LOG = logging.getLogger(__name__)
+
+
+class SharedStorage(object):
+    """Cached view of the hosts sharing instance storage."""
+
+    def __init__(self):
+        self._hosts = frozenset()
+        self._loaded_at = None
+
+    def _expired(self):
+        if self._loaded_at is None:
+            return True
+        return timeutils.is_older_than(self._loaded_at,
+                                       CONF.kvmha_capacity_cache_ttl)
+
+    def get_hosts(self):
+        """Return the set of hosts registered on the shared storage."""
+        if not CONF.kvmha_detect_shared_storage:
+            return frozenset()
+        if self._expired():
+            try:
+                self._hosts = frozenset(storage_users.get_storage_users(
+                    CONF.kvmha_instances_path))
+            except (IOError, OSError) as e:
+                LOG.warn(_("Failed to read the storage registry of "
+                           "%(path)s: %(error)s"),
+                         {'path': CONF.kvmha_instances_path, 'error': e})
+                self._hosts = frozenset()
+            self._loaded_at = timeutils.utcnow()
+        return self._hosts
+
+    def get_hosts_sharing(self, host):
+        """Return the other hosts sharing instance storage with host."""
+        hosts = self.get_hosts()
+        if host not in hosts:
+            return frozenset()
+        return hosts - set([host])
+
+    def is_shared(self, source, dest):
+        """Return True if source and dest share instance storage."""
+        return dest in self.get_hosts_sharing(source)
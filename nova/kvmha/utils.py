@@ -62,6 +62,9 @@ LOG = logging.getLogger(__name__)
 
 
 
+_CLIENTS = {}
+
+
 def auth_client(auth_url, password):
     """
     Authorization for server evacuate.
@@ -73,3 +76,19 @@ def auth_client(auth_url, password):
     nova_evacuate = Client(CONF.client_version, session=sess)
 
     return nova_evacuate
+
+
+@utils.synchronized('kvmha-admin-client')
+def get_client(auth_url, password):
+    """
+    Return the process-wide admin client for server evacuate.
+
+    The client is built once per auth_url and password. Its keystone
+    session keeps the token until it expires and reuses its HTTP
+    connections, so a mass failover costs one token request instead
+    of one per instance.
+    """
+    key = (auth_url, password)
+    if key not in _CLIENTS:
+        _CLIENTS[key] = auth_client(auth_url, password)
+    return _CLIENTS[key]
@@ -507,10 +507,13 @@ class DbQuotaDriver(object):
         #            which means access to the session.  Since the
         #            session isn't available outside the DBAPI, we
         #            have to do the work there.
-        return db.quota_reserve(context, resources, quotas, user_quotas,
-                                deltas, expire,
-                                CONF.until_refresh, CONF.max_age,
-                                project_id=project_id, user_id=user_id)
+        return self._quota_reserve(context, resources, quotas, user_quotas,
+                                   deltas, expire,
+                                   CONF.until_refresh, CONF.max_age,
+                                   project_id=project_id, user_id=user_id)
+
+    def _quota_reserve(self, *args, **kwargs):
+        return db.quota_reserve(*args, **kwargs)
 
     def commit(self, context, reservations, project_id=None, user_id=None):
         """Commit reservations.
@@ -620,6 +623,20 @@ class DbQuotaDriver(object):
         db.reservation_expire(context)
 
 
+class OptimisticDbQuotaDriver(DbQuotaDriver):
+    """Database quota driver reserving the resources without locking the
+    quota usages.
+
+    Concurrent reservations of a project are serialized by the row locks
+    of the quota usages with DbQuotaDriver. This driver updates the usages
+    with compare-and-swap UPDATEs instead, see
+    nova.db.api.quota_reserve_optimistic.
+    """
+
+    def _quota_reserve(self, *args, **kwargs):
+        return db.quota_reserve_optimistic(*args, **kwargs)
+
+
 class NoopQuotaDriver(object):
     """Driver that turns quotas calls into no-ops and pretends that quotas
     for all resources are unlimited.  This can be used if you do not
@@ -0,0 +1,99 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Placement of all the instances of a request in a single pass.
+
+The hosts are filtered and weighed once. The weighed hosts are kept in a
+heap, and after an instance is consumed from the chosen host only that
+host is filtered and weighed again before going back in the heap.
+
+Weights of re-weighed hosts are normalized with the bounds found when
+weighing all the hosts, so the placements can differ slightly from
+filtering and weighing all the hosts again for every instance when
+several weighers are combined.
+"""
+
+import heapq
+import random
+
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+class BatchPlacement(object):
+    """Place the instances of a request on hosts in a single pass."""
+
+    def __init__(self, host_manager, filter_properties):
+        self.host_manager = host_manager
+        self.filter_properties = filter_properties
+        # (minval, maxval) of each weigher over all the hosts.
+        self.bounds = []
+
+    def _weigh_all(self, hosts):
+        return self.host_manager.get_weighed_hosts(
+            hosts, self.filter_properties, self.bounds)
+
+    def _reweigh(self, host):
+        return self.host_manager.get_weighed_hosts(
+            [host], self.filter_properties, self.bounds)[0]
+
+    def _passes(self, host, index):
+        return bool(self.host_manager.get_filtered_hosts(
+            [host], self.filter_properties, index=index))
+
+    def place(self, hosts, instance_properties, num_instances,
+              subset_size=1):
+        """Return the WeighedHosts chosen for each instance.
+
+        Each host is chosen randomly among the subset_size best ones.
+        Fewer than num_instances WeighedHosts are returned if the hosts
+        run out of capacity.
+        """
+        hosts = self.host_manager.get_filtered_hosts(
+            hosts, self.filter_properties, index=0)
+        if not hosts:
+            return []
+        LOG.debug(_("Filtered %(hosts)s"), {'hosts': hosts})
+
+        # The position keeps the order of hosts with the same weight, the
+        # weighed hosts are sorted stably.
+        heap = [(-weighed_host.weight, position, weighed_host)
+                for position, weighed_host in
+                enumerate(self._weigh_all(hosts))]
+        heapq.heapify(heap)
+
+        selected_hosts = []
+        for num in xrange(num_instances):
+            if not heap:
+                break
+            best = [heapq.heappop(heap)
+                    for i in xrange(min(max(subset_size, 1), len(heap)))]
+            chosen = random.choice(best)
+            for entry in best:
+                if entry is not chosen:
+                    heapq.heappush(heap, entry)
+
+            weighed_host = chosen[2]
+            selected_hosts.append(weighed_host)
+            weighed_host.obj.consume_from_instance(instance_properties)
+            if (num + 1 < num_instances and
+                    self._passes(weighed_host.obj, num + 1)):
+                weighed_host = self._reweigh(weighed_host.obj)
+                heapq.heappush(heap, (-weighed_host.weight, chosen[1],
+                                      weighed_host))
+        return selected_hosts
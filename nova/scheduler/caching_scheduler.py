@@ -13,8 +13,111 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from oslo.config import cfg
+
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova.openstack.common import memorycache
+from nova.openstack.common import timeutils
+from nova.openstack.common import uuidutils
 from nova.scheduler import filter_scheduler
 
+caching_scheduler_opts = [
+    cfg.IntOpt('caching_scheduler_claim_ttl',
+               default=300,
+               help='Number of seconds the claims made by a caching '
+                    'scheduler are kept in memcached for the other '
+                    'scheduler workers. A worker which does not read '
+                    'them in time reloads all host states'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(caching_scheduler_opts)
+CONF.import_opt('memcached_servers', 'nova.openstack.common.memorycache')
+
+LOG = logging.getLogger(__name__)
+
+# Keys of the instance properties a claim needs to be replayed.
+CLAIM_KEYS = ('root_gb', 'ephemeral_gb', 'memory_mb', 'vcpus',
+              'project_id', 'os_type', 'vm_state', 'task_state')
+
+# Seconds a claim whose sequence number is reserved may take to appear.
+CLAIM_WRITE_TIMEOUT = 5
+
+
+class SharedClaims(object):
+    """Log of the claims made by all the caching scheduler workers.
+
+    Each claim gets a sequence number from an atomic memcached counter
+    and is stored under its own key. Every worker reads the claims made
+    by the others since the last sequence number it has seen and
+    consumes them from its cached host states, unless the compute node
+    was updated after the claim.
+    """
+
+    sequence_key = 'caching_scheduler_claims'
+
+    def __init__(self):
+        self.client = memorycache.get_client()
+        self.worker_id = uuidutils.generate_uuid()
+        self.seen = None
+        self._missing_since = None
+
+    def _claim_key(self, sequence):
+        return '%s-%d' % (self.sequence_key, sequence)
+
+    def _get_sequence(self):
+        return int(self.client.get(self.sequence_key) or 0)
+
+    def record(self, host_state, instance_properties):
+        """Publish the consumption of an instance on a host."""
+        self.client.add(self.sequence_key, '0')
+        sequence = self.client.incr(self.sequence_key)
+        if sequence is None:
+            LOG.warn(_("Unable to record claim on %s in memcached"),
+                     host_state.host)
+            return
+        instance = dict((key, instance_properties.get(key))
+                        for key in CLAIM_KEYS if key in instance_properties)
+        self.client.set(self._claim_key(sequence),
+                        {'worker': self.worker_id,
+                         'host': host_state.host,
+                         'nodename': host_state.nodename,
+                         'claimed_at': timeutils.strtime(),
+                         'instance': instance},
+                        time=CONF.caching_scheduler_claim_ttl)
+
+    def fetch(self):
+        """Return the claims of the other workers since the last call.
+
+        Return None if some claims were lost and the host states have to
+        be reloaded.
+        """
+        sequence = self._get_sequence()
+        if self.seen is None or sequence < self.seen:
+            # First call or the counter was lost, nothing to replay.
+            self.seen = sequence
+            return []
+        claims = []
+        for seen in xrange(self.seen + 1, sequence + 1):
+            claim = self.client.get(self._claim_key(seen))
+            if claim is None:
+                if self._missing_since is None:
+                    self._missing_since = timeutils.utcnow()
+                if not timeutils.is_older_than(self._missing_since,
+                                               CLAIM_WRITE_TIMEOUT):
+                    # Still being written, read it on the next call.
+                    break
+                LOG.info(_("Claim %d is lost, reloading host states"), seen)
+                self.seen = sequence
+                self._missing_since = None
+                return None
+            self._missing_since = None
+            self.seen = seen
+            if claim['worker'] != self.worker_id:
+                claims.append(claim)
+        return claims
+
 
 class CachingScheduler(filter_scheduler.FilterScheduler):
     """Scheduler to test aggressive caching of the host list.
@@ -43,7 +146,10 @@ class CachingScheduler(filter_scheduler.FilterScheduler):
     Please note, the way this works, each scheduler worker has its own
     copy of the cache. So if you run multiple schedulers, you will get
     more retries, because the data stored on any additional scheduler will
-    be more out of date, than if it was fetched from the database.
+    be more out of date, than if it was fetched from the database. When
+    memcached_servers is set, the workers share the resources they
+    consume through memcached (see SharedClaims) to avoid most of these
+    retries.
 
     In a similar way, if you have a high number of server deletes, the
     extra capacity from those deletes will not show up until the cache is
@@ -53,6 +159,9 @@ class CachingScheduler(filter_scheduler.FilterScheduler):
     def __init__(self, *args, **kwargs):
         super(CachingScheduler, self).__init__(*args, **kwargs)
         self.all_host_states = None
+        self.shared_claims = None
+        if CONF.memcached_servers:
+            self.shared_claims = SharedClaims()
 
     def run_periodic_tasks(self, context):
         """Called from a periodic tasks in the manager."""
@@ -69,9 +178,48 @@ class CachingScheduler(filter_scheduler.FilterScheduler):
             # comes in before the first run of the periodic task.
             # Rather than raise an error, we fetch the list of hosts.
             self.all_host_states = self._get_up_hosts(context)
+        elif self.shared_claims:
+            self._consume_shared_claims(context)
 
         return self.all_host_states
 
+    def _consume_shared_claims(self, context):
+        """Consume the resources claimed by the other workers."""
+        claims = self.shared_claims.fetch()
+        if claims is None:
+            self.all_host_states = self._get_up_hosts(context)
+            return
+        if not claims:
+            return
+        host_states = dict(((host_state.host, host_state.nodename),
+                            host_state)
+                           for host_state in self.all_host_states)
+        for claim in claims:
+            host_state = host_states.get((claim['host'], claim['nodename']))
+            if not host_state:
+                continue
+            # The resources of a compute node updated after the claim
+            # already account for it.
+            claimed_at = timeutils.parse_strtime(claim['claimed_at'])
+            if (host_state.compute_updated and
+                    claimed_at <= host_state.compute_updated):
+                continue
+            host_state.consume_from_instance(claim['instance'])
+
+    def _schedule(self, context, request_spec, filter_properties,
+                  instance_uuids=None):
+        selected_hosts = super(CachingScheduler, self)._schedule(
+                context, request_spec, filter_properties, instance_uuids)
+        if self.shared_claims:
+            instance_properties = request_spec['instance_properties']
+            for weighed_host in selected_hosts:
+                self.shared_claims.record(weighed_host.obj,
+                                          instance_properties)
+        return selected_hosts
+
     def _get_up_hosts(self, context):
+        if self.shared_claims and self.shared_claims.seen is None:
+            # Only the claims made after the first load are replayed.
+            self.shared_claims.fetch()
         all_hosts_iterator = self.host_manager.get_all_host_states(context)
         return list(all_hosts_iterator)
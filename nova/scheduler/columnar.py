@@ -0,0 +1,108 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Columnar view of HostStates for vectorized filters and weighers.
+
+When numpy is available and scheduler_columnar_host_states is set, the
+resource filters (Ram, Core, Disk, NumInstances, IoOps) and the RAM and
+metrics weighers evaluate all hosts at once as array expressions instead
+of calling Python code per host. Other filters and weighers keep running
+per host.
+
+Columns are extracted from the HostStates on every call rather than kept
+in a separate store, as HostStates are updated in place when instances
+are consumed from them.
+"""
+
+import operator
+
+from oslo.config import cfg
+
+from nova.openstack.common import importutils
+
+numpy = importutils.try_import('numpy')
+
+columnar_opts = [
+    cfg.BoolOpt('scheduler_columnar_host_states',
+                default=False,
+                help='Evaluate the resource filters and weighers over numpy '
+                     'arrays of host state columns. Requires numpy'),
+    cfg.IntOpt('scheduler_columnar_min_hosts',
+               default=100,
+               help='Minimum number of hosts for the resource filters and '
+                    'weighers to be evaluated over columns'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(columnar_opts)
+
+
+def enabled(host_states):
+    """Return True if host_states should be evaluated as columns."""
+    return (numpy is not None and CONF.scheduler_columnar_host_states and
+            len(host_states) >= CONF.scheduler_columnar_min_hosts)
+
+
+class HostStateColumns(object):
+    """Numpy arrays of the attributes of a list of HostStates.
+
+    Columns are extracted on first access and cached, so a filter only
+    pays for the attributes it reads.
+    """
+
+    def __init__(self, host_states):
+        self.host_states = host_states
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.host_states)
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            self._columns[name] = numpy.fromiter(
+                (value or 0 for value in
+                 map(operator.attrgetter(name), self.host_states)),
+                dtype=float, count=len(self.host_states))
+        return self._columns[name]
+
+    def metric(self, name):
+        """Return the values of a metric, NaN where it is unavailable."""
+        key = ('metric', name)
+        if key not in self._columns:
+            values = []
+            for host_state in self.host_states:
+                item = host_state.metrics.get(name)
+                values.append(numpy.nan if item is None else item.value)
+            self._columns[key] = numpy.array(values, dtype=float)
+        return self._columns[key]
+
+    def select(self, mask, limit_name=None, limits=None):
+        """Return the HostStates where mask is True.
+
+        :param limit_name: if set, the oversubscription limit to store in
+                           the limits of every selected HostState.
+        :param limits: scalar or array of the limit values, no limit is
+                       stored for NaN values.
+        """
+        selected = []
+        for i in numpy.flatnonzero(mask):
+            host_state = self.host_states[i]
+            if limit_name is not None:
+                limit = limits if numpy.isscalar(limits) else limits[i]
+                if not numpy.isnan(limit):
+                    host_state.limits[limit_name] = float(limit)
+            selected.append(host_state)
+        return selected
@@ -30,7 +30,9 @@ from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
 from nova.pci import pci_request
 from nova import rpc
+from nova.scheduler import batch
 from nova.scheduler import driver
+from nova.scheduler import profiler
 from nova.scheduler import scheduler_options
 from nova.scheduler import utils as scheduler_utils
 
@@ -48,7 +50,14 @@ filter_scheduler_opts = [
                     'chosen from. A value of 1 chooses the '
                     'first host returned by the weighing functions. '
                     'This value must be at least 1. Any value less than 1 '
-                    'will be ignored, and 1 will be used instead')
+                    'will be ignored, and 1 will be used instead'),
+    cfg.BoolOpt('scheduler_batch_placement',
+                default=False,
+                help='Filter and weigh the hosts once for requests of '
+                     'several instances, then only filter and weigh again '
+                     'the host chosen for the previous instance. Requests '
+                     'for instance groups are always placed one instance '
+                     'at a time'),
 ]
 
 CONF.register_opts(filter_scheduler_opts)
@@ -276,6 +285,7 @@ class FilterScheduler(driver.Scheduler):
                 filter_properties['group_policies'] = group.policies
         return update_group_hosts
 
+    @profiler.profiled
     def _schedule(self, context, request_spec, filter_properties,
                   instance_uuids=None):
         """Returns a list of hosts that meet the required specs,
@@ -314,13 +324,21 @@ class FilterScheduler(driver.Scheduler):
         # Note: remember, we are using an iterator here. So only
         # traverse this list once. This can bite you if the hosts
         # are being scanned in a filter or weighing function.
-        hosts = self._get_all_host_states(elevated)
+        with profiler.timed('host_manager', 'get_all_host_states'):
+            hosts = self._get_all_host_states(elevated)
 
         selected_hosts = []
         if instance_uuids:
             num_instances = len(instance_uuids)
         else:
             num_instances = request_spec.get('num_instances', 1)
+        if (CONF.scheduler_batch_placement and num_instances > 1 and
+                not update_group_hosts):
+            placement = batch.BatchPlacement(self.host_manager,
+                                             filter_properties)
+            return placement.place(hosts, instance_properties,
+                                   num_instances,
+                                   CONF.scheduler_host_subset_size)
         for num in xrange(num_instances):
             # Filter local hosts based on requirements ...
             hosts = self.host_manager.get_filtered_hosts(hosts,
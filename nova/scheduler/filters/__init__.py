@@ -18,6 +18,7 @@ Scheduler host filters
 """
 
 from nova import filters
+from nova.scheduler import profiler
 
 
 class BaseHostFilter(filters.BaseFilter):
@@ -37,6 +38,9 @@ class HostFilterHandler(filters.BaseFilterHandler):
     def __init__(self):
         super(HostFilterHandler, self).__init__(BaseHostFilter)
 
+    def _filter_done(self, cls_name, elapsed, objs_in, objs_out):
+        profiler.record('filter', cls_name, elapsed, objs_in, objs_out)
+
 
 def all_filters():
     """Return a list of filter classes found in this directory.
@@ -17,10 +17,11 @@
 
 from oslo.config import cfg
 
-from nova import db
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
+from nova.scheduler import columnar
 from nova.scheduler import filters
+from nova.scheduler.filters import utils
 
 LOG = logging.getLogger(__name__)
 
@@ -40,6 +41,31 @@ class BaseCoreFilter(filters.BaseHostFilter):
     def _get_cpu_allocation_ratio(self, host_state, filter_properties):
         raise NotImplementedError
 
+    def _get_cpu_allocation_ratios(self, columns, filter_properties):
+        """Return the ratio of every host as a scalar or an array."""
+        return columnar.numpy.array(
+            [self._get_cpu_allocation_ratio(host_state, filter_properties)
+             for host_state in columns.host_states])
+
+    def filter_all(self, filter_obj_list, filter_properties):
+        """Evaluate all hosts at once over columns when enabled."""
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type or not columnar.enabled(filter_obj_list):
+            return super(BaseCoreFilter, self).filter_all(filter_obj_list,
+                                                          filter_properties)
+        numpy = columnar.numpy
+        columns = columnar.HostStateColumns(filter_obj_list)
+        vcpus_total = columns['vcpus_total'] * \
+            self._get_cpu_allocation_ratios(columns, filter_properties)
+        # Hosts not reporting VCPUs pass and get no limit, see host_passes.
+        unknown = columns['vcpus_total'] == 0
+        if unknown.any():
+            LOG.warning(_("VCPUs not set; assuming CPU collection broken"))
+        passes = unknown | (vcpus_total - columns['vcpus_used'] >=
+                            instance_type['vcpus'])
+        limits = numpy.where(vcpus_total > 0, vcpus_total, numpy.nan)
+        return columns.select(passes, 'vcpu', limits)
+
     def host_passes(self, host_state, filter_properties):
         """Return True if host has sufficient CPU cores."""
         instance_type = filter_properties.get('instance_type')
@@ -70,6 +96,9 @@ class CoreFilter(BaseCoreFilter):
     def _get_cpu_allocation_ratio(self, host_state, filter_properties):
         return CONF.cpu_allocation_ratio
 
+    def _get_cpu_allocation_ratios(self, columns, filter_properties):
+        return CONF.cpu_allocation_ratio
+
 
 class AggregateCoreFilter(BaseCoreFilter):
     """AggregateCoreFilter with per-aggregate CPU subscription flag.
@@ -78,12 +107,8 @@ class AggregateCoreFilter(BaseCoreFilter):
     """
 
     def _get_cpu_allocation_ratio(self, host_state, filter_properties):
-        context = filter_properties['context'].elevated()
-        # TODO(uni): DB query in filter is a performance hit, especially for
-        # system with lots of hosts. Will need a general solution here to fix
-        # all filters with aggregate DB call things.
-        metadata = db.aggregate_metadata_get_by_host(
-                     context, host_state.host, key='cpu_allocation_ratio')
+        metadata = utils.aggregate_metadata_get_by_host(
+                     host_state, filter_properties, key='cpu_allocation_ratio')
         aggregate_vals = metadata.get('cpu_allocation_ratio', set())
         num_values = len(aggregate_vals)
 
@@ -17,6 +17,7 @@ from oslo.config import cfg
 
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
+from nova.scheduler import columnar
 from nova.scheduler import filters
 
 LOG = logging.getLogger(__name__)
@@ -31,6 +32,23 @@ CONF.register_opt(disk_allocation_ratio_opt)
 class DiskFilter(filters.BaseHostFilter):
     """Disk Filter with over subscription flag."""
 
+    def filter_all(self, filter_obj_list, filter_properties):
+        """Evaluate all hosts at once over columns when enabled."""
+        if not columnar.enabled(filter_obj_list):
+            return super(DiskFilter, self).filter_all(filter_obj_list,
+                                                      filter_properties)
+        instance_type = filter_properties.get('instance_type')
+        requested_disk = (1024 * (instance_type['root_gb'] +
+                                 instance_type['ephemeral_gb']) +
+                         instance_type['swap'])
+        columns = columnar.HostStateColumns(filter_obj_list)
+        total_usable_disk_mb = columns['total_usable_disk_gb'] * 1024
+        disk_mb_limit = total_usable_disk_mb * CONF.disk_allocation_ratio
+        used_disk_mb = total_usable_disk_mb - columns['free_disk_mb']
+        usable_disk_mb = disk_mb_limit - used_disk_mb
+        return columns.select(usable_disk_mb >= requested_disk,
+                              'disk_gb', disk_mb_limit / 1024)
+
     def host_passes(self, host_state, filter_properties):
         """Filter based on disk usage."""
         instance_type = filter_properties.get('instance_type')
@@ -17,6 +17,7 @@ from oslo.config import cfg
 
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
+from nova.scheduler import columnar
 from nova.scheduler import filters
 
 LOG = logging.getLogger(__name__)
@@ -32,6 +33,15 @@ CONF.register_opt(max_io_ops_per_host_opt)
 class IoOpsFilter(filters.BaseHostFilter):
     """Filter out hosts with too many concurrent I/O operations."""
 
+    def filter_all(self, filter_obj_list, filter_properties):
+        """Evaluate all hosts at once over columns when enabled."""
+        if not columnar.enabled(filter_obj_list):
+            return super(IoOpsFilter, self).filter_all(filter_obj_list,
+                                                       filter_properties)
+        columns = columnar.HostStateColumns(filter_obj_list)
+        return columns.select(columns['num_io_ops'] <
+                              CONF.max_io_ops_per_host)
+
     def host_passes(self, host_state, filter_properties):
         """Use information about current vm and task states collected from
         compute node statistics to decide whether to filter.
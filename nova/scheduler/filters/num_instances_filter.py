@@ -17,6 +17,7 @@ from oslo.config import cfg
 
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
+from nova.scheduler import columnar
 from nova.scheduler import filters
 
 LOG = logging.getLogger(__name__)
@@ -32,6 +33,15 @@ CONF.register_opt(max_instances_per_host_opt)
 class NumInstancesFilter(filters.BaseHostFilter):
     """Filter out hosts with too many instances."""
 
+    def filter_all(self, filter_obj_list, filter_properties):
+        """Evaluate all hosts at once over columns when enabled."""
+        if not columnar.enabled(filter_obj_list):
+            return super(NumInstancesFilter, self).filter_all(
+                filter_obj_list, filter_properties)
+        columns = columnar.HostStateColumns(filter_obj_list)
+        return columns.select(columns['num_instances'] <
+                              CONF.max_instances_per_host)
+
     def host_passes(self, host_state, filter_properties):
         num_instances = host_state.num_instances
         max_instances = CONF.max_instances_per_host
@@ -16,10 +16,11 @@
 
 from oslo.config import cfg
 
-from nova import db
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
+from nova.scheduler import columnar
 from nova.scheduler import filters
+from nova.scheduler.filters import utils
 
 LOG = logging.getLogger(__name__)
 
@@ -39,6 +40,27 @@ class BaseRamFilter(filters.BaseHostFilter):
     def _get_ram_allocation_ratio(self, host_state, filter_properties):
         raise NotImplementedError
 
+    def _get_ram_allocation_ratios(self, columns, filter_properties):
+        """Return the ratio of every host as a scalar or an array."""
+        return columnar.numpy.array(
+            [self._get_ram_allocation_ratio(host_state, filter_properties)
+             for host_state in columns.host_states])
+
+    def filter_all(self, filter_obj_list, filter_properties):
+        """Evaluate all hosts at once over columns when enabled."""
+        if not columnar.enabled(filter_obj_list):
+            return super(BaseRamFilter, self).filter_all(filter_obj_list,
+                                                         filter_properties)
+        instance_type = filter_properties.get('instance_type')
+        columns = columnar.HostStateColumns(filter_obj_list)
+        total_usable_ram_mb = columns['total_usable_ram_mb']
+        memory_mb_limit = total_usable_ram_mb * \
+            self._get_ram_allocation_ratios(columns, filter_properties)
+        used_ram_mb = total_usable_ram_mb - columns['free_ram_mb']
+        usable_ram = memory_mb_limit - used_ram_mb
+        return columns.select(usable_ram >= instance_type['memory_mb'],
+                              'memory_mb', memory_mb_limit)
+
     def host_passes(self, host_state, filter_properties):
         """Only return hosts with sufficient available RAM."""
         instance_type = filter_properties.get('instance_type')
@@ -71,6 +93,9 @@ class RamFilter(BaseRamFilter):
     def _get_ram_allocation_ratio(self, host_state, filter_properties):
         return CONF.ram_allocation_ratio
 
+    def _get_ram_allocation_ratios(self, columns, filter_properties):
+        return CONF.ram_allocation_ratio
+
 
 class AggregateRamFilter(BaseRamFilter):
     """AggregateRamFilter with per-aggregate ram subscription flag.
@@ -79,12 +104,8 @@ class AggregateRamFilter(BaseRamFilter):
     """
 
     def _get_ram_allocation_ratio(self, host_state, filter_properties):
-        context = filter_properties['context'].elevated()
-        # TODO(uni): DB query in filter is a performance hit, especially for
-        # system with lots of hosts. Will need a general solution here to fix
-        # all filters with aggregate DB call things.
-        metadata = db.aggregate_metadata_get_by_host(
-                     context, host_state.host, key='ram_allocation_ratio')
+        metadata = utils.aggregate_metadata_get_by_host(
+                     host_state, filter_properties, key='ram_allocation_ratio')
         aggregate_vals = metadata.get('ram_allocation_ratio', set())
         num_values = len(aggregate_vals)
 
@@ -40,12 +40,20 @@ Details on setting up and using an Attestation Service can be found at
 the Open Attestation project at:
 
     https://github.com/OpenAttestation/OpenAttestation
+
+The trust levels are cached for all the scheduling requests of a process
+and fetched over a pool of kept-alive connections. With
+`attestation_async_refresh' set, expired trust levels keep being used for
+up to `attestation_max_stale' seconds while a background green thread
+refreshes them, so that scheduling requests never wait for the
+Attestation service.
 """
 
 import httplib
 import socket
 import ssl
 
+from eventlet import pools
 from oslo.config import cfg
 
 from nova import context
@@ -55,6 +63,7 @@ from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova.scheduler import filters
+from nova import utils
 
 LOG = logging.getLogger(__name__)
 
@@ -74,6 +83,20 @@ trusted_opts = [
     cfg.IntOpt('attestation_auth_timeout',
                default=60,
                help='Attestation status cache valid period length'),
+    cfg.IntOpt('attestation_max_connections',
+               default=4,
+               help='Maximum number of kept-alive connections to the '
+                    'attestation server'),
+    cfg.BoolOpt('attestation_async_refresh',
+                default=False,
+                help='Refresh expired attestations in the background '
+                     'instead of waiting for the attestation server while '
+                     'scheduling'),
+    cfg.IntOpt('attestation_max_stale',
+               default=300,
+               help='Number of seconds an expired attestation is still '
+                    'used while it is refreshed in the background, after '
+                    'which the host is considered of unknown trust'),
 ]
 
 CONF = cfg.CONF
@@ -113,6 +136,22 @@ class HTTPSClientAuthConnection(httplib.HTTPSConnection):
                                     cert_reqs=ssl.CERT_REQUIRED)
 
 
+class AttestationConnectionPool(pools.Pool):
+    """Pool of kept-alive connections to the attestation server."""
+
+    def __init__(self, service):
+        super(AttestationConnectionPool, self).__init__(
+            max_size=CONF.trusted_computing.attestation_max_connections)
+        self.service = service
+
+    def create(self):
+        return HTTPSClientAuthConnection(self.service.host,
+                                         self.service.port,
+                                         key_file=self.service.key_file,
+                                         cert_file=self.service.cert_file,
+                                         ca_file=self.service.ca_file)
+
+
 class AttestationService(object):
     # Provide access wrapper to attestation server to get integrity report.
 
@@ -125,30 +164,34 @@ class AttestationService(object):
         self.cert_file = None
         self.ca_file = CONF.trusted_computing.attestation_server_ca_file
         self.request_count = 100
+        self.connections = AttestationConnectionPool(self)
 
     def _do_request(self, method, action_url, body, headers):
-        # Connects to the server and issues a request.
-        # :returns: result data
-        # :raises: IOError if the request fails
+        # Issues a request over a pooled connection.
+        # :returns: status and result data
 
         action_url = "%s/%s" % (self.api_url, action_url)
-        try:
-            c = HTTPSClientAuthConnection(self.host, self.port,
-                                          key_file=self.key_file,
-                                          cert_file=self.cert_file,
-                                          ca_file=self.ca_file)
-            c.request(method, action_url, body, headers)
-            res = c.getresponse()
-            status_code = res.status
-            if status_code in (httplib.OK,
-                               httplib.CREATED,
-                               httplib.ACCEPTED,
-                               httplib.NO_CONTENT):
-                return httplib.OK, res
-            return status_code, None
-
-        except (socket.error, IOError):
-            return IOError, None
+        with self.connections.item() as c:
+            # A kept-alive connection may have been closed by the server
+            # since its last use, so retry once on a new one.
+            for attempt in (1, 2):
+                try:
+                    c.request(method, action_url, body, headers)
+                    res = c.getresponse()
+                    data = res.read()
+                    break
+                except (socket.error, IOError, httplib.HTTPException):
+                    # The connection is reopened by its next request.
+                    c.close()
+            else:
+                return IOError, None
+        status_code = res.status
+        if status_code in (httplib.OK,
+                           httplib.CREATED,
+                           httplib.ACCEPTED,
+                           httplib.NO_CONTENT):
+            return httplib.OK, data
+        return status_code, None
 
     def _request(self, cmd, subcmd, hosts):
         body = {}
@@ -160,9 +203,8 @@ class AttestationService(object):
         headers['Accept'] = 'application/json'
         if self.auth_blob:
             headers['x-auth-blob'] = self.auth_blob
-        status, res = self._do_request(cmd, subcmd, cooked, headers)
+        status, data = self._do_request(cmd, subcmd, cooked, headers)
         if status == httplib.OK:
-            data = res.read()
             return status, jsonutils.loads(data)
         else:
             return status, None
@@ -191,11 +233,16 @@ class ComputeAttestationCache(object):
 
     OAT service may have cache also. OAT service's cache valid time
     should be set shorter than trusted filter's cache valid time.
+
+    Only the hosts whose trust level expired are polled. With
+    attestation_async_refresh, they are polled in a background green
+    thread and their previous trust level is used in the meantime.
     """
 
     def __init__(self):
         self.attestservice = AttestationService()
         self.compute_nodes = {}
+        self._refreshing = False
         admin = context.get_admin_context()
 
         # Fetch compute node list to initialize the compute_nodes,
@@ -210,13 +257,14 @@ class ComputeAttestationCache(object):
             host = service['host']
             self._init_cache_entry(host)
 
-    def _cache_valid(self, host):
+    def _cache_valid(self, host, valid_period=None):
+        if valid_period is None:
+            valid_period = CONF.trusted_computing.attestation_auth_timeout
         cachevalid = False
         if host in self.compute_nodes:
             node_stats = self.compute_nodes.get(host)
-            if not timeutils.is_older_than(
-                             node_stats['vtime'],
-                             CONF.trusted_computing.attestation_auth_timeout):
+            if not timeutils.is_older_than(node_stats['vtime'],
+                                           valid_period):
                 cachevalid = True
         return cachevalid
 
@@ -226,9 +274,9 @@ class ComputeAttestationCache(object):
             'vtime': timeutils.normalize_time(
                         timeutils.parse_isotime("1970-01-01T00:00:00Z"))}
 
-    def _invalidate_caches(self):
-        for host in self.compute_nodes:
-            self._init_cache_entry(host)
+    def _expired_hosts(self):
+        return [host for host in self.compute_nodes
+                if not self._cache_valid(host)]
 
     def _update_cache_entry(self, state):
         entry = {}
@@ -247,27 +295,61 @@ class ComputeAttestationCache(object):
 
         self.compute_nodes[host] = entry
 
-    def _update_cache(self):
-        self._invalidate_caches()
-        states = self.attestservice.do_attestation(self.compute_nodes.keys())
+    def _update_cache(self, hosts):
+        states = self.attestservice.do_attestation(hosts)
         if states is None:
             return
         for state in states:
             self._update_cache_entry(state)
 
+    def _refresh(self):
+        try:
+            hosts = self._expired_hosts()
+            if hosts:
+                self._update_cache(hosts)
+        except Exception:
+            LOG.exception(_("Error while refreshing host attestations"))
+        finally:
+            self._refreshing = False
+
+    def _get_host_attestation_async(self, host):
+        if self._cache_valid(host):
+            return self.compute_nodes[host]['trust_lvl']
+        if not self._refreshing:
+            self._refreshing = True
+            utils.spawn_n(self._refresh)
+        max_stale = (CONF.trusted_computing.attestation_auth_timeout +
+                     CONF.trusted_computing.attestation_max_stale)
+        if self._cache_valid(host, max_stale):
+            return self.compute_nodes[host]['trust_lvl']
+        return 'unknown'
+
     def get_host_attestation(self, host):
         """Check host's trust level."""
         if host not in self.compute_nodes:
             self._init_cache_entry(host)
+        if CONF.trusted_computing.attestation_async_refresh:
+            return self._get_host_attestation_async(host)
         if not self._cache_valid(host):
-            self._update_cache()
+            hosts = self._expired_hosts()
+            # Hosts failing to be attested are of unknown trust.
+            for expired_host in hosts:
+                self._init_cache_entry(expired_host)
+            self._update_cache(hosts)
         level = self.compute_nodes.get(host).get('trust_lvl')
         return level
 
 
+# Shared by the TrustedFilters of all the scheduling requests.
+_attestation_cache = None
+
+
 class ComputeAttestation(object):
     def __init__(self):
-        self.caches = ComputeAttestationCache()
+        global _attestation_cache
+        if _attestation_cache is None:
+            _attestation_cache = ComputeAttestationCache()
+        self.caches = _attestation_cache
 
     def is_trusted(self, host, trust):
         level = self.caches.get_host_attestation(host)
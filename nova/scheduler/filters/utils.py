@@ -0,0 +1,38 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Bench of utility methods used by filters."""
+
+from nova import db
+
+
+def aggregate_metadata_get_by_host(host_state, filter_properties, key=None):
+    """Returns a dict of all metadata of the aggregates of a host.
+
+    The metadata is read from the aggregate index the HostManager shares
+    between all the hosts of a request. Host states built without it fall
+    back to a DB query. Returns a dict of sets like
+    db.aggregate_metadata_get_by_host().
+    """
+    context = filter_properties['context']
+    if host_state.aggregate_index is None:
+        return db.aggregate_metadata_get_by_host(context.elevated(),
+                                                 host_state.host, key=key)
+    metadata = host_state.aggregate_index.get(context, host_state.host)
+    if key is None:
+        return metadata
+    if key in metadata:
+        return {key: metadata[key]}
+    return {}
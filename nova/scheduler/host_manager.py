@@ -18,6 +18,7 @@ Manage hosts in the current zone.
 """
 
 import collections
+import datetime
 import UserDict
 
 from oslo.config import cfg
@@ -58,6 +59,26 @@ host_manager_opts = [
     cfg.ListOpt('scheduler_weight_classes',
                 default=['nova.scheduler.weights.all_weighers'],
                 help='Which weight class names to use for weighing hosts'),
+    cfg.BoolOpt('scheduler_incremental_host_states',
+                default=False,
+                help='Only load the compute nodes updated since the '
+                     'previous request and keep the others from memory '
+                     'when building the host states'),
+    cfg.IntOpt('scheduler_host_states_resync_interval',
+               default=300,
+               help='Interval in seconds between full reloads of the '
+                    'compute nodes when scheduler_incremental_host_states '
+                    'is set, to recover from clock skew between the hosts '
+                    'updating the compute nodes'),
+    cfg.IntOpt('scheduler_host_states_since_margin',
+               default=60,
+               help='Number of seconds the compute nodes updated before the '
+                    'latest update seen are loaded again when '
+                    'scheduler_incremental_host_states is set, so the '
+                    'updates committed late or read from a lagging database '
+                    'replica are not missed. It must be larger than the '
+                    'replica lag and the duration of the transactions '
+                    'updating the compute nodes'),
     ]
 
 CONF = cfg.CONF
@@ -98,17 +119,95 @@ class ReadOnlyDict(UserDict.IterableUserDict):
             raise TypeError()
 
 
+class AggregateMetadataIndex(object):
+    """Metadata of all aggregates indexed by host.
+
+    Aggregates are loaded with a single query the first time the metadata
+    of any host is requested, and the index is shared by all the HostStates
+    of a request so filters do not query the DB per host.
+    """
+
+    def __init__(self):
+        self._metadata = None
+
+    def _load(self, context):
+        metadata = collections.defaultdict(
+            lambda: collections.defaultdict(set))
+        for aggregate in db.aggregate_get_all(context):
+            for host in aggregate['hosts']:
+                for key, value in aggregate['metadetails'].iteritems():
+                    metadata[host][key].add(value)
+        return dict((host, dict(host_metadata))
+                    for host, host_metadata in metadata.iteritems())
+
+    def get(self, context, host):
+        """Return the aggregate metadata of host as a dict of sets."""
+        if self._metadata is None:
+            self._metadata = self._load(context.elevated())
+        return self._metadata.get(host, {})
+
+
 # Representation of a single metric value from a compute node.
 MetricItem = collections.namedtuple(
              'MetricItem', ['value', 'timestamp', 'source'])
 
 
+class _StatsCategory(object):
+    """Counts of the compute node stats with a given key prefix.
+
+    The dict is decoded from HostState.stats the first time it is used
+    after an update, so only the filters needing a category pay for it.
+    """
+
+    def __init__(self, prefix, slot):
+        self.prefix = prefix
+        self.slot = slot
+
+    def __get__(self, host_state, owner):
+        if host_state is None:
+            return self
+        counts = getattr(host_state, self.slot)
+        if counts is None:
+            start = len(self.prefix)
+            counts = dict((key[start:], int(value)) for key, value in
+                          host_state.stats.iteritems()
+                          if key.startswith(self.prefix))
+            setattr(host_state, self.slot, counts)
+        return counts
+
+    def __set__(self, host_state, counts):
+        setattr(host_state, self.slot, counts)
+
+
 class HostState(object):
     """Mutable and immutable information tracked for a host.
     This is an attempt to remove the ad-hoc data structures
     previously used and lock down access.
     """
 
+    # NOTE: slots keep the memory of the host states of large clouds low,
+    # subclasses not defining __slots__ can still add attributes.
+    __slots__ = ('host', 'nodename', 'capabilities', 'service',
+                 'total_usable_ram_mb', 'total_usable_disk_gb',
+                 'disk_mb_used', 'free_ram_mb', 'free_disk_mb',
+                 'vcpus_total', 'vcpus_used', 'stats', 'num_instances',
+                 'num_io_ops', 'host_ip', 'hypervisor_type',
+                 'hypervisor_version', 'hypervisor_hostname', 'cpu_info',
+                 'supported_instances', 'limits', 'pci_stats',
+                 'aggregate_index', 'updated', 'compute_updated',
+                 '_vm_states', '_task_states',
+                 '_num_instances_by_project', '_num_instances_by_os_type',
+                 '_metrics', '_metrics_json')
+
+    # Number of instances in each vm_state, task_state, project and
+    # os_type, decoded from the stats of the compute node when used.
+    vm_states = _StatsCategory('num_vm_', '_vm_states')
+    task_states = _StatsCategory('num_task_', '_task_states')
+    num_instances_by_project = _StatsCategory('num_proj_',
+                                              '_num_instances_by_project')
+    num_instances_by_os_type = _StatsCategory('num_os_type_',
+                                              '_num_instances_by_os_type')
+
     def __init__(self, host, node, capabilities=None, service=None):
         self.host = host
         self.nodename = node
@@ -125,11 +224,9 @@ class HostState(object):
         self.vcpus_used = 0
 
         # Additional host information from the compute node stats:
-        self.vm_states = {}
-        self.task_states = {}
+        self.stats = {}
+        self._reset_stats_categories()
         self.num_instances = 0
-        self.num_instances_by_project = {}
-        self.num_instances_by_os_type = {}
         self.num_io_ops = 0
 
         # Other information
@@ -139,14 +236,27 @@ class HostState(object):
         self.hypervisor_hostname = None
         self.cpu_info = None
         self.supported_instances = None
+        self.pci_stats = None
 
         # Resource oversubscription values for the compute host:
         self.limits = {}
 
-        # Generic metrics from compute nodes
-        self.metrics = {}
+        # Generic metrics from compute nodes, decoded when used
+        self._metrics = {}
+        self._metrics_json = None
+
+        # Aggregate metadata shared by the hosts of a request
+        self.aggregate_index = None
 
         self.updated = None
+        # updated_at of the compute node the resources were read from
+        self.compute_updated = None
+
+    def _reset_stats_categories(self):
+        self._vm_states = None
+        self._task_states = None
+        self._num_instances_by_project = None
+        self._num_instances_by_os_type = None
 
     def update_capabilities(self, capabilities=None, service=None):
         # Read-only capability dicts
@@ -158,25 +268,38 @@ class HostState(object):
             service = {}
         self.service = ReadOnlyDict(service)
 
+    @property
+    def metrics(self):
+        """Generic metrics of the compute node as MetricItems by name."""
+        if self._metrics is None:
+            self._metrics = {}
+            for metric in jsonutils.loads(self._metrics_json):
+                # 'name', 'value', 'timestamp' and 'source' are all
+                # required to be valid keys, just let KeyError happen if
+                # any one of them is missing. But we also require 'name'
+                # to be True.
+                name = metric['name']
+                item = MetricItem(value=metric['value'],
+                                  timestamp=metric['timestamp'],
+                                  source=metric['source'])
+                if name:
+                    self._metrics[name] = item
+                else:
+                    LOG.warn(_("Metric name unknown of %r") % item)
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        self._metrics = metrics
+
     def _update_metrics_from_compute_node(self, compute):
         #NOTE(llu): The 'or []' is to avoid json decode failure of None
         #           returned from compute.get, because DB schema allows
         #           NULL in the metrics column
         metrics = compute.get('metrics', []) or []
         if metrics:
-            metrics = jsonutils.loads(metrics)
-        for metric in metrics:
-            # 'name', 'value', 'timestamp' and 'source' are all required
-            # to be valid keys, just let KeyError happen if any one of
-            # them is missing. But we also require 'name' to be True.
-            name = metric['name']
-            item = MetricItem(value=metric['value'],
-                              timestamp=metric['timestamp'],
-                              source=metric['source'])
-            if name:
-                self.metrics[name] = item
-            else:
-                LOG.warn(_("Metric name unknown of %r") % item)
+            self._metrics = None
+            self._metrics_json = metrics
 
     def update_from_compute_node(self, compute):
         """Update information about a host from its compute_node info."""
@@ -207,6 +330,7 @@ class HostState(object):
         self.vcpus_total = compute['vcpus']
         self.vcpus_used = compute['vcpus_used']
         self.updated = compute['updated_at']
+        self.compute_updated = compute['updated_at']
         if 'pci_stats' in compute:
             self.pci_stats = pci_stats.PciDeviceStats(compute['pci_stats'])
         else:
@@ -233,33 +357,9 @@ class HostState(object):
         # Track number of instances on host
         self.num_instances = int(self.stats.get('num_instances', 0))
 
-        # Track number of instances by project_id
-        project_id_keys = [k for k in self.stats.keys() if
-                k.startswith("num_proj_")]
-        for key in project_id_keys:
-            project_id = key[9:]
-            self.num_instances_by_project[project_id] = int(self.stats[key])
-
-        # Track number of instances in certain vm_states
-        vm_state_keys = [k for k in self.stats.keys() if
-                k.startswith("num_vm_")]
-        for key in vm_state_keys:
-            vm_state = key[7:]
-            self.vm_states[vm_state] = int(self.stats[key])
-
-        # Track number of instances in certain task_states
-        task_state_keys = [k for k in self.stats.keys() if
-                k.startswith("num_task_")]
-        for key in task_state_keys:
-            task_state = key[9:]
-            self.task_states[task_state] = int(self.stats[key])
-
-        # Track number of instances by host_type
-        os_keys = [k for k in self.stats.keys() if
-                k.startswith("num_os_type_")]
-        for key in os_keys:
-            os = key[12:]
-            self.num_instances_by_os_type[os] = int(self.stats[key])
+        # The numbers of instances by project, vm_state, task_state and
+        # os_type are decoded from the stats when used.
+        self._reset_stats_categories()
 
         self.num_io_ops = int(self.stats.get('io_workload', 0))
 
@@ -331,6 +431,10 @@ class HostManager(object):
         # { (host, hypervisor_hostname) : { <service> : { cap k : v }}}
         self.service_states = {}
         self.host_state_map = {}
+        # { compute node id : compute node } for incremental loads
+        self._compute_nodes = {}
+        self._compute_nodes_since = None
+        self._compute_nodes_resync_at = None
         self.filter_handler = filters.HostFilterHandler()
         self.filter_classes = self.filter_handler.get_matching_classes(
                 CONF.scheduler_available_filters)
@@ -435,10 +539,62 @@ class HostManager(object):
         return self.filter_handler.get_filtered_objects(filter_classes,
                 hosts, filter_properties, index)
 
-    def get_weighed_hosts(self, hosts, weight_properties):
+    def get_weighed_hosts(self, hosts, weight_properties, bounds=None):
         """Weigh the hosts."""
         return self.weight_handler.get_weighed_objects(self.weight_classes,
-                hosts, weight_properties)
+                hosts, weight_properties, bounds)
+
+    def _needs_full_load(self):
+        return (self._compute_nodes_resync_at is None or
+                timeutils.is_older_than(
+                    self._compute_nodes_resync_at,
+                    CONF.scheduler_host_states_resync_interval))
+
+    def _get_compute_nodes(self, context):
+        """Return the compute nodes and the ids of those which changed.
+
+        The changed ids are None when all the compute nodes were loaded.
+        """
+        if not CONF.scheduler_incremental_host_states:
+            return db.compute_node_get_all(context), None
+
+        if self._needs_full_load():
+            LOG.debug(_("Loading all compute nodes"))
+            self._compute_nodes = {}
+            self._compute_nodes_since = None
+            self._compute_nodes_resync_at = timeutils.utcnow()
+            compute_nodes = db.compute_node_get_all(context)
+        else:
+            margin = datetime.timedelta(
+                seconds=CONF.scheduler_host_states_since_margin)
+            compute_nodes = db.compute_node_get_all(
+                context, updated_since=self._compute_nodes_since - margin)
+
+        nodes = {}
+        changed = set()
+        for compute in compute_nodes:
+            cached = self._compute_nodes.get(compute['id'])
+            if compute.get('unchanged'):
+                # Partial row of a node not updated since the previous load.
+                if cached is None:
+                    LOG.info(_("Compute node %s is unknown, reloading all "
+                               "compute nodes") % compute['id'])
+                    self._compute_nodes_resync_at = None
+                    return self._get_compute_nodes(context)
+                cached['service'] = compute['service']
+                nodes[compute['id']] = cached
+                continue
+            # Nodes updated within the margin are returned again.
+            if (cached is None or compute['updated_at'] is None or
+                    cached['updated_at'] != compute['updated_at']):
+                changed.add(compute['id'])
+            nodes[compute['id']] = compute
+            for timestamp in (compute['created_at'], compute['updated_at']):
+                if timestamp and (self._compute_nodes_since is None or
+                                  timestamp > self._compute_nodes_since):
+                    self._compute_nodes_since = timestamp
+        self._compute_nodes = nodes
+        return nodes.values(), changed
 
     def get_all_host_states(self, context):
         """Returns a list of HostStates that represents all the hosts
@@ -447,7 +603,8 @@ class HostManager(object):
         """
 
         # Get resource usage across the available compute nodes:
-        compute_nodes = db.compute_node_get_all(context)
+        compute_nodes, changed = self._get_compute_nodes(context)
+        aggregate_index = AggregateMetadataIndex()
         seen_nodes = set()
         for compute in compute_nodes:
             service = compute['service']
@@ -459,6 +616,7 @@ class HostManager(object):
             state_key = (host, node)
             capabilities = self.service_states.get(state_key, None)
             host_state = self.host_state_map.get(state_key)
+            updated = changed is None or compute['id'] in changed
             if host_state:
                 host_state.update_capabilities(capabilities,
                                                dict(service.iteritems()))
@@ -467,7 +625,10 @@ class HostManager(object):
                         capabilities=capabilities,
                         service=dict(service.iteritems()))
                 self.host_state_map[state_key] = host_state
-            host_state.update_from_compute_node(compute)
+                updated = True
+            if updated:
+                host_state.update_from_compute_node(compute)
+            host_state.aggregate_index = aggregate_index
             seen_nodes.add(state_key)
 
         # remove compute nodes from host_state_map if they are not active
@@ -32,11 +32,13 @@ from nova import exception
 from nova import manager
 from nova.objects import instance as instance_obj
 from nova.openstack.common import excutils
+from nova.openstack.common.gettextutils import _
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import periodic_task
 from nova import quota
+from nova.scheduler import profiler
 from nova.scheduler import utils as scheduler_utils
 
 
@@ -269,6 +271,18 @@ class SchedulerManager(manager.Manager):
     def _run_periodic_tasks(self, context):
         self.driver.run_periodic_tasks(context)
 
+    @periodic_task.periodic_task(
+        spacing=CONF.scheduler_profiling_log_interval)
+    def _log_scheduler_stats(self, context):
+        if CONF.scheduler_profiling and profiler.STATS.counters['requests']:
+            LOG.info(_("Scheduler stats: %s"), profiler.STATS.summary())
+
+    def get_scheduler_stats(self, context):
+        """Returns the counters and timing histograms of the scheduling
+        requests, recorded when scheduler_profiling is enabled.
+        """
+        return profiler.STATS.to_dict()
+
     # NOTE(russellb) This method can be removed in 3.0 of this API.  It is
     # deprecated in favor of the method in the base API.
     def get_backdoor_port(self, context):
@@ -299,7 +313,7 @@ class SchedulerManager(manager.Manager):
 
 class _SchedulerManagerV3Proxy(object):
 
-    target = messaging.Target(version='3.0')
+    target = messaging.Target(version='3.1')
 
     def __init__(self, manager):
         self.manager = manager
@@ -324,3 +338,6 @@ class _SchedulerManagerV3Proxy(object):
                 instance_type=instance_type, image=image,
                 request_spec=request_spec, filter_properties=filter_properties,
                 reservations=reservations)
+
+    def get_scheduler_stats(self, ctxt):
+        return self.manager.get_scheduler_stats(ctxt)
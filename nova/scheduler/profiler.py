@@ -0,0 +1,233 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Profiling of the scheduling requests.
+
+When scheduler_profiling is enabled, each scheduling request records the
+time spent in every filter and weigher, the number of hosts going in and
+out of each filter, the wall time of get_all_host_states and the number
+of DB queries issued. The profile of a request is logged at debug level
+and aggregated in the counters and histograms of STATS, which the
+scheduler manager logs periodically and returns from get_scheduler_stats.
+"""
+
+import bisect
+import collections
+import contextlib
+import functools
+import threading
+import time
+
+from oslo.config import cfg
+import sqlalchemy
+from sqlalchemy import event
+
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+profiler_opts = [
+    cfg.BoolOpt('scheduler_profiling',
+                default=False,
+                help='Record the time spent in each scheduler filter and '
+                     'weigher, the hosts they keep and the DB queries '
+                     'issued by every scheduling request'),
+    cfg.IntOpt('scheduler_profiling_log_interval',
+               default=600,
+               help='How often (in seconds) to log the scheduler '
+                    'profiling statistics'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(profiler_opts)
+
+# Upper bounds, in seconds, of the buckets of the timing histograms.
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_queries = {'count': 0, 'listening': False}
+
+
+def _count_query(*args, **kwargs):
+    _queries['count'] += 1
+
+
+def _listen_queries():
+    # NOTE: queries are counted for the whole process, so the count of a
+    # request includes the queries of the requests running concurrently.
+    if not _queries['listening']:
+        event.listen(sqlalchemy.engine.Engine, 'before_cursor_execute',
+                     _count_query)
+        _queries['listening'] = True
+
+
+class Histogram(object):
+    """Count, total, max and bucketed distribution of timings."""
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """Return the upper bound of the bucket of the given percentile."""
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        bounds = list(self.buckets) + ['inf']
+        return {'count': self.count,
+                'total': self.total,
+                'max': self.max,
+                'buckets': [[bound, count] for bound, count in
+                            zip(bounds, self.counts)]}
+
+
+class SchedulerStats(object):
+    """Counters and timing histograms aggregated over the requests."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = collections.defaultdict(int)
+        self.histograms = collections.defaultdict(Histogram)
+
+    def add_request(self, profile):
+        self.counters['requests'] += 1
+        self.counters['db_queries'] += profile.db_queries
+        self.histograms['request'].add(profile.elapsed)
+        for step in profile.steps:
+            name = '%s.%s' % (step['kind'], step['name'])
+            self.histograms[name].add(step['time'])
+            for key in ('hosts_in', 'hosts_out'):
+                if step.get(key) is not None:
+                    self.counters['%s.%s' % (name, key)] += step[key]
+
+    def to_dict(self):
+        return {'counters': dict(self.counters),
+                'histograms': dict((name, histogram.to_dict())
+                                   for name, histogram in
+                                   self.histograms.iteritems())}
+
+    def summary(self):
+        """Return the timings as a log line, most expensive first."""
+        entries = []
+        for name, histogram in sorted(self.histograms.iteritems(),
+                                      key=lambda item: -item[1].total):
+            entries.append('%s: count=%d avg=%.1fms p99=%.1fms max=%.1fms' %
+                           (name, histogram.count,
+                            histogram.total * 1000 / histogram.count,
+                            histogram.percentile(99) * 1000,
+                            histogram.max * 1000))
+        return '; '.join(['requests=%d db_queries=%d' %
+                          (self.counters['requests'],
+                           self.counters['db_queries'])] + entries)
+
+
+STATS = SchedulerStats()
+
+
+class RequestProfile(object):
+    """Timings of a single scheduling request."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.queries_at_start = _queries['count']
+        self.steps = []
+        self.elapsed = None
+        self.db_queries = None
+
+    def record(self, kind, name, elapsed, hosts_in=None, hosts_out=None):
+        self.steps.append({'kind': kind, 'name': name, 'time': elapsed,
+                           'hosts_in': hosts_in, 'hosts_out': hosts_out})
+
+    def finish(self):
+        self.elapsed = time.time() - self.started_at
+        self.db_queries = _queries['count'] - self.queries_at_start
+
+    def to_dict(self):
+        return {'time': self.elapsed, 'db_queries': self.db_queries,
+                'steps': self.steps}
+
+
+def current():
+    """Return the RequestProfile being recorded, if any."""
+    return getattr(_local, 'profile', None)
+
+
+@contextlib.contextmanager
+def profile_request():
+    """Profile the scheduling request run in the block.
+
+    Nested blocks are part of the outermost request.
+    """
+    if not CONF.scheduler_profiling or current() is not None:
+        yield current()
+        return
+    _listen_queries()
+    profile = RequestProfile()
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        _local.profile = None
+        profile.finish()
+        STATS.add_request(profile)
+        LOG.debug(_("Scheduling request profile: %s"), profile.to_dict())
+
+
+def profiled(f):
+    """Decorator profiling each call as a scheduling request."""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        with profile_request():
+            return f(*args, **kwargs)
+    return wrapper
+
+
+def record(kind, name, elapsed, hosts_in=None, hosts_out=None):
+    """Record a step of the scheduling request being profiled."""
+    profile = current()
+    if profile is not None:
+        profile.record(kind, name, elapsed, hosts_in, hosts_out)
+
+
+@contextlib.contextmanager
+def timed(kind, name):
+    """Record the time spent in the block as a step of the request."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(kind, name, time.time() - start)
@@ -80,6 +80,7 @@ class SchedulerAPI(object):
         ... - Deprecated select_hosts()
 
         3.0 - Removed backwards compat
+        3.1 - Add get_scheduler_stats()
     '''
 
     VERSION_ALIASES = {
@@ -127,3 +128,7 @@ class SchedulerAPI(object):
                    image=image_p, request_spec=request_spec,
                    filter_properties=filter_properties,
                    reservations=reservations_p)
+
+    def get_scheduler_stats(self, ctxt):
+        cctxt = self.client.prepare(version='3.1')
+        return cctxt.call(ctxt, 'get_scheduler_stats')
@@ -19,6 +19,7 @@ Scheduler host weights
 
 from oslo.config import cfg
 
+from nova.scheduler import profiler
 from nova import weights
 
 CONF = cfg.CONF
@@ -46,6 +47,9 @@ class HostWeightHandler(weights.BaseWeightHandler):
     def __init__(self):
         super(HostWeightHandler, self).__init__(BaseHostWeigher)
 
+    def _weigher_done(self, cls_name, elapsed, num_objs):
+        profiler.record('weigher', cls_name, elapsed, num_objs)
+
 
 def all_weighers():
     """Return a list of weight plugin classes found in this directory."""
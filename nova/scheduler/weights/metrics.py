@@ -29,6 +29,7 @@ in the configuration file as the followings:
 from oslo.config import cfg
 
 from nova import exception
+from nova.scheduler import columnar
 from nova.scheduler import utils
 from nova.scheduler import weights
 
@@ -102,3 +103,41 @@ class MetricsWeigher(weights.BaseHostWeigher):
                         return CONF.metrics.weight_of_unavailable
 
         return value
+
+    def weigh_objects(self, weighed_obj_list, weight_properties):
+        """Read the metrics of all hosts as columns when enabled."""
+        if not self.setting or not columnar.enabled(weighed_obj_list):
+            return super(MetricsWeigher, self).weigh_objects(
+                    weighed_obj_list, weight_properties)
+        numpy = columnar.numpy
+        columns = columnar.HostStateColumns([obj.obj for obj in
+                                             weighed_obj_list])
+        values = numpy.zeros(len(columns))
+        missing = numpy.zeros(len(columns), dtype=bool)
+        unavailable = numpy.zeros(len(columns), dtype=bool)
+        for (name, ratio) in self.setting:
+            metric = columns.metric(name)
+            missing_metric = numpy.isnan(metric)
+            values += numpy.where(missing_metric, 0.0, metric) * ratio
+            missing |= missing_metric
+            if ratio * self.weight_multiplier() != 0:
+                unavailable |= missing_metric
+
+        if CONF.metrics.required and missing.any():
+            # Report the first host and metric the per host weighing
+            # would have failed on.
+            host_state = columns.host_states[numpy.flatnonzero(missing)[0]]
+            name = [name for (name, ratio) in self.setting
+                    if name not in host_state.metrics][0]
+            raise exception.ComputeHostMetricNotFound(
+                    host=host_state.host,
+                    node=host_state.nodename,
+                    name=name)
+        weights = numpy.where(unavailable, CONF.metrics.weight_of_unavailable,
+                              values)
+        lowest, highest = weights.min(), weights.max()
+        self.minval = (lowest if self.minval is None else
+                       min(self.minval, lowest))
+        self.maxval = (highest if self.maxval is None else
+                       max(self.maxval, highest))
+        return weights.tolist()
@@ -22,6 +22,7 @@ number and the weighing has the opposite effect of the default.
 
 from oslo.config import cfg
 
+from nova.scheduler import columnar
 from nova.scheduler import weights
 
 ram_weight_opts = [
@@ -45,3 +46,18 @@ class RAMWeigher(weights.BaseHostWeigher):
     def _weigh_object(self, host_state, weight_properties):
         """Higher weights win.  We want spreading to be the default."""
         return host_state.free_ram_mb
+
+    def weigh_objects(self, weighed_obj_list, weight_properties):
+        """Read the free RAM of all hosts as a column when enabled."""
+        if not columnar.enabled(weighed_obj_list):
+            return super(RAMWeigher, self).weigh_objects(weighed_obj_list,
+                                                         weight_properties)
+        columns = columnar.HostStateColumns([obj.obj for obj in
+                                             weighed_obj_list])
+        weights = columns['free_ram_mb']
+        lowest, highest = weights.min(), weights.max()
+        self.minval = (lowest if self.minval is None else
+                       min(self.minval, lowest))
+        self.maxval = (highest if self.maxval is None else
+                       max(self.maxval, highest))
+        return weights.tolist()
@@ -0,0 +1,93 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the coalescing of the heartbeats in conductor."""
+
+import mock
+from oslo.config import cfg
+
+from nova.conductor import coalescer
+from nova import test
+
+CONF = cfg.CONF
+
+
+class UpdateCoalescerTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(UpdateCoalescerTestCase, self).setUp()
+        self.flags(heartbeat_flush_interval=2, group='conductor')
+        self.db = mock.Mock()
+        self.db.service_update_all.return_value = set()
+        self.db.compute_node_update_all.return_value = set()
+        self.coalescer = coalescer.UpdateCoalescer(self.db)
+        patcher = mock.patch('eventlet.greenthread.spawn_after')
+        self.spawn_after = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_enabled(self):
+        self.assertTrue(self.coalescer.enabled())
+        self.flags(heartbeat_flush_interval=0, group='conductor')
+        self.assertFalse(self.coalescer.enabled())
+
+    def test_flush_interval_capped(self):
+        self.flags(service_down_time=60)
+        self.flags(heartbeat_flush_interval=30, group='conductor')
+        coalescer.UpdateCoalescer(self.db)
+        self.assertEqual(6, CONF.conductor.heartbeat_flush_interval)
+
+    def test_flush(self):
+        for host in range(100):
+            self.coalescer.service_update(host, {'report_count': 1})
+            self.coalescer.compute_node_update(host, {'vcpus_used': 1})
+        self.coalescer.service_update(1, {'report_count': 2})
+        self.spawn_after.assert_called_once_with(2, self.coalescer.flush)
+
+        self.coalescer.flush()
+        services = dict((host, {'report_count': 1}) for host in range(100))
+        services[1] = {'report_count': 2}
+        self.db.service_update_all.assert_called_once_with(mock.ANY,
+                                                           services)
+        self.db.compute_node_update_all.assert_called_once_with(
+            mock.ANY, dict((host, {'vcpus_used': 1}) for host in range(100)))
+        self.assertEqual({}, self.coalescer.services)
+
+        # The next update schedules the next flush.
+        self.coalescer.service_update(1, {'report_count': 3})
+        self.assertEqual(2, self.spawn_after.call_count)
+
+    def test_flush_nothing(self):
+        self.coalescer.flush()
+        self.assertFalse(self.db.service_update_all.called)
+        self.assertFalse(self.db.compute_node_update_all.called)
+
+    def test_flush_failure_retried(self):
+        self.db.compute_node_update_all.side_effect = Exception()
+        self.coalescer.compute_node_update(1, {'vcpus_used': 1,
+                                               'free_ram_mb': 512})
+        self.coalescer.compute_node_update(2, {'vcpus_used': 2})
+
+        def service_update_all(context, services):
+            # A resource update received while the flush is running.
+            self.coalescer.compute_node_update(1, {'vcpus_used': 3})
+            return set()
+
+        self.db.service_update_all.side_effect = service_update_all
+        self.coalescer.service_update(1, {'report_count': 2})
+        self.coalescer.flush()
+        self.assertEqual({1: {'vcpus_used': 3, 'free_ram_mb': 512},
+                          2: {'vcpus_used': 2}},
+                         self.coalescer.compute_nodes)
+        self.assertEqual(2, self.spawn_after.call_count)
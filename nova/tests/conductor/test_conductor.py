@@ -524,6 +524,52 @@ class ConductorTestCase(_BaseTestCase, test.TestCase):
         self.conductor = conductor_manager.ConductorManager()
         self.conductor_manager = self.conductor
 
+    @mock.patch.object(db, 'compute_node_update_all')
+    @mock.patch.object(db, 'compute_node_update')
+    @mock.patch('eventlet.greenthread.spawn_after')
+    def test_compute_node_update_coalesced(self, spawn_after, update,
+                                           update_all):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.flags(heartbeat_flush_interval=1, group='conductor')
+        node = {'id': 'fake-id', 'vcpus': 2, 'vcpus_used': 0}
+        self.conductor.compute_node_update(
+            self.context, node, {'vcpus_used': 1, 'free_ram_mb': 512})
+        result = self.conductor.compute_node_update(self.context, node,
+                                                    {'vcpus_used': 2})
+        self.assertEqual(2, result['vcpus_used'])
+        self.assertIn('updated_at', result)
+        spawn_after.assert_called_once_with(
+            1, self.conductor.coalescer.flush)
+        self.assertFalse(update.called)
+        self.conductor.cleanup_host()
+        update_all.assert_called_once_with(
+            mock.ANY, {'fake-id': {'vcpus_used': 2, 'free_ram_mb': 512,
+                                   'updated_at': timeutils.utcnow()}})
+
+    @mock.patch.object(db, 'service_update_all')
+    @mock.patch.object(db, 'service_update')
+    @mock.patch('eventlet.greenthread.spawn_after')
+    def test_service_update_heartbeat_coalesced(self, spawn_after, update,
+                                                update_all):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.flags(heartbeat_flush_interval=1, group='conductor')
+        service = {'id': 'fake-id', 'report_count': 1}
+        result = self.conductor.service_update(self.context, service,
+                                               {'report_count': 2})
+        self.assertEqual(2, result['report_count'])
+        self.assertFalse(update.called)
+        # Other updates are written immediately.
+        self.conductor.service_update(self.context, service,
+                                      {'disabled': True})
+        update.assert_called_once_with(self.context, 'fake-id',
+                                       {'disabled': True})
+        self.conductor.coalescer.flush()
+        update_all.assert_called_once_with(
+            mock.ANY, {'fake-id': {'report_count': 2,
+                                   'updated_at': timeutils.utcnow()}})
+
     def test_instance_info_cache_update(self):
         fake_values = {'key1': 'val1', 'key2': 'val2'}
         fake_inst = {'uuid': 'fake-uuid'}
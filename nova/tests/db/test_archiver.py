@@ -0,0 +1,134 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the archiving of the deleted rows."""
+
+import os
+
+import fixtures
+
+from nova import context
+from nova.db import archiver
+from nova import exception
+from nova.openstack.common import jsonutils
+from nova import test
+
+
+class ArchiverTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(ArchiverTestCase, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'watermarks.json')
+        self.flags(archive_max_batch_size=4, archive_batch_time=10,
+                   archive_sleep_ratio=1, archive_max_replica_lag=10,
+                   archive_watermark_file=self.path)
+        # Keys of the deleted rows of each table.
+        self.deleted = {'instance_system_metadata': range(1, 11),
+                        'instances': [3, 5]}
+        self.referenced = set()
+        self.lags = []
+        self.calls = []
+        self.stubs.Set(archiver.db, 'archive_table_names',
+                       lambda ctxt: ['instance_system_metadata', 'instances',
+                                     'services'])
+        self.stubs.Set(archiver.db, 'archive_deleted_rows_batch',
+                       self._archive_deleted_rows_batch)
+        self.stubs.Set(archiver.db, 'replica_lag',
+                       lambda ctxt: self.lags.pop(0) if self.lags else None)
+        self.sleeps = []
+        self.archiver = archiver.Archiver(context.get_admin_context(),
+                                          sleep=self.sleeps.append)
+
+    def _archive_deleted_rows_batch(self, ctxt, tablename, max_rows,
+                                    marker=None):
+        self.calls.append((tablename, max_rows, marker))
+        keys = [key for key in self.deleted.get(tablename, [])
+                if marker is None or key > marker][:max_rows]
+        if self.referenced.intersection(keys):
+            raise exception.ArchiveRowReferenced(table=tablename,
+                                                 key=keys[-1])
+        for key in keys:
+            self.deleted[tablename].remove(key)
+        return {'rows': len(keys), 'marker': keys[-1] if keys else marker}
+
+    def test_archive_pass(self):
+        self.assertEqual(12, self.archiver.archive_pass())
+        self.assertEqual({'instance_system_metadata': [], 'instances': []},
+                         self.deleted)
+        self.assertEqual([('instance_system_metadata', 4, None),
+                          ('instance_system_metadata', 4, 4),
+                          ('instance_system_metadata', 4, 8),
+                          ('instance_system_metadata', 4, 10),
+                          ('instances', 4, None),
+                          ('instances', 4, 5),
+                          ('services', 4, None)], self.calls)
+        self.assertEqual({'instance_system_metadata': 10, 'instances': 2},
+                         dict(self.archiver.rows))
+        # The watermarks of the drained tables are cleared.
+        self.assertEqual({}, self.archiver.watermarks)
+        with open(self.path) as f:
+            self.assertEqual({}, jsonutils.loads(f.read()))
+
+    def test_resume_from_watermark(self):
+        with open(self.path, 'w') as f:
+            f.write(jsonutils.dumps({'instance_system_metadata': 6}))
+        resumed = archiver.Archiver(sleep=self.sleeps.append)
+        self.assertEqual(4, resumed.archive_table('instance_system_metadata'))
+        self.assertEqual(('instance_system_metadata', 4, 6), self.calls[0])
+        self.assertEqual(range(1, 7), self.deleted['instance_system_metadata'])
+
+    def test_watermark_saved_after_each_batch(self):
+        self.archiver.archive_batch('instance_system_metadata')
+        with open(self.path) as f:
+            self.assertEqual({'instance_system_metadata': 4},
+                             jsonutils.loads(f.read()))
+
+    def test_skip_referenced_row(self):
+        self.referenced.add(3)
+        self.assertEqual(9, self.archiver.archive_table(
+            'instance_system_metadata'))
+        self.assertEqual([3], self.deleted['instance_system_metadata'])
+        # The batch is halved until it holds the referenced row alone.
+        self.assertEqual([('instance_system_metadata', 4, None),
+                          ('instance_system_metadata', 2, None),
+                          ('instance_system_metadata', 4, 2),
+                          ('instance_system_metadata', 2, 2),
+                          ('instance_system_metadata', 1, 2),
+                          ('instance_system_metadata', 1, 3),
+                          ('instance_system_metadata', 2, 4)],
+                         self.calls[:7])
+
+    def test_throttle(self):
+        self.archiver.batch_size = 2
+        self.archiver._throttle(1.5)
+        self.assertEqual(4, self.archiver.batch_size)
+        self.flags(archive_batch_time=1, archive_sleep_ratio=2)
+        self.lags = [30, 12, 3]
+        self.archiver._throttle(1.5)
+        self.assertEqual(2, self.archiver.batch_size)
+        self.assertEqual([1.5, 3.0, 30, 12], self.sleeps)
+        self.assertEqual([], self.lags)
+
+    def test_run_sleeps_when_idle(self):
+        self.stubs.Set(self.archiver, 'archive_pass', lambda: 0)
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            raise StopIteration()
+
+        self.archiver.sleep = sleep
+        self.assertRaises(StopIteration, self.archiver.run)
+        self.assertEqual([300], self.sleeps)
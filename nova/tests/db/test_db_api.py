@@ -46,6 +46,7 @@ from nova.db.sqlalchemy import utils as db_utils
 from nova import exception
 from nova.openstack.common.db import exception as db_exc
 from nova.openstack.common import jsonutils
+from nova.openstack.common import local
 from nova.openstack.common import timeutils
 from nova.openstack.common import uuidutils
 from nova import quota
@@ -169,6 +170,99 @@ class DecoratorTestCase(test.TestCase):
     def test_require_deadlock_retry_wraps_functions_properly(self):
         self._test_decorator_wraps_helper(sqlalchemy_api._retry_on_deadlock)
 
+    def test_read_replica_decorator_wraps_functions_properly(self):
+        self._test_decorator_wraps_helper(sqlalchemy_api.read_replica)
+
+
+class ReadReplicaTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ReadReplicaTestCase, self).setUp()
+        self.flags(replica_connection=['sqlite://'], replica_max_lag=30,
+                   replica_check_interval=10, group='database')
+        self.stubs.Set(sqlalchemy_api, '_REPLICA_POOL', None)
+        self.lag_checks = []
+        self.stubs.Set(sqlalchemy_api, '_replication_lag',
+                       lambda engine: self.lag_checks.append(engine) or
+                       self.lag)
+        self.lag = 0
+        self.context = context.get_admin_context()
+        self.replica = sqlalchemy_api._get_replica_pool().replicas[0]
+        self.replica_engine = self.replica.facade.get_engine()
+        self.primary_engine = sqlalchemy_api.get_engine()
+        self.engines = []
+
+        @sqlalchemy_api.read_replica
+        def read(context, fail=False):
+            engine = sqlalchemy_api.get_engine()
+            self.engines.append(engine)
+            if fail and engine is self.replica_engine:
+                raise db_exc.DBConnectionError()
+        self._read = read
+
+    def _set_request_context(self, ctxt):
+        self.addCleanup(setattr, local.store, 'context',
+                        getattr(local.store, 'context', None))
+        local.store.context = ctxt
+
+    def test_read_from_replica(self):
+        self._read(self.context)
+        self._read(self.context)
+        self.assertEqual([self.replica_engine] * 2, self.engines)
+        self.assertEqual(1, len(self.lag_checks))
+        # Calls which are not declared read-only use the primary.
+        self.assertIs(self.primary_engine, sqlalchemy_api.get_engine())
+
+    def test_lagging_replica_skipped(self):
+        self.lag = 31
+        self._read(self.context)
+        self.assertEqual([self.primary_engine], self.engines)
+
+    def test_read_your_writes(self):
+        self._set_request_context(self.context)
+        sqlalchemy_api._record_write(None, None, 'SELECT * FROM instances',
+                                     None, None, False)
+        self._read(self.context)
+        sqlalchemy_api._record_write(None, None, 'UPDATE instances SET',
+                                     None, None, False)
+        self._read(self.context)
+        # Other requests still read from the replica.
+        self._read(context.get_admin_context())
+        self.assertEqual([self.replica_engine, self.primary_engine,
+                          self.replica_engine], self.engines)
+
+    def test_failover_to_primary(self):
+        self._read(self.context, fail=True)
+        self._read(self.context)
+        self.assertEqual([self.replica_engine, self.primary_engine,
+                          self.primary_engine], self.engines)
+        self.assertFalse(self.replica.is_usable())
+
+    def test_use_slave_opt_in(self):
+        @sqlalchemy_api.read_replica
+        def read(context, host, use_slave=False):
+            self.engines.append(sqlalchemy_api.get_engine())
+
+        read(self.context, 'host1')
+        read(self.context, 'host1', use_slave=False)
+        read(self.context, 'host1', False)
+        read(self.context, 'host1', use_slave=True)
+        read(self.context, 'host1', True)
+        self.assertEqual([self.primary_engine] * 3 +
+                         [self.replica_engine] * 2, self.engines)
+
+    def test_liveness_reads_use_primary(self):
+        # The replica database of the test has no tables.
+        db.service_create(self.context, {'host': 'host1',
+                                         'binary': 'nova-compute',
+                                         'topic': 'compute'})
+        db.instance_create(self.context, {'host': 'host1'})
+        self.assertEqual(1, len(db.service_get_all(self.context)))
+        self.assertEqual(1, len(db.service_get_all_by_topic(self.context,
+                                                            'compute')))
+        self.assertEqual(1, len(db.instance_get_all_by_host(
+            self.context, 'host1', use_slave=False)))
+
 
 def _get_fake_aggr_values():
     return {'name': 'fake_aggregate'}
@@ -1704,6 +1798,39 @@ class InstanceTestCase(test.TestCase, ModelsObjectComparatorMixin):
                           'deleted', 'deleted_at', 'info_cache',
                           'pci_devices'])
 
+    def test_instance_get_all_by_filters_keyset_pages(self):
+        created_at = timeutils.utcnow()
+        instances = []
+        for i in range(7):
+            instances.append(self.create_instance_with_args(
+                display_name='name%d' % (i % 3),
+                created_at=created_at + datetime.timedelta(seconds=i % 2)))
+
+        for sort_key in ('created_at', 'display_name'):
+            for sort_dir in ('asc', 'desc'):
+                expected = sorted(instances, key=lambda inst: (
+                    inst[sort_key], inst['created_at'], inst['id']),
+                    reverse=sort_dir == 'desc')
+                pages = []
+                marker = None
+                while True:
+                    page = db.instance_get_all_by_filters(
+                        self.ctxt, {}, sort_key, sort_dir, limit=2,
+                        marker=marker)
+                    if not page:
+                        break
+                    pages.extend(page)
+                    marker = page[-1]['uuid']
+                self.assertEqual([inst['uuid'] for inst in expected],
+                                 [inst['uuid'] for inst in pages])
+
+    def test_instance_get_all_by_filters_marker_not_found(self):
+        self.create_instance_with_args()
+        self.assertRaises(exception.MarkerNotFound,
+                          db.instance_get_all_by_filters, self.ctxt, {},
+                          'created_at', 'desc',
+                          marker=str(stdlib_uuid.uuid4()))
+
     def test_instance_get_all_by_filters_deleted_and_soft_deleted(self):
         inst1 = self.create_instance_with_args()
         inst2 = self.create_instance_with_args(vm_state=vm_states.SOFT_DELETED)
@@ -2114,6 +2241,36 @@ class ServiceTestCase(test.TestCase, ModelsObjectComparatorMixin):
         for key, value in new_values.iteritems():
             self.assertEqual(value, updated_service[key])
 
+    def test_service_update_all(self):
+        service1 = self._create_service({})
+        service2 = self._create_service({'host': 'fake_host2'})
+        service3 = self._create_service({'host': 'fake_host3'})
+        db.service_destroy(self.ctxt, service3['id'])
+        missing = db.service_update_all(self.ctxt, {
+            service1['id']: {'report_count': 4},
+            service2['id']: {'report_count': 7, 'disabled': True},
+            service3['id']: {'report_count': 8}})
+        self.assertEqual(set([service3['id']]), missing)
+        service1 = db.service_get(self.ctxt, service1['id'])
+        service2 = db.service_get(self.ctxt, service2['id'])
+        self.assertEqual((4, False), (service1['report_count'],
+                                      service1['disabled']))
+        self.assertEqual((7, True), (service2['report_count'],
+                                     service2['disabled']))
+        self.assertIsNotNone(service1['updated_at'])
+
+    def test_service_update_all_chunks(self):
+        self.stubs.Set(sqlalchemy_api, '_UPDATE_ALL_MAX_PARAMS', 12)
+        services = [self._create_service({'host': 'host%d' % i})
+                    for i in range(5)]
+        missing = db.service_update_all(self.ctxt, dict(
+            (service['id'], {'report_count': 10 + i})
+            for i, service in enumerate(services)))
+        self.assertEqual(set(), missing)
+        for i, service in enumerate(services):
+            self.assertEqual(10 + i, db.service_get(
+                self.ctxt, service['id'])['report_count'])
+
     def test_service_update_not_found_exception(self):
         self.assertRaises(exception.ServiceNotFound,
                           db.service_update, self.ctxt, 100500, {})
@@ -4451,6 +4608,78 @@ class TaskLogTestCase(test.TestCase):
                           message=self.message)
 
 
+class KvmhaEvacuationTestCase(test.TestCase):
+
+    def setUp(self):
+        super(KvmhaEvacuationTestCase, self).setUp()
+        self.context = context.get_admin_context()
+
+    def _create(self, uuid, status='queued', priority=0,
+                source_host='failed'):
+        return db.kvmha_evacuation_create(self.context, {
+            'instance_uuid': uuid, 'source_host': source_host,
+            'dest_host': 'target', 'status': status, 'priority': priority})
+
+    def test_kvmha_evacuation_get_all_by_source_host(self):
+        self._create('low', priority=1)
+        self._create('high', priority=5)
+        self._create('done', status='done', priority=9)
+        self._create('other', source_host='other-host')
+
+        result = db.kvmha_evacuation_get_all_by_source_host(
+            self.context, 'failed', statuses=['queued', 'running'])
+        self.assertEqual(['high', 'low'],
+                         [r['instance_uuid'] for r in result])
+        result = db.kvmha_evacuation_get_all_by_source_host(self.context,
+                                                            'failed')
+        self.assertEqual(3, len(result))
+
+    def test_kvmha_evacuation_update(self):
+        evacuation = self._create('fake-uuid')
+        db.kvmha_evacuation_update(self.context, evacuation['id'],
+                                   {'status': 'running'})
+        result = db.kvmha_evacuation_get_all_by_source_host(self.context,
+                                                            'failed')
+        self.assertEqual('running', result[0]['status'])
+
+    def test_kvmha_evacuation_update_not_found(self):
+        self.assertRaises(exception.NotFound, db.kvmha_evacuation_update,
+                          self.context, 42, {'status': 'running'})
+
+    def test_kvmha_host_claim(self):
+        self.assertTrue(db.kvmha_host_claim(self.context, 'failed',
+                                            'kvmha1', 60))
+        self.assertFalse(db.kvmha_host_claim(self.context, 'failed',
+                                             'kvmha2', 60))
+        # The owner renews its claim.
+        self.assertTrue(db.kvmha_host_claim(self.context, 'failed',
+                                            'kvmha1', 60))
+        self.assertTrue(db.kvmha_host_claim(self.context, 'other',
+                                            'kvmha2', 60))
+
+    def test_kvmha_host_claim_expired(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.assertTrue(db.kvmha_host_claim(self.context, 'failed',
+                                            'kvmha1', 60))
+        timeutils.advance_time_seconds(61)
+        self.assertTrue(db.kvmha_host_claim(self.context, 'failed',
+                                            'kvmha2', 60))
+        self.assertFalse(db.kvmha_host_claim(self.context, 'failed',
+                                             'kvmha1', 60))
+
+    def test_kvmha_host_release(self):
+        db.kvmha_host_claim(self.context, 'failed', 'kvmha1', 60)
+        self.assertFalse(db.kvmha_host_release(self.context, 'failed',
+                                               'kvmha2'))
+        self.assertTrue(db.kvmha_host_release(self.context, 'failed',
+                                              'kvmha1'))
+        self.assertTrue(db.kvmha_host_claim(self.context, 'failed',
+                                            'kvmha2', 60))
+        self.assertTrue(db.kvmha_host_release(self.context, 'failed'))
+        self.assertFalse(db.kvmha_host_release(self.context, 'failed'))
+
+
 class BlockDeviceMappingTestCase(test.TestCase):
     def setUp(self):
         super(BlockDeviceMappingTestCase, self).setUp()
@@ -5400,6 +5629,196 @@ class QuotaTestCase(test.TestCase, ModelsObjectComparatorMixin):
                           'project1', 'resource1', 42)
 
 
+class QuotaReserveOptimisticTestCase(test.TestCase):
+
+    """Tests for db.api.quota_reserve_optimistic."""
+
+    def setUp(self):
+        super(QuotaReserveOptimisticTestCase, self).setUp()
+        self.ctxt = context.get_admin_context()
+        self.quotas = {'instances': 10, 'cores': 20}
+        self.resources = {}
+        sync_functions = dict(sqlalchemy_api.QUOTA_SYNC_FUNCTIONS)
+        for resource in self.quotas:
+            sync_name = '_sync_optimistic_%s' % resource
+            sync_functions[sync_name] = self._get_sync(resource)
+            self.resources[resource] = quota.ReservableResource(resource,
+                                                                sync_name)
+        self.stubs.Set(sqlalchemy_api, 'QUOTA_SYNC_FUNCTIONS',
+                       sync_functions)
+        self.stubs.Set(sqlalchemy_api, '_QUOTA_USAGE_LEDGER',
+                       sqlalchemy_api._QuotaUsageLedger())
+        self.snapshots = []
+        snapshot = sqlalchemy_api._quota_usage_snapshot
+
+        def fake_snapshot(context, project_id):
+            self.snapshots.append(project_id)
+            return snapshot(context, project_id)
+
+        self.stubs.Set(sqlalchemy_api, '_quota_usage_snapshot',
+                       fake_snapshot)
+
+    @staticmethod
+    def _get_sync(resource):
+        def sync(elevated, project_id, user_id, session):
+            return {resource: 0}
+        return sync
+
+    def _reserve(self, deltas, user_id='user1'):
+        return db.quota_reserve_optimistic(
+            self.ctxt, self.resources, self.quotas, self.quotas, deltas,
+            timeutils.utcnow() + datetime.timedelta(days=1), 0, 0,
+            'project1', user_id)
+
+    def _reserved(self, resource, user_id='user1'):
+        return db.quota_usage_get(self.ctxt, 'project1', resource,
+                                  user_id).reserved
+
+    def test_reserve(self):
+        # The usages are created by the locking path.
+        self._reserve({'instances': 1, 'cores': 2})
+        version = db.quota_usage_get(self.ctxt, 'project1', 'instances',
+                                     'user1').version
+        self._reserve({'instances': 1, 'cores': 2})
+        reservations = self._reserve({'instances': 1, 'cores': 2})
+        # The last reservation swapped the usages of the ledger.
+        self.assertEqual(['project1', 'project1'], self.snapshots)
+        self.assertEqual(3, self._reserved('instances'))
+        self.assertEqual(6, self._reserved('cores'))
+        self.assertEqual(version + 2, db.quota_usage_get(
+            self.ctxt, 'project1', 'instances', 'user1').version)
+        deltas = dict((reservation.resource, reservation.delta)
+                      for reservation in [_reservation_get(self.ctxt, uuid)
+                                          for uuid in reservations])
+        self.assertEqual({'instances': 1, 'cores': 2}, deltas)
+
+    def test_reserve_conflict(self):
+        self._reserve({'instances': 1})
+        self._reserve({'instances': 1})
+        db.quota_usage_update(self.ctxt, 'project1', 'user1', 'instances',
+                              in_use=3)
+        self._reserve({'instances': 1})
+        # The stale usages of the ledger were read again.
+        self.assertEqual(['project1'] * 3, self.snapshots)
+        self.assertEqual(3, self._reserved('instances'))
+
+    def test_reserve_shares_ledger_between_users(self):
+        self._reserve({'instances': 1})
+        self._reserve({'instances': 1}, user_id='user2')
+        self._reserve({'instances': 1})
+        self._reserve({'instances': 1}, user_id='user2')
+        self.assertEqual(['project1'] * 3, self.snapshots)
+        self.assertEqual(2, self._reserved('instances'))
+        self.assertEqual(2, self._reserved('instances', 'user2'))
+
+    def test_reserve_conflict_other_user(self):
+        self._reserve({'instances': 1})
+        self._reserve({'instances': 1}, user_id='user2')
+        self._reserve({'instances': 1})
+        db.quota_reserve(self.ctxt, self.resources, self.quotas, self.quotas,
+                         {'instances': 1}, timeutils.utcnow(), 0, 0,
+                         'project1', 'user2')
+        # The project quota was checked against a stale usage of user2.
+        self._reserve({'instances': 1})
+        self.assertEqual(['project1'] * 4, self.snapshots)
+        self.assertEqual(3, self._reserved('instances'))
+        self.assertEqual(2, self._reserved('instances', 'user2'))
+
+    def test_reserve_over_quota(self):
+        self.quotas['instances'] = 2
+        self._reserve({'instances': 1})
+        self._reserve({'instances': 1}, user_id='user2')
+        self.assertRaises(exception.OverQuota, self._reserve,
+                          {'instances': 1})
+        self.assertEqual(1, self._reserved('instances'))
+
+    def test_reserve_over_quota_user_inserted(self):
+        self.quotas['instances'] = 3
+        self._reserve({'instances': 1})
+        self._reserve({'instances': 1})
+        # The usage of user2 is not in the ledger.
+        db.quota_reserve(self.ctxt, self.resources, self.quotas, self.quotas,
+                         {'instances': 1}, timeutils.utcnow(), 0, 0,
+                         'project1', 'user2')
+        self.assertRaises(exception.OverQuota, self._reserve,
+                          {'instances': 1})
+        self.assertEqual(2, self._reserved('instances'))
+
+    def test_reserve_orm_update_bumps_version(self):
+        self._reserve({'instances': 1})
+        version = db.quota_usage_get(self.ctxt, 'project1', 'instances',
+                                     'user1').version
+        reservations = self._reserve({'instances': 1})
+        db.reservation_commit(self.ctxt, reservations, 'project1', 'user1')
+        self.assertEqual(version + 2, db.quota_usage_get(
+            self.ctxt, 'project1', 'instances', 'user1').version)
+
+    def test_usages_never_updated_need_refresh(self):
+        usages = {'instances': {'in_use': 0, 'until_refresh': None,
+                                'updated_at': None}}
+        self.assertTrue(sqlalchemy_api._quota_usages_need_refresh(
+            {'instances': 1}, usages, 60))
+        self.assertFalse(sqlalchemy_api._quota_usages_need_refresh(
+            {'instances': 1}, usages, 0))
+
+    def test_reserve_over_quota_stale_ledger(self):
+        self.quotas['instances'] = 2
+        self._reserve({'instances': 1})
+        reservations = self._reserve({'instances': 1})
+        db.reservation_rollback(self.ctxt, reservations, 'project1', 'user1')
+        # The ledger is over quota, the current usages are not.
+        self._reserve({'instances': 1})
+        self.assertEqual(['project1'] * 3, self.snapshots)
+        self.assertEqual(2, self._reserved('instances'))
+
+    def test_reserve_negative_delta(self):
+        self._reserve({'instances': 1})
+        self._reserve({'instances': -1})
+        self.assertEqual(1, self._reserved('instances'))
+
+    def test_reserve_until_refresh(self):
+        self._reserve({'instances': 1})
+        db.quota_usage_update(self.ctxt, 'project1', 'user1', 'instances',
+                              until_refresh=2)
+        calls = []
+        quota_reserve = sqlalchemy_api.quota_reserve
+
+        def fake_quota_reserve(*args, **kwargs):
+            calls.append(args[4])
+            return quota_reserve(*args, **kwargs)
+
+        self.stubs.Set(sqlalchemy_api, 'quota_reserve', fake_quota_reserve)
+        # The countdown is decremented without locking the usages.
+        self._reserve({'instances': 1})
+        self.assertEqual([], calls)
+        self.assertEqual(1, db.quota_usage_get(
+            self.ctxt, 'project1', 'instances', 'user1').until_refresh)
+        # The refresh is due, it is left to quota_reserve.
+        self._reserve({'instances': 1})
+        self.assertEqual([{'instances': 1}], calls)
+        self.assertEqual(3, self._reserved('instances'))
+
+    def test_reserve_attempts_exhausted(self):
+        self._reserve({'instances': 1})
+        self.flags(quota_reserve_attempts=0)
+        self._reserve({'instances': 1})
+        self.assertEqual(['project1'], self.snapshots)
+        self.assertEqual(2, self._reserved('instances'))
+
+    def test_ledger_eviction(self):
+        self.flags(quota_usage_ledger_size=2)
+        ledger = sqlalchemy_api._QuotaUsageLedger()
+        for project_id in ['p1', 'p2', 'p3']:
+            ledger.put(project_id, [{'resource': project_id}])
+            ledger.get('p1')
+        self.assertEqual([{'resource': 'p1'}], ledger.get('p1'))
+        self.assertIsNone(ledger.get('p2'))
+        self.assertEqual([{'resource': 'p3'}], ledger.get('p3'))
+        # The rows of the ledger are copied.
+        ledger.get('p3')[0]['resource'] = 'p4'
+        self.assertEqual([{'resource': 'p3'}], ledger.get('p3'))
+
+
 class QuotaClassTestCase(test.TestCase, ModelsObjectComparatorMixin):
 
     def setUp(self):
@@ -5585,6 +6004,27 @@ class ComputeNodeTestCase(test.TestCase, ModelsObjectComparatorMixin):
             # Clean up the service
             db.service_destroy(self.ctxt, service['id'])
 
+    def test_compute_node_get_all_updated_since(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        db.compute_node_update(self.ctxt, self.item['id'], {'vcpus_used': 1})
+        timeutils.advance_time_seconds(10)
+        updated_since = timeutils.utcnow()
+        compute_node_data = self.compute_node_dict.copy()
+        compute_node_data['hypervisor_hostname'] = 'new-node'
+        node = db.compute_node_create(self.ctxt, compute_node_data)
+
+        nodes = dict((n['id'], n) for n in db.compute_node_get_all(
+            self.ctxt, updated_since=updated_since))
+        self.assertEqual(2, len(nodes))
+        unchanged = nodes[self.item['id']]
+        self.assertEqual(['id', 'service', 'service_id', 'unchanged'],
+                         sorted(unchanged))
+        self.assertTrue(unchanged['unchanged'])
+        self.assertEqual(self.service['id'], unchanged['service']['id'])
+        self.assertEqual('new-node', nodes[node['id']]['hypervisor_hostname'])
+        self.assertNotIn('unchanged', nodes[node['id']])
+
     def test_compute_node_get_all_mult_compute_nodes_one_service_entry(self):
         service_data = self.service_dict.copy()
         service_data['host'] = 'host2'
@@ -5620,6 +6060,43 @@ class ComputeNodeTestCase(test.TestCase, ModelsObjectComparatorMixin):
         new_stats = jsonutils.loads(node['stats'])
         self.assertEqual(self.stats, new_stats)
 
+    def test_compute_node_update_all(self):
+        service = db.service_create(self.ctxt, dict(self.service_dict,
+                                                    host='host2'))
+        item2 = db.compute_node_create(self.ctxt, dict(
+            self.compute_node_dict, service_id=service['id'],
+            hypervisor_hostname='host2'))
+        missing = db.compute_node_update_all(self.ctxt, {
+            self.item['id']: {'vcpus_used': 1, 'free_ram_mb': 512,
+                              'service': 'ignored'},
+            item2['id']: {'vcpus_used': 2, 'free_ram_mb': 256}})
+        self.assertEqual(set(), missing)
+        node1 = db.compute_node_get(self.ctxt, self.item['id'])
+        node2 = db.compute_node_get(self.ctxt, item2['id'])
+        self.assertEqual((1, 512), (node1['vcpus_used'],
+                                    node1['free_ram_mb']))
+        self.assertEqual((2, 256), (node2['vcpus_used'],
+                                    node2['free_ram_mb']))
+        self.assertEqual(node1['updated_at'], node2['updated_at'])
+
+    def test_compute_node_update_all_skips_newer_rows(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        received_at = timeutils.utcnow()
+        timeutils.advance_time_seconds(10)
+        db.compute_node_update(self.ctxt, self.item['id'], {'vcpus_used': 3})
+        db.compute_node_update_all(self.ctxt, {
+            self.item['id']: {'vcpus_used': 1, 'updated_at': received_at}})
+        node = db.compute_node_get(self.ctxt, self.item['id'])
+        self.assertEqual(3, node['vcpus_used'])
+
+        db.compute_node_update_all(self.ctxt, {
+            self.item['id']: {'vcpus_used': 2,
+                              'updated_at': timeutils.utcnow() +
+                              datetime.timedelta(seconds=1)}})
+        node = db.compute_node_get(self.ctxt, self.item['id'])
+        self.assertEqual(2, node['vcpus_used'])
+
     def test_compute_node_update(self):
         compute_node_id = self.item['id']
         stats = jsonutils.loads(self.item['stats'])
@@ -6489,6 +6966,56 @@ class ArchiveTestCase(test.TestCase):
         self.assertEqual(len(rows), 4)
         return 0
 
+    def test_archive_deleted_rows_batch(self):
+        ids = []
+        for uuidstr in self.uuidstrs:
+            ins_stmt = self.instance_id_mappings.insert().values(uuid=uuidstr)
+            ids.append(self.conn.execute(ins_stmt).inserted_primary_key[0])
+        update_statement = self.instance_id_mappings.update().\
+                where(self.instance_id_mappings.c.id.in_(ids[1:5]))\
+                .values(deleted=1)
+        self.conn.execute(update_statement)
+        result = db.archive_deleted_rows_batch(self.context,
+                                               'instance_id_mappings', 3)
+        self.assertEqual({'rows': 3, 'marker': ids[3]}, result)
+        result = db.archive_deleted_rows_batch(self.context,
+                                               'instance_id_mappings', 3,
+                                               marker=ids[3])
+        self.assertEqual({'rows': 1, 'marker': ids[4]}, result)
+        result = db.archive_deleted_rows_batch(self.context,
+                                               'instance_id_mappings', 3,
+                                               marker=ids[4])
+        self.assertEqual({'rows': 0, 'marker': ids[4]}, result)
+        qsiim = select([self.shadow_instance_id_mappings.c.id]).\
+                where(self.shadow_instance_id_mappings.c.uuid.in_(
+                                                                self.uuidstrs))
+        self.assertEqual(ids[1:5], sorted(row[0] for row in
+                                          self.conn.execute(qsiim)))
+
+    def test_archive_deleted_rows_for_table(self):
+        ins_stmt = self.instance_id_mappings.insert().values(
+            uuid=self.uuidstrs[0], deleted=1)
+        self.conn.execute(ins_stmt)
+        user_context = context.RequestContext('fake', 'fake')
+        for archive in [db.archive_deleted_rows_for_table,
+                        db.archive_deleted_rows_batch]:
+            self.assertRaises(exception.AdminRequired, archive,
+                              user_context, 'instance_id_mappings', 10)
+        self.assertEqual(1, db.archive_deleted_rows_for_table(
+            self.context, 'instance_id_mappings', 10))
+        qsiim = select([self.shadow_instance_id_mappings.c.uuid]).\
+                where(self.shadow_instance_id_mappings.c.uuid.in_(
+                                                                self.uuidstrs))
+        self.assertEqual([self.uuidstrs[0]],
+                         [row[0] for row in self.conn.execute(qsiim)])
+
+    def test_archive_table_names(self):
+        tablenames = db.archive_table_names(self.context)
+        self.assertTrue(tablenames.index('consoles') <
+                        tablenames.index('console_pools'))
+        self.assertTrue(tablenames.index('instance_system_metadata') <
+                        tablenames.index('instances'))
+
     def test_archive_deleted_rows_no_id_column(self):
         uuidstr0 = self.uuidstrs[0]
         ins_stmt = self.dns_domains.insert().values(domain=uuidstr0)
@@ -0,0 +1,126 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of the pagination of instance_get_all_by_filters.
+
+Bulk inserts instances into the sqlite test database and pages through
+them the way 'nova list' does, for a project and across all projects.
+Set INSTANCE_LIST_BENCHMARK=1 to run it with a million instances:
+
+    INSTANCE_LIST_BENCHMARK=1 python -m testtools.run \\
+        nova.tests.db.test_instance_list_benchmark
+"""
+
+import datetime
+import os
+import time
+import uuid
+
+import testtools
+
+from nova.compute import vm_states
+from nova import context
+from nova import db
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import models
+from nova.openstack.common import timeutils
+from nova import test
+
+
+def _create_instances(count, projects, deleted_ratio=0.2, batch=10000):
+    """Bulk insert count instances spread over projects and hosts."""
+    engine = sqlalchemy_api.get_engine()
+    start = timeutils.utcnow() - datetime.timedelta(days=365)
+    rows = []
+    for i in xrange(count):
+        # Several instances share the same created_at, like the instances
+        # of a multiple instance boot.
+        rows.append({'id': i + 1,
+                     'uuid': str(uuid.uuid4()),
+                     'project_id': 'project%d' % (i % projects),
+                     'user_id': 'user',
+                     'host': 'host%d' % (i % 1000),
+                     'display_name': 'instance%d' % i,
+                     'vm_state': vm_states.ACTIVE,
+                     'created_at': start + datetime.timedelta(seconds=i // 3),
+                     'deleted': (i + 1) if i % int(1 / deleted_ratio) == 0
+                                else 0})
+        if len(rows) == batch:
+            engine.execute(models.Instance.__table__.insert(), rows)
+            rows = []
+    if rows:
+        engine.execute(models.Instance.__table__.insert(), rows)
+
+
+def _list_pages(ctxt, filters, limit, pages=None):
+    """Page through the instances like 'nova list'.
+
+    Returns the number of instances and the latency of each page.
+    """
+    marker = None
+    count = 0
+    latencies = []
+    while pages is None or len(latencies) < pages:
+        start = time.time()
+        page = db.instance_get_all_by_filters(ctxt, filters, 'created_at',
+                                              'desc', limit=limit,
+                                              marker=marker)
+        latencies.append(time.time() - start)
+        if not page:
+            break
+        count += len(page)
+        marker = page[-1]['uuid']
+    return count, latencies
+
+
+class InstanceListBenchmarkTestCase(test.TestCase):
+
+    def setUp(self):
+        super(InstanceListBenchmarkTestCase, self).setUp()
+        self.context = context.get_admin_context()
+
+    def test_pages(self):
+        _create_instances(300, projects=3)
+        count, latencies = _list_pages(self.context,
+                                       {'project_id': 'project1',
+                                        'deleted': False}, limit=7)
+        self.assertEqual(80, count)
+        count, latencies = _list_pages(self.context, {'deleted': False},
+                                       limit=50)
+        self.assertEqual(240, count)
+
+    @testtools.skipUnless(os.environ.get('INSTANCE_LIST_BENCHMARK'),
+                          'Set INSTANCE_LIST_BENCHMARK=1 to run the benchmark')
+    def test_instance_list_benchmark(self):
+        rows = int(os.environ.get('INSTANCE_LIST_BENCHMARK_ROWS', 1000000))
+        limit = int(os.environ.get('INSTANCE_LIST_BENCHMARK_LIMIT', 1000))
+        pages = int(os.environ.get('INSTANCE_LIST_BENCHMARK_PAGES', 50))
+        start = time.time()
+        _create_instances(rows, projects=100)
+        print('Created %d instances in %.1fs' % (rows, time.time() - start))
+
+        for name, filters in [
+                ('project', {'project_id': 'project1', 'deleted': False}),
+                ('all tenants', {'deleted': False}),
+                ('host', {'host': 'host1', 'deleted': False})]:
+            count, latencies = _list_pages(self.context, filters, limit,
+                                           pages)
+            latencies.sort()
+            print('%-12s %7d instance(s) in %3d page(s): total %.2fs, '
+                  'p50 %.1fms, max %.1fms' %
+                  (name, count, len(latencies), sum(latencies),
+                   latencies[len(latencies) // 2] * 1000,
+                   latencies[-1] * 1000))
@@ -595,6 +595,11 @@ class TestNovaMigrations(BaseWalkMigrationTestCase, CommonTestsMixIn):
         index_names = [idx.name for idx in t.indexes]
         self.assertIn(index, index_names)
 
+    def assertIndexNotExists(self, engine, table, index):
+        t = db_utils.get_table(engine, table)
+        index_names = [idx.name for idx in t.indexes]
+        self.assertNotIn(index, index_names)
+
     def assertIndexMembers(self, engine, table, index, members):
         self.assertIndexExists(engine, table, index)
 
@@ -695,6 +700,66 @@ class TestNovaMigrations(BaseWalkMigrationTestCase, CommonTestsMixIn):
         # confirm compute_node_stats exists
         db_utils.get_table(engine, 'compute_node_stats')
 
+    def _check_235(self, engine, data):
+        for table_name in ['kvmha_evacuations', 'shadow_kvmha_evacuations']:
+            for column in ['instance_uuid', 'source_host', 'dest_host',
+                           'status', 'priority']:
+                self.assertColumnExists(engine, table_name, column)
+        self.assertIndexMembers(engine, 'kvmha_evacuations',
+                                'kvmha_evacuations_source_host_status_idx',
+                                ['source_host', 'status', 'deleted'])
+
+    def _post_downgrade_235(self, engine):
+        self.assertTableNotExists(engine, 'kvmha_evacuations')
+        self.assertTableNotExists(engine, 'shadow_kvmha_evacuations')
+
+    def _check_236(self, engine, data):
+        for table_name in ['kvmha_host_claims', 'shadow_kvmha_host_claims']:
+            self.assertColumnExists(engine, table_name, 'host')
+            self.assertColumnExists(engine, table_name, 'owner')
+
+    def _post_downgrade_236(self, engine):
+        self.assertTableNotExists(engine, 'kvmha_host_claims')
+        self.assertTableNotExists(engine, 'shadow_kvmha_host_claims')
+
+    def _check_237(self, engine, data):
+        self.assertIndexMembers(engine, 'instances',
+                                'instances_project_id_deleted_created_at_idx',
+                                ['project_id', 'deleted', 'created_at', 'id'])
+        self.assertIndexMembers(engine, 'instances',
+                                'instances_deleted_created_at_idx',
+                                ['deleted', 'created_at', 'id'])
+
+    def _post_downgrade_237(self, engine):
+        self.assertIndexNotExists(
+            engine, 'instances', 'instances_project_id_deleted_created_at_idx')
+        self.assertIndexNotExists(engine, 'instances',
+                                  'instances_deleted_created_at_idx')
+
+    def _check_238(self, engine, data):
+        for table_name in ('quota_usages', 'shadow_quota_usages'):
+            self.assertColumnExists(engine, table_name, 'version')
+            table = db_utils.get_table(engine, table_name)
+            self.assertIsInstance(table.c.version.type,
+                                  sqlalchemy.types.Integer)
+            self.assertFalse(table.c.version.nullable)
+
+    def _post_downgrade_238(self, engine):
+        for table_name in ('quota_usages', 'shadow_quota_usages'):
+            self.assertColumnNotExists(engine, table_name, 'version')
+
+    def _check_239(self, engine, data):
+        for table_name in ('kvmha_evacuations', 'shadow_kvmha_evacuations'):
+            self.assertColumnExists(engine, table_name, 'attempts')
+            table = db_utils.get_table(engine, table_name)
+            self.assertIsInstance(table.c.attempts.type,
+                                  sqlalchemy.types.Integer)
+            self.assertFalse(table.c.attempts.nullable)
+
+    def _post_downgrade_239(self, engine):
+        for table_name in ('kvmha_evacuations', 'shadow_kvmha_evacuations'):
+            self.assertColumnNotExists(engine, table_name, 'attempts')
+
 
 class TestBaremetalMigrations(BaseWalkMigrationTestCase, CommonTestsMixIn):
     """Test sqlalchemy-migrate migrations."""
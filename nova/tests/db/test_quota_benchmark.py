@@ -0,0 +1,204 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of the concurrent quota reservations of a project.
+
+Runs concurrent reservations of a single project against the sqlite test
+database, through the locking quota_reserve and through
+quota_reserve_optimistic. The API workers are simulated by green threads
+with a ledger each, and the usages read are followed by a context switch
+so the reservations of the workers interleave.
+
+sqlite has no row locks, so the latencies do not show the lock waits of
+quota_reserve on MySQL or PostgreSQL. The statements per reservation, the
+locking reads of the quota usages and the reads of the optimistic
+reservations, retries included, do not depend on the backend. The
+optimistic reservations falling back to quota_reserve show up as locking
+reads. Set QUOTA_BENCHMARK=1 to run it with 200 reservations:
+
+    QUOTA_BENCHMARK=1 python -m testtools.run \\
+        nova.tests.db.test_quota_benchmark
+"""
+
+import datetime
+import os
+import time
+
+from eventlet import greenpool
+from eventlet import greenthread
+from sqlalchemy import event
+import testtools
+
+from nova import context
+from nova import db
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.openstack.common import timeutils
+from nova import quota
+from nova import test
+
+DELTAS = {'instances': 1, 'cores': 2}
+
+
+class _WorkerLedgers(object):
+    """One quota usage ledger per simulated API worker."""
+
+    def __init__(self, workers):
+        self.ledgers = [sqlalchemy_api._QuotaUsageLedger()
+                        for i in xrange(workers)]
+        self.threads = {}
+
+    def _ledger(self):
+        return self.ledgers[self.threads.get(greenthread.getcurrent(), 0)]
+
+    def get(self, project_id):
+        return self._ledger().get(project_id)
+
+    def put(self, project_id, rows):
+        self._ledger().put(project_id, rows)
+
+    def invalidate(self, project_id):
+        self._ledger().invalidate(project_id)
+
+
+class QuotaBenchmarkTestCase(test.TestCase):
+
+    def setUp(self):
+        super(QuotaBenchmarkTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.quotas = dict((resource, 100000) for resource in DELTAS)
+        self.resources = {}
+        sync_functions = dict(sqlalchemy_api.QUOTA_SYNC_FUNCTIONS)
+        for resource in DELTAS:
+            sync_name = '_sync_benchmark_%s' % resource
+            sync_functions[sync_name] = self._get_sync(resource)
+            self.resources[resource] = quota.ReservableResource(resource,
+                                                                sync_name)
+        self.stubs.Set(sqlalchemy_api, 'QUOTA_SYNC_FUNCTIONS',
+                       sync_functions)
+
+        self.statements = {'all': 0, 'locking_reads': 0, 'reads': 0}
+        self.counting = False
+        engine = sqlalchemy_api.get_engine()
+        event.listen(engine, 'before_cursor_execute', self._execute)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute',
+                        self._execute)
+        get_usages = sqlalchemy_api._get_project_user_quota_usages
+        snapshot = sqlalchemy_api._quota_usage_snapshot
+
+        def fake_get_usages(*args, **kwargs):
+            self.statements['locking_reads'] += 1
+            return get_usages(*args, **kwargs)
+
+        def fake_snapshot(context, project_id):
+            rows = snapshot(context, project_id)
+            self.statements['reads'] += 1
+            # Let the other workers run between the read and the swap.
+            greenthread.sleep(0)
+            return rows
+
+        self.stubs.Set(sqlalchemy_api, '_get_project_user_quota_usages',
+                       fake_get_usages)
+        self.stubs.Set(sqlalchemy_api, '_quota_usage_snapshot',
+                       fake_snapshot)
+
+    @staticmethod
+    def _get_sync(resource):
+        def sync(elevated, project_id, user_id, session):
+            return {resource: 0}
+        return sync
+
+    def _execute(self, conn, cursor, statement, parameters, exec_context,
+                 executemany):
+        if self.counting:
+            self.statements['all'] += 1
+
+    def _reserve_concurrently(self, reserve, count, workers, users=10):
+        """Run count reservations of one project from workers.
+
+        Returns the latency of each reservation.
+        """
+        ledgers = _WorkerLedgers(workers)
+        self.stubs.Set(sqlalchemy_api, '_QUOTA_USAGE_LEDGER', ledgers)
+        expire = timeutils.utcnow() + datetime.timedelta(days=1)
+        latencies = []
+
+        def run(i):
+            ledgers.threads[greenthread.getcurrent()] = i % workers
+            start = time.time()
+            reserve(self.context, self.resources, self.quotas, self.quotas,
+                    DELTAS, expire, 0, 0, 'project1', 'user%d' % (i % users))
+            latencies.append(time.time() - start)
+
+        # The usages of the users are created beforehand, both paths
+        # create them the same way.
+        for i in xrange(users):
+            run(i)
+        del latencies[:]
+        for key in self.statements:
+            self.statements[key] = 0
+
+        pool = greenpool.GreenPool(count)
+        self.counting = True
+        try:
+            for i in xrange(count):
+                pool.spawn_n(run, i)
+            pool.waitall()
+        finally:
+            self.counting = False
+        return latencies
+
+    def _reserved(self):
+        usages = db.quota_usage_get_all_by_project(self.context, 'project1')
+        return dict((resource, usages[resource]['reserved'])
+                    for resource in DELTAS)
+
+    def _check_reserved(self, count, users=10):
+        self.assertEqual(dict((resource, delta * (count + users))
+                              for resource, delta in DELTAS.items()),
+                         self._reserved())
+
+    def test_reserve(self):
+        self._reserve_concurrently(db.quota_reserve, 20, workers=4)
+        self._check_reserved(20)
+
+    def test_reserve_optimistic(self):
+        self._reserve_concurrently(db.quota_reserve_optimistic, 20,
+                                   workers=4)
+        self._check_reserved(20)
+
+    @testtools.skipUnless(os.environ.get('QUOTA_BENCHMARK'),
+                          'Set QUOTA_BENCHMARK=1 to run the benchmark')
+    def test_quota_benchmark(self):
+        count = int(os.environ.get('QUOTA_BENCHMARK_RESERVATIONS', 200))
+        workers = int(os.environ.get('QUOTA_BENCHMARK_WORKERS', 8))
+        for name, reserve in [('locking', db.quota_reserve),
+                              ('optimistic', db.quota_reserve_optimistic)]:
+            db.quota_destroy_all_by_project(self.context, 'project1')
+            start = time.time()
+            latencies = self._reserve_concurrently(reserve, count, workers)
+            elapsed = time.time() - start
+            self.assertEqual(count, len(latencies))
+            latencies.sort()
+            print('%-10s %d reservations in %.2fs (%.0f/s): p50 %.1fms, '
+                  'p99 %.1fms, max %.1fms, %.1f statements per '
+                  'reservation, %d locking reads, %d optimistic reads' %
+                  (name, count, elapsed, count / elapsed,
+                   latencies[len(latencies) // 2] * 1000,
+                   latencies[int(len(latencies) * 0.99)] * 1000,
+                   latencies[-1] * 1000,
+                   float(self.statements['all']) / count,
+                   self.statements['locking_reads'],
+                   self.statements['reads']))
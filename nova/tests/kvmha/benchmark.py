@@ -0,0 +1,354 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Recovery benchmark and fault injection harness for KVMHA.
+
+Simulates a cloud of compute hosts backed by nova.virt.fake.FakeDriver in
+the sqlite test database, kills hosts on a schedule through a fake
+servicegroup driver and drives a real KvmhaManager until every instance
+of the killed hosts has been rebuilt elsewhere. The report gives the
+detection latency, the planning time, the per-instance evacuation and
+recovery latencies and the number of DB queries, so changes to kvmha can
+be compared on recovery time.
+
+The harness is a fixture to be used from a test case, which provides the
+database and configuration. nova.tests.kvmha.test_benchmark runs it, set
+KVMHA_BENCHMARK=1 to run the full size scenario:
+
+    KVMHA_BENCHMARK=1 python -m testtools.run \\
+        nova.tests.kvmha.test_benchmark
+"""
+
+import collections
+import time
+
+from eventlet import greenthread
+import fixtures
+from sqlalchemy import event
+
+from nova.compute import flavors
+from nova.compute import power_state
+from nova.compute import task_states
+from nova.compute import vm_states
+from nova import context
+from nova import db
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.objects import instance as instance_obj
+from nova.openstack.common import importutils
+from nova import servicegroup
+from nova.servicegroup import api as servicegroup_api
+from nova.tests import utils as test_utils
+from nova import utils
+from nova.virt import fake
+
+
+class FakeServiceGroupDriver(servicegroup_api.ServiceGroupDriver):
+    """Servicegroup driver reporting the hosts not killed as up."""
+
+    def __init__(self, *args, **kwargs):
+        self.groups = collections.defaultdict(set)
+        self.down_hosts = set()
+
+    def join(self, member_id, group_id, service=None):
+        self.groups[group_id].add(member_id)
+
+    def is_up(self, member):
+        return member['host'] not in self.down_hosts
+
+    def leave(self, member_id, group_id):
+        self.groups[group_id].discard(member_id)
+
+    def get_all(self, group_id):
+        return sorted(self.groups[group_id] - self.down_hosts)
+
+
+class QueryCounter(object):
+    """Count the statements executed through the nova DB engine."""
+
+    def __init__(self):
+        self.count = 0
+        self.enabled = False
+        event.listen(sqlalchemy_api.get_engine(), 'before_cursor_execute',
+                     self._execute)
+
+    def _execute(self, conn, cursor, statement, parameters, exec_context,
+                 executemany):
+        if self.enabled:
+            self.count += 1
+
+
+class FakeComputeHost(object):
+    """Compute host rebuilding evacuated instances with a FakeDriver."""
+
+    def __init__(self, host, rebuild_time):
+        self.host = host
+        self.rebuild_time = rebuild_time
+        self.driver = fake.FakeDriver(None)
+
+    def get_available_resource(self, vcpus, memory_mb, local_gb):
+        resources = self.driver.get_available_resource(self.host)
+        resources.update({'vcpus': vcpus, 'memory_mb': memory_mb,
+                          'local_gb': local_gb})
+        return resources
+
+    def rebuild(self, ctxt, uuid, done):
+        greenthread.sleep(self.rebuild_time)
+        instance = instance_obj.Instance.get_by_uuid(ctxt, uuid)
+        self.driver.spawn(ctxt, instance, {}, [], None)
+        db.instance_update(ctxt, uuid, {'host': self.host,
+                                        'node': self.host,
+                                        'task_state': None})
+        done(uuid)
+
+
+class RecoveryBenchmark(fixtures.Fixture):
+    """Simulated compute hosts and a KvmhaManager recovering them.
+
+    :param hosts: number of compute hosts.
+    :param instances_per_host: number of instances booted on each host.
+    :param flavor_name: flavor of the instances.
+    :param headroom: spare capacity of every host as a multiple of the
+                     capacity used by its instances.
+    :param rebuild_time: simulated time in seconds to rebuild an instance.
+    :param detect_interval: interval in seconds between two runs of the
+                            kvmha periodic task.
+    :param manager: class name of the kvmha manager.
+    """
+
+    def __init__(self, hosts=10, instances_per_host=10, flavor_name='m1.tiny',
+                 headroom=1.0, rebuild_time=0, detect_interval=1,
+                 manager='nova.kvmha.manager.KvmhaManager'):
+        super(RecoveryBenchmark, self).__init__()
+        self.host_names = ['compute%d' % i for i in xrange(hosts)]
+        self.instances_per_host = instances_per_host
+        self.flavor_name = flavor_name
+        self.headroom = headroom
+        self.rebuild_time = rebuild_time
+        self.detect_interval = detect_interval
+        self.manager_class = manager
+
+    def setUp(self):
+        super(RecoveryBenchmark, self).setUp()
+        self.context = context.get_admin_context()
+        self.servicegroup = FakeServiceGroupDriver()
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.servicegroup.API._driver', self.servicegroup))
+        fake.set_nodes(self.host_names)
+        self.addCleanup(fake.restore_nodes)
+        self.queries = QueryCounter()
+        self.addCleanup(event.remove, sqlalchemy_api.get_engine(),
+                        'before_cursor_execute', self.queries._execute)
+
+        self.computes = {}
+        self.instances = {}
+        flavor = flavors.get_flavor_by_name(self.flavor_name)
+        for host in self.host_names:
+            self.computes[host] = FakeComputeHost(host, self.rebuild_time)
+            self._create_host(host, flavor)
+
+        self.manager = importutils.import_object(self.manager_class)
+        self.manager.evacuator.evacuate_fn = self._evacuate_instance
+        self._instrument()
+
+    def _create_host(self, host, flavor):
+        """Create the service, compute node and instances of a host."""
+        used = self.instances_per_host
+        scale = 1 + self.headroom
+        service = db.service_create(self.context, {
+            'host': host, 'binary': 'nova-compute', 'topic': 'compute',
+            'report_count': 0})
+        servicegroup.API().join(host, 'compute', service)
+        resources = self.computes[host].get_available_resource(
+            vcpus=int(used * flavor['vcpus'] * scale) or 1,
+            memory_mb=int(used * flavor['memory_mb'] * scale),
+            local_gb=int(used * flavor['root_gb'] * scale) or 1)
+        resources.update({
+            'service_id': service['id'],
+            'vcpus_used': used * flavor['vcpus'],
+            'memory_mb_used': used * flavor['memory_mb'],
+            'local_gb_used': used * flavor['root_gb'],
+            'free_ram_mb': (resources['memory_mb'] -
+                            used * flavor['memory_mb']),
+            'free_disk_gb': resources['local_gb'] - used * flavor['root_gb'],
+            'disk_available_least': (resources['local_gb'] -
+                                     used * flavor['root_gb']),
+            'hypervisor_version': utils.convert_version_to_int(
+                resources['hypervisor_version']),
+            'current_workload': 0,
+            'running_vms': used})
+        db.compute_node_create(self.context, resources)
+
+        for i in xrange(self.instances_per_host):
+            instance = db.instance_create(self.context, {
+                'host': host, 'node': host,
+                'display_name': '%s-instance%d' % (host, i),
+                'project_id': 'benchmark', 'user_id': 'benchmark',
+                'instance_type_id': flavor['id'],
+                'memory_mb': flavor['memory_mb'], 'vcpus': flavor['vcpus'],
+                'root_gb': flavor['root_gb'],
+                'ephemeral_gb': flavor['ephemeral_gb'],
+                'image_ref': 'benchmark-image', 'os_type': 'linux',
+                'vm_state': vm_states.ACTIVE,
+                'power_state': power_state.RUNNING,
+                'system_metadata': flavors.save_flavor_info({}, flavor)})
+            self.instances[instance['uuid']] = host
+
+    def _instrument(self):
+        """Wrap the kvmha manager to record timings and query counts."""
+        self.kill_times = {}
+        self.detect_times = {}
+        self.plan_times = []
+        self.request_times = {}
+        self.done_times = {}
+        self.detect_queries = 0
+        self.plan_queries = 0
+
+        driver = self.manager.driver
+        planner = self.manager.planner
+        evacuate = self.manager._evacuate
+        detect_failure_hosts = driver.detect_failure_hosts
+        plan = planner.plan
+
+        def timed_detect_failure_hosts():
+            queries = self.queries.count
+            try:
+                return detect_failure_hosts()
+            finally:
+                self.detect_queries += self.queries.count - queries
+
+        def timed_evacuate(failure_host):
+            self.detect_times.setdefault(failure_host, time.time())
+            return evacuate(failure_host)
+
+        def timed_plan(*args, **kwargs):
+            start = time.time()
+            queries = self.queries.count
+            try:
+                return plan(*args, **kwargs)
+            finally:
+                self.plan_times.append(time.time() - start)
+                self.plan_queries += self.queries.count - queries
+
+        self.useFixture(fixtures.MonkeyPatch(
+            '%s.detect_failure_hosts' % driver.__name__,
+            timed_detect_failure_hosts))
+        self.manager._evacuate = timed_evacuate
+        planner.plan = timed_plan
+
+    def _evacuate_instance(self, ctxt, instance, host):
+        """Issue a simulated evacuate to the FakeDriver of the target."""
+        self.request_times[instance['uuid']] = time.time()
+        db.instance_update(ctxt, instance['uuid'],
+                           {'task_state': task_states.REBUILDING})
+        greenthread.spawn_n(self.computes[host].rebuild, ctxt,
+                            instance['uuid'], self._rebuilt)
+
+    def _rebuilt(self, uuid):
+        self.done_times[uuid] = time.time()
+
+    def kill_host(self, host):
+        """Inject the failure of a compute host."""
+        self.kill_times[host] = time.time()
+        self.servicegroup.down_hosts.add(host)
+
+    def _recovered(self):
+        return all(uuid in self.done_times
+                   for uuid, host in self.instances.iteritems()
+                   if host in self.kill_times)
+
+    def run(self, kill_schedule, timeout=600):
+        """Kill hosts on a schedule and wait for their recovery.
+
+        :param kill_schedule: list of (delay in seconds, host) failures.
+        :param timeout: maximum time in seconds to wait for recovery.
+        :returns: the benchmark report, see report().
+        """
+        start = time.time()
+        for delay, host in kill_schedule:
+            greenthread.spawn_after(delay, self.kill_host, host)
+        last_kill = max(delay for delay, host in kill_schedule)
+
+        self.queries.enabled = True
+        try:
+            while time.time() - start < timeout:
+                self.manager.kvmha_proxy_run(self.context)
+                if (time.time() - start >= last_kill and
+                        len(self.kill_times) == len(kill_schedule) and
+                        self._recovered()):
+                    break
+                greenthread.sleep(self.detect_interval)
+        finally:
+            self.queries.enabled = False
+        return self.report(time.time() - start)
+
+    def report(self, elapsed):
+        """Summarize the recovery of the killed hosts.
+
+        Latencies are in seconds: detection is from the kill of a host to
+        the start of its evacuation, evacuation from the evacuate request
+        of an instance to its rebuild and recovery from the kill of its
+        host to its rebuild.
+        """
+        killed = [uuid for uuid, host in self.instances.iteritems()
+                  if host in self.kill_times]
+        stats = test_utils.latency_stats
+        return {
+            'elapsed': elapsed,
+            'hosts': len(self.host_names),
+            'hosts_killed': len(self.kill_times),
+            'instances_to_recover': len(killed),
+            'instances_recovered': len([uuid for uuid in killed
+                                        if uuid in self.done_times]),
+            'detection': stats([self.detect_times[host] - killed_at
+                                for host, killed_at in
+                                self.kill_times.iteritems()
+                                if host in self.detect_times]),
+            'planning': stats(self.plan_times),
+            'evacuation': stats([self.done_times[uuid] -
+                                 self.request_times[uuid]
+                                 for uuid in killed
+                                 if uuid in self.done_times]),
+            'recovery': stats([self.done_times[uuid] -
+                               self.kill_times[self.instances[uuid]]
+                               for uuid in killed
+                               if uuid in self.done_times]),
+            'db_queries': {'total': self.queries.count,
+                           'detection': self.detect_queries,
+                           'planning': self.plan_queries},
+            }
+
+
+def format_report(report):
+    """Format a benchmark report as a table."""
+    lines = ['Recovered %(instances_recovered)d/%(instances_to_recover)d '
+             'instance(s) of %(hosts_killed)d/%(hosts)d killed host(s) in '
+             '%(elapsed).2fs' % report,
+             '%-12s %6s %9s %9s %9s %9s %9s' % ('latency (s)', 'count', 'min',
+                                                'mean', 'p50', 'p95', 'max')]
+    for name in ('detection', 'planning', 'evacuation', 'recovery'):
+        stats = report[name]
+        if not stats['count']:
+            lines.append('%-12s %6d' % (name, 0))
+            continue
+        lines.append('%-12s ' % name +
+                     '%(count)6d %(min)9.3f %(mean)9.3f %(p50)9.3f '
+                     '%(p95)9.3f %(max)9.3f' % stats)
+    lines.append('DB queries: %(total)d total, %(detection)d detection, '
+                 '%(planning)d planning' % report['db_queries'])
+    return '\n'.join(lines)
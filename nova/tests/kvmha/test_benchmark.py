@@ -0,0 +1,67 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Recovery benchmark of nova-kvmha, see nova.tests.kvmha.benchmark
+"""
+
+import os
+
+import testtools
+
+from nova import test
+from nova.tests.kvmha import benchmark
+
+
+class RecoveryBenchmarkTestCase(test.TestCase):
+
+    def setUp(self):
+        super(RecoveryBenchmarkTestCase, self).setUp()
+        self.flags(kvmha_failure_threshold=1,
+                   kvmha_detect_shared_storage=False,
+                   kvmha_evacuate_poll_interval=0)
+
+    def test_recovery(self):
+        bench = self.useFixture(benchmark.RecoveryBenchmark(
+            hosts=3, instances_per_host=2, detect_interval=0))
+        report = bench.run([(0, 'compute0')], timeout=60)
+
+        self.assertEqual(1, report['hosts_killed'])
+        self.assertEqual(2, report['instances_recovered'])
+        self.assertEqual(1, report['detection']['count'])
+        self.assertEqual(2, report['evacuation']['count'])
+        self.assertTrue(report['db_queries']['planning'] > 0)
+        # The instances were rebuilt on the surviving hosts.
+        self.assertEqual(2, sum(len(compute.driver.instances)
+                                for compute in bench.computes.values()))
+        self.assertEqual({}, bench.computes['compute0'].driver.instances)
+        benchmark.format_report(report)
+
+    @testtools.skipUnless(os.environ.get('KVMHA_BENCHMARK'),
+                          'Set KVMHA_BENCHMARK=1 to run the benchmark')
+    def test_recovery_benchmark(self):
+        hosts = int(os.environ.get('KVMHA_BENCHMARK_HOSTS', 20))
+        instances = int(os.environ.get('KVMHA_BENCHMARK_INSTANCES', 10))
+        killed = int(os.environ.get('KVMHA_BENCHMARK_KILLED', 2))
+        interval = int(os.environ.get('KVMHA_BENCHMARK_KILL_INTERVAL', 5))
+        self.flags(kvmha_evacuate_poll_interval=1)
+        bench = self.useFixture(benchmark.RecoveryBenchmark(
+            hosts=hosts, instances_per_host=instances, rebuild_time=1))
+        report = bench.run([(i * interval, 'compute%d' % i)
+                            for i in xrange(killed)])
+        print(benchmark.format_report(report))
@@ -0,0 +1,63 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Unit Tests for nova.kvmha.capacity
+"""
+
+import mock
+
+from nova import context
+from nova.kvmha import capacity
+from nova import test
+from nova.tests.scheduler import fakes
+
+
+@mock.patch('nova.db.compute_node_get_all',
+            return_value=fakes.COMPUTE_NODES)
+class CapacitySnapshotTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(CapacitySnapshotTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.capacity = capacity.CapacitySnapshot()
+
+    def test_get_host_states_single_query(self, compute_node_get_all):
+        host_states = self.capacity.get_host_states(self.context,
+                                                    exclude='host1')
+        self.assertEqual(['host2', 'host3', 'host4'],
+                         sorted(hs.host for hs in host_states))
+        self.assertEqual(1024, self.capacity.get_available_memory(
+            self.context, 'host2'))
+        self.assertIsNone(self.capacity.get_available_memory(
+            self.context, 'unknown'))
+        self.assertEqual(1, compute_node_get_all.call_count)
+
+    def test_snapshot_keeps_consumption(self, compute_node_get_all):
+        host_state = self.capacity.get(self.context, 'host4')[0]
+        host_state.consume_from_instance({'root_gb': 1, 'ephemeral_gb': 0,
+                                          'memory_mb': 1024, 'vcpus': 1})
+        self.assertEqual(8192 - 1024, self.capacity.get_available_memory(
+            self.context, 'host4'))
+        self.assertEqual(1, compute_node_get_all.call_count)
+
+    def test_refresh_after_ttl(self, compute_node_get_all):
+        self.capacity.get_host_states(self.context)
+        self.capacity._loaded_at = self.capacity._loaded_at.replace(year=2000)
+        self.capacity.get_host_states(self.context)
+        self.assertEqual(2, compute_node_get_all.call_count)
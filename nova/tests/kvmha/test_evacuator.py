@@ -0,0 +1,172 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Unit Tests for nova.kvmha.evacuator
+"""
+
+import datetime
+
+import mock
+
+from nova.compute import task_states
+from nova.compute import vm_states
+from nova import context
+from nova.kvmha import evacuator
+from nova.openstack.common import timeutils
+from nova import test
+
+
+class FakeInstance(object):
+    def __init__(self, host, task_state=None, vm_state=vm_states.ACTIVE):
+        self.host = host
+        self.task_state = task_state
+        self.vm_state = vm_state
+
+
+class EvacuatorTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(EvacuatorTestCase, self).setUp()
+        self.flags(kvmha_evacuate_poll_interval=0,
+                   kvmha_target_max_workload=0)
+        self.context = context.get_admin_context()
+        self.evacuate_fn = mock.Mock()
+        self.evacuator = evacuator.Evacuator(self.evacuate_fn)
+        self.instances = [{'uuid': 'fake-uuid1'}, {'uuid': 'fake-uuid2'}]
+
+    @mock.patch('nova.objects.instance.Instance.get_by_uuid')
+    def test_evacuate_tracks_task_state(self, get_by_uuid):
+        get_by_uuid.side_effect = [
+            FakeInstance('failed', task_state=task_states.REBUILDING),
+            FakeInstance('target', task_state=task_states.REBUILD_SPAWNING),
+            FakeInstance('target'),
+            FakeInstance('target')]
+        placements = [(inst, 'target') for inst in self.instances]
+
+        results = self.evacuator.evacuate(self.context, placements)
+
+        self.assertEqual({'fake-uuid1': evacuator.EVACUATE_DONE,
+                          'fake-uuid2': evacuator.EVACUATE_DONE}, results)
+        self.assertEqual(2, self.evacuate_fn.call_count)
+        self.evacuate_fn.assert_any_call(self.context, self.instances[0],
+                                         'target')
+
+    @mock.patch('nova.objects.instance.Instance.get_by_uuid')
+    def test_evacuate_reports_error(self, get_by_uuid):
+        get_by_uuid.return_value = FakeInstance('failed',
+                                                vm_state=vm_states.ERROR)
+        results = self.evacuator.evacuate(self.context,
+                                          [(self.instances[0], 'target')])
+        self.assertEqual({'fake-uuid1': evacuator.EVACUATE_ERROR}, results)
+
+    def test_evacuate_request_failure(self):
+        self.evacuate_fn.side_effect = test.TestingException()
+        results = self.evacuator.evacuate(self.context,
+                                          [(self.instances[0], 'target')])
+        self.assertEqual({'fake-uuid1': evacuator.EVACUATE_FAILED}, results)
+
+    @mock.patch('nova.objects.instance.Instance.get_by_uuid')
+    def test_evacuate_timeout(self, get_by_uuid):
+        self.flags(kvmha_evacuate_timeout=0)
+        results = self.evacuator.evacuate(self.context,
+                                          [(self.instances[0], 'target')])
+        self.assertEqual({'fake-uuid1': evacuator.EVACUATE_TIMEOUT}, results)
+        self.assertFalse(get_by_uuid.called)
+
+    @mock.patch('nova.db.service_get_by_compute_host')
+    @mock.patch('nova.objects.instance.Instance.get_by_uuid')
+    def test_evacuate_back_pressure(self, get_by_uuid, service_get):
+        self.flags(kvmha_target_max_workload=2)
+        service_get.side_effect = [
+            {'compute_node': [{'current_workload': 3}]},
+            {'compute_node': [{'current_workload': 1}]}]
+        get_by_uuid.return_value = FakeInstance('target')
+
+        results = self.evacuator.evacuate(self.context,
+                                          [(self.instances[0], 'target')])
+
+        self.assertEqual({'fake-uuid1': evacuator.EVACUATE_DONE}, results)
+        self.assertEqual(2, service_get.call_count)
+
+    @mock.patch('nova.db.kvmha_evacuation_update')
+    @mock.patch('nova.db.service_get_by_compute_host')
+    def test_evacuate_back_pressure_timeout(self, service_get,
+                                            evacuation_update):
+        self.flags(kvmha_target_max_workload=2, kvmha_evacuate_timeout=0)
+        records = {'fake-uuid1': {'id': 1, 'status': 'queued'}}
+
+        results = self.evacuator.evacuate(self.context,
+                                          [(self.instances[0], 'target')],
+                                          records=records)
+
+        self.assertEqual({'fake-uuid1': evacuator.EVACUATE_TIMEOUT}, results)
+        self.assertFalse(self.evacuate_fn.called)
+        evacuation_update.assert_called_once_with(self.context, 1,
+                                                  {'status': 'timeout'})
+
+    def test_evacuate_deadline_starts_when_dispatched(self):
+        self.flags(kvmha_max_evacuations_per_host=1)
+        self.evacuator = evacuator.Evacuator(self.evacuate_fn)
+        deadlines = []
+
+        def wait_for_completion(context, instance, host, deadline):
+            deadlines.append(deadline)
+            timeutils.advance_time_seconds(60)
+            return evacuator.EVACUATE_DONE
+
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        placements = [(inst, 'target') for inst in self.instances]
+        with mock.patch.object(self.evacuator, '_wait_for_completion',
+                               side_effect=wait_for_completion):
+            self.evacuator.evacuate(self.context, placements)
+
+        # The second evacuation waited for the first one to finish.
+        self.assertEqual(datetime.timedelta(seconds=60),
+                         deadlines[1] - deadlines[0])
+
+    @mock.patch('nova.db.kvmha_evacuation_update')
+    @mock.patch('nova.objects.instance.Instance.get_by_uuid')
+    def test_evacuate_records_status(self, get_by_uuid, evacuation_update):
+        get_by_uuid.return_value = FakeInstance('target')
+        records = {'fake-uuid1': {'id': 1, 'status': 'queued'}}
+
+        self.evacuator.evacuate(self.context,
+                                [(self.instances[0], 'target')],
+                                records=records)
+
+        self.assertEqual(
+            [mock.call(self.context, 1, {'status': 'running'}),
+             mock.call(self.context, 1, {'status': 'done'})],
+            evacuation_update.call_args_list)
+
+    @mock.patch('nova.db.kvmha_evacuation_update')
+    @mock.patch('nova.objects.instance.Instance.get_by_uuid')
+    def test_evacuate_resumes_running(self, get_by_uuid, evacuation_update):
+        get_by_uuid.return_value = FakeInstance('target')
+        records = {'fake-uuid1': {'id': 1, 'status': 'running'}}
+
+        results = self.evacuator.evacuate(self.context,
+                                          [(self.instances[0], 'target')],
+                                          records=records)
+
+        self.assertEqual({'fake-uuid1': evacuator.EVACUATE_DONE}, results)
+        self.assertFalse(self.evacuate_fn.called)
+        evacuation_update.assert_called_once_with(self.context, 1,
+                                                  {'status': 'done'})
@@ -0,0 +1,163 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Unit Tests for nova.kvmha.event_driver
+"""
+
+import datetime
+
+import fixtures
+import mock
+from oslo.config import cfg
+
+from nova import exception
+from nova.kvmha import event_driver
+from nova.openstack.common import timeutils
+from nova import test
+
+CONF = cfg.CONF
+
+
+class HeartbeatTimeoutsTestCase(test.NoDBTestCase):
+
+    def test_pop_expired(self):
+        now = timeutils.utcnow()
+        timeouts = event_driver.HeartbeatTimeouts()
+        timeouts.schedule('host1', now - datetime.timedelta(seconds=1))
+        timeouts.schedule('host2', now + datetime.timedelta(seconds=1))
+        timeouts.schedule('host3', now - datetime.timedelta(seconds=2))
+        # Rescheduled hosts only expire at their latest deadline.
+        timeouts.schedule('host3', now + datetime.timedelta(seconds=2))
+
+        self.assertEqual(['host1'], timeouts.pop_expired(now))
+        self.assertEqual([], timeouts.pop_expired(now))
+        self.assertNotIn('host1', timeouts)
+        self.assertIn('host3', timeouts)
+
+
+class FakeServiceGroupAPI(object):
+    down_hosts = set()
+    members = []
+
+    def service_is_up(self, service):
+        return service['host'] not in self.down_hosts
+
+    def get_all(self, group_id):
+        return self.members
+
+
+class FailureWatcherTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(FailureWatcherTestCase, self).setUp()
+        self.flags(kvmha_failure_threshold=2, kvmha_watch_interval=1,
+                   kvmha_watch_resync_interval=600, service_down_time=60,
+                   kvmha_fence_failed_hosts=False, servicegroup_driver='db')
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.watcher = event_driver.FailureWatcher()
+        now = timeutils.utcnow()
+        self.services = [
+            {'id': 1, 'host': 'host1', 'disabled': False,
+             'updated_at': now, 'created_at': now},
+            {'id': 2, 'host': 'host2', 'disabled': False,
+             'updated_at': now, 'created_at': now}]
+        self.servicegroup_api = FakeServiceGroupAPI()
+        self.servicegroup_api.down_hosts = set()
+        self.query = mock.Mock(side_effect=lambda ctxt, topic: self.services)
+
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.db.service_get_all_by_topic', self.query))
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.servicegroup.API', lambda: self.servicegroup_api))
+
+    def test_no_query_before_deadline(self):
+        self.assertEqual([], self.watcher.tick())
+        timeutils.advance_time_seconds(1)
+        self.assertEqual([], self.watcher.tick())
+        self.assertEqual(1, self.query.call_count)
+
+    def test_failure_detected_after_deadline(self):
+        self.watcher.tick()
+        self.servicegroup_api.down_hosts = set(['host2'])
+        timeutils.advance_time_seconds(60)
+        self.assertEqual([], self.watcher.tick())
+        timeutils.advance_time_seconds(1)
+        self.assertEqual(['host2'], self.watcher.tick())
+        self.assertEqual(['host2'], self.watcher.pending)
+        # Still down, reported again on the next check.
+        timeutils.advance_time_seconds(1)
+        self.assertEqual(['host2'], self.watcher.tick())
+
+    @mock.patch('nova.db.service_get_by_compute_host',
+                side_effect=exception.ComputeHostNotFound(host='host2'))
+    @mock.patch('nova.db.kvmha_host_release')
+    def test_failed_host_recovery_detected_before_resync(self, host_release,
+                                                         get_service):
+        self.servicegroup_api.down_hosts = set(['host2'])
+        self.watcher.tick()
+        timeutils.advance_time_seconds(1)
+        self.assertEqual(['host2'], self.watcher.tick())
+        self.servicegroup_api.down_hosts = set()
+        timeutils.advance_time_seconds(1)
+        self.assertEqual([], self.watcher.tick())
+        host_release.assert_called_once_with(mock.ANY, 'host2', CONF.host)
+        self.assertEqual(set(), self.watcher.failed_hosts)
+
+    def test_failure_pushed_to_callback(self):
+        callback = mock.Mock()
+        self.stubs.Set(event_driver.utils, 'spawn_n',
+                       lambda func, *args: func(*args))
+        self.watcher.callback = callback
+        self.servicegroup_api.down_hosts = set(['host1'])
+        self.watcher.tick()
+        timeutils.advance_time_seconds(1)
+        self.watcher.tick()
+        callback.assert_called_once_with(['host1'])
+        self.assertEqual([], self.watcher.pending)
+
+    @mock.patch('nova.db.service_update')
+    def test_membership_driver(self, service_update):
+        self.flags(servicegroup_driver='zk', kvmha_fence_failed_hosts=True)
+        self.servicegroup_api.members = ['host1']
+        self.assertEqual([], self.watcher.tick())
+        self.assertEqual(['host2'], self.watcher.tick())
+        # Reported again but not fenced again.
+        self.assertEqual(['host2'], self.watcher.tick())
+        service_update.assert_called_once_with(mock.ANY, 2, mock.ANY)
+
+    @mock.patch('nova.db.service_get_by_compute_host',
+                side_effect=exception.ComputeHostNotFound(host='host2'))
+    @mock.patch('nova.db.kvmha_host_release')
+    def test_recovered_host_released(self, host_release, get_service):
+        self.flags(servicegroup_driver='zk')
+        self.servicegroup_api.members = ['host1']
+        self.watcher.tick()
+        self.assertEqual(['host2'], self.watcher.tick())
+        self.servicegroup_api.members = ['host1', 'host2']
+        self.watcher.tick()
+        host_release.assert_called_once_with(mock.ANY, 'host2', CONF.host)
+        self.assertEqual(set(), self.watcher.failed_hosts)
+
+    def test_host_filter(self):
+        self.watcher.host_filter = lambda host: host != 'host2'
+        self.servicegroup_api.down_hosts = set(['host1', 'host2'])
+        self.watcher.tick()
+        timeutils.advance_time_seconds(1)
+        self.assertEqual(['host1'], self.watcher.tick())
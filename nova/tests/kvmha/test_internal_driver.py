@@ -23,6 +23,7 @@
 Unit Tests for nova.kvmha.internal_driver
 """
 
+import fixtures
 import mox
 import mock
 from oslo.config import cfg
@@ -30,6 +31,7 @@ from oslo.config import cfg
 from nova import context
 from nova import exception
 from nova.kvmha import driver
+from nova.kvmha import internal_driver
 from nova.openstack.common import importutils
 from nova.openstack.common import log as logging
 from nova import test
@@ -60,3 +62,91 @@ class InternalDriverTestCase(test.TestCase):
         detect_failure_host.return_value = fake_host
         failure_host = self.driver.detect_failure_host()
         self.assertEqual(fake_host, failure_host)
+
+
+class MonitorManagerTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(MonitorManagerTestCase, self).setUp()
+        self.flags(kvmha_failure_threshold=2)
+        self.monitor = internal_driver.MonitorManager()
+        self.services = [
+            {'id': 1, 'host': 'host1', 'disabled': False},
+            {'id': 2, 'host': 'host1', 'disabled': False},
+            {'id': 3, 'host': 'host2', 'disabled': False},
+            {'id': 4, 'host': 'host3', 'disabled': False}]
+        self.down_hosts = set(['host1', 'host2'])
+
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.db.service_get_all_by_topic',
+            lambda ctxt, topic: self.services))
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.servicegroup.API.service_is_up',
+            lambda api, service: service['host'] not in self.down_hosts))
+
+    @mock.patch('nova.db.service_update')
+    def test_detect_all_failure_hosts_after_threshold(self, service_update):
+        self.flags(kvmha_fence_failed_hosts=True)
+        self.assertEqual([], self.monitor.detect_failure_hosts())
+        self.assertFalse(service_update.called)
+
+        failure_hosts = self.monitor.detect_failure_hosts()
+
+        self.assertEqual(['host1', 'host2'], sorted(failure_hosts))
+        self.assertEqual(2, service_update.call_count)
+        service_update.assert_any_call(
+            mock.ANY, 1, {'disabled': True,
+                          'disabled_reason': internal_driver.FENCED_REASON})
+        # The hosts still down are reported again but not fenced again.
+        self.assertEqual(['host1', 'host2'],
+                         sorted(self.monitor.detect_failure_hosts()))
+        self.assertEqual(2, service_update.call_count)
+
+    @mock.patch('nova.db.service_update')
+    def test_recovered_host_resets_count(self, service_update):
+        self.flags(kvmha_fence_failed_hosts=False)
+        self.monitor.detect_failure_hosts()
+        self.down_hosts = set(['host2'])
+        self.assertEqual(['host2'], self.monitor.detect_failure_hosts())
+        self.down_hosts = set(['host1', 'host2'])
+
+        self.assertEqual(['host2'], self.monitor.detect_failure_hosts())
+        self.assertEqual({'host1': 1}, self.monitor.missed_heartbeats)
+        self.assertFalse(service_update.called)
+
+    def test_host_filter(self):
+        self.flags(kvmha_failure_threshold=1, kvmha_fence_failed_hosts=False)
+        self.monitor.host_filter = lambda host: host != 'host1'
+        self.assertEqual(['host2'], self.monitor.detect_failure_hosts())
+
+    @mock.patch('nova.db.service_update')
+    @mock.patch('nova.db.service_get_by_compute_host')
+    @mock.patch('nova.db.kvmha_host_release')
+    def test_recovered_host_released(self, host_release, get_service,
+                                     service_update):
+        get_service.return_value = {
+            'id': 3, 'host': 'host2', 'disabled': True,
+            'disabled_reason': internal_driver.FENCED_REASON}
+        self.flags(kvmha_failure_threshold=1)
+        self.monitor.detect_failure_hosts()
+        self.down_hosts = set(['host1'])
+        self.assertEqual(['host1'], self.monitor.detect_failure_hosts())
+        host_release.assert_called_once_with(mock.ANY, 'host2', CONF.host)
+        # The service fenced by kvmha is enabled again.
+        service_update.assert_called_once_with(
+            mock.ANY, 3, {'disabled': False, 'disabled_reason': None})
+        self.down_hosts = set(['host1', 'host2'])
+        self.assertEqual(['host1', 'host2'],
+                         sorted(self.monitor.detect_failure_hosts()))
+
+    @mock.patch('nova.db.service_update')
+    @mock.patch('nova.db.service_get_by_compute_host')
+    @mock.patch('nova.db.kvmha_host_release')
+    def test_recovered_host_disabled_by_admin(self, host_release,
+                                              get_service, service_update):
+        get_service.return_value = {'id': 3, 'host': 'host2',
+                                    'disabled': True,
+                                    'disabled_reason': 'maintenance'}
+        internal_driver.host_recovered(context.get_admin_context(),
+                                       'host2')
+        self.assertFalse(service_update.called)
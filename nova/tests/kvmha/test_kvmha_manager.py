@@ -23,12 +23,17 @@
 Unit Tests for nova.kvmha.manager
 """
 
+import contextlib
+
+from eventlet import event
+from eventlet import greenthread
 import mox
 import mock
 from oslo.config import cfg
 
 import nova
 from nova import context
+from nova import db
 from nova import exception
 from nova.openstack.common import importutils
 from nova.openstack.common import log as logging
@@ -49,42 +54,175 @@ class KvmhaTestCase(test.TestCase):
         self.context = context.RequestContext('fake', 'fake')
         self.kvmha = importutils.import_object(CONF.kvmha_manager)
 
-    @mock.patch('nova.kvmha.manager.KvmhaManager._get_target_instances')
-    def test_get_target_instances(self, get_target_instances):
-        fake_host = 'fake-host'
+    @mock.patch('nova.db.instance_get_all_by_host')
+    def test_get_target_instances(self, instance_get_all_by_host):
         fake_instances = ['fake1', 'fake2']
-        get_target_instances.return_value = fake_instances
-        res = self.kvmha._get_target_instances(fake_host)
+        instance_get_all_by_host.return_value = fake_instances
+        res = self.kvmha._get_target_instances('fake-host')
         self.assertEqual(fake_instances, res)
+        instance_get_all_by_host.assert_called_once_with(
+            mock.ANY, 'fake-host', columns_to_join=None, use_slave=False)
+
+    def _test_evacuate_instance_via_compute_api(self, shared_hosts,
+                                                on_shared_storage):
+        instance = {'uuid': 'fake-uuid', 'display_name': 'fake',
+                    'host': 'failed'}
+        with contextlib.nested(
+            mock.patch.object(self.kvmha.compute_api, 'get',
+                              return_value=instance),
+            mock.patch.object(self.kvmha.compute_api, 'evacuate'),
+            mock.patch('nova.virt.storage_users.get_storage_users',
+                       return_value=shared_hosts)
+        ) as (get, evacuate, get_storage_users):
+            self.kvmha._evacuate_instance(self.context, instance, 'target')
+            get.assert_called_once_with(self.context, 'fake-uuid')
+            evacuate.assert_called_once_with(
+                self.context, instance, 'target',
+                on_shared_storage=on_shared_storage)
+
+    def test_evacuate_instance_via_compute_api(self):
+        self._test_evacuate_instance_via_compute_api([], False)
+
+    def test_evacuate_instance_on_shared_storage(self):
+        self._test_evacuate_instance_via_compute_api(['failed', 'target'],
+                                                     True)
+
+    def test_evacuate_resumes_recorded_evacuations(self):
+        ctxt = context.get_admin_context()
+        db.kvmha_evacuation_create(ctxt, {'instance_uuid': 'running',
+                                          'source_host': 'failed',
+                                          'dest_host': 'host1',
+                                          'status': 'running',
+                                          'priority': 0})
+        instances = [{'uuid': 'running'}, {'uuid': 'new'}]
+        with contextlib.nested(
+            mock.patch.object(self.kvmha, '_get_target_instances',
+                              return_value=instances),
+            mock.patch('nova.kvmha.priority.get_priorities',
+                       return_value={'new': 10}),
+            mock.patch.object(self.kvmha.planner, 'plan',
+                              return_value=([(instances[1], 'host2')], [])),
+            mock.patch.object(self.kvmha.evacuator, 'evacuate'),
+            mock.patch('nova.virt.storage_users.get_storage_users',
+                       return_value=[])
+        ) as (get_instances, get_priorities, plan, evacuate, storage_users):
+            self.kvmha._evacuate('failed')
+            plan.assert_called_once_with(mock.ANY, 'failed', [instances[1]],
+                                         priorities={'new': 10},
+                                         preferred_hosts=frozenset())
+            placements = evacuate.call_args[0][1]
+            records = evacuate.call_args[1]['records']
+
+        # The new evacuation has a higher priority than the resumed one.
+        self.assertEqual([(instances[1], 'host2'), (instances[0], 'host1')],
+                         placements)
+        self.assertEqual('queued', records['new']['status'])
+        self.assertEqual('running', records['running']['status'])
+
+    def test_evacuate_retries_failed_evacuations(self):
+        ctxt = context.get_admin_context()
+        retried = db.kvmha_evacuation_create(ctxt, {
+            'instance_uuid': 'retried', 'source_host': 'failed',
+            'dest_host': 'host1', 'status': 'failed', 'priority': 0,
+            'attempts': 1})
+        abandoned = db.kvmha_evacuation_create(ctxt, {
+            'instance_uuid': 'abandoned', 'source_host': 'failed',
+            'dest_host': 'host1', 'status': 'timeout', 'priority': 0,
+            'attempts': 3})
+        db.kvmha_evacuation_create(ctxt, {
+            'instance_uuid': 'given-up', 'source_host': 'failed',
+            'dest_host': 'host1', 'status': 'abandoned', 'priority': 0,
+            'attempts': 3})
+        instances = [{'uuid': 'retried'}, {'uuid': 'abandoned'},
+                     {'uuid': 'given-up'}]
+        with contextlib.nested(
+            mock.patch.object(self.kvmha, '_get_target_instances',
+                              return_value=instances),
+            mock.patch('nova.kvmha.priority.get_priorities',
+                       return_value={'retried': 5}),
+            mock.patch.object(self.kvmha.planner, 'plan',
+                              return_value=([(instances[0], 'host2')], [])),
+            mock.patch.object(self.kvmha.evacuator, 'evacuate'),
+            mock.patch('nova.virt.storage_users.get_storage_users',
+                       return_value=[])
+        ) as (get_instances, get_priorities, plan, evacuate, storage_users):
+            self.kvmha._evacuate('failed')
+            plan.assert_called_once_with(mock.ANY, 'failed', [instances[0]],
+                                         priorities={'retried': 5},
+                                         preferred_hosts=frozenset())
+            records = evacuate.call_args[1]['records']
+
+        # The failed evacuation record is reused by the next attempt.
+        self.assertEqual(retried['id'], records['retried']['id'])
+        self.assertEqual(2, records['retried']['attempts'])
+        self.assertEqual('host2', records['retried']['dest_host'])
+        evacuations = dict(
+            (record['instance_uuid'], record) for record in
+            db.kvmha_evacuation_get_all_by_source_host(ctxt, 'failed'))
+        self.assertEqual(3, len(evacuations))
+        self.assertEqual('queued', evacuations['retried']['status'])
+        self.assertEqual(abandoned['id'], evacuations['abandoned']['id'])
+        self.assertEqual('abandoned', evacuations['abandoned']['status'])
+
+    def test_evacuate_claimed_by_other_worker(self):
+        db.kvmha_host_claim(context.get_admin_context(), 'failed',
+                            'other-kvmha', 60)
+        with mock.patch.object(self.kvmha,
+                               '_get_target_instances') as get_instances:
+            self.assertEqual({}, self.kvmha._evacuate('failed'))
+            self.assertFalse(get_instances.called)
+
+    def test_evacuate_again_after_completion(self):
+        ctxt = context.get_admin_context()
+        with contextlib.nested(
+            mock.patch.object(self.kvmha, '_get_target_instances',
+                              return_value=[{'uuid': 'fake-uuid'}]),
+            mock.patch('nova.kvmha.priority.get_priorities',
+                       return_value={'fake-uuid': 0}),
+            mock.patch.object(self.kvmha.planner, 'plan',
+                              return_value=([], [])),
+            mock.patch.object(self.kvmha.evacuator, 'evacuate',
+                              return_value={}),
+            mock.patch('nova.virt.storage_users.get_storage_users',
+                       return_value=[])
+        ) as (get_instances, get_priorities, plan, evacuate, storage_users):
+            self.kvmha._evacuate('failed')
+            # The host failed again and is now owned by another worker.
+            self.assertTrue(db.kvmha_host_claim(ctxt, 'failed',
+                                                'other-kvmha', 3600))
+            db.kvmha_host_release(ctxt, 'failed')
+            self.kvmha._evacuate('failed')
+            self.assertEqual(2, evacuate.call_count)
+
+    def test_evacuate_failure_releases_claim(self):
+        with mock.patch.object(self.kvmha, '_get_target_instances',
+                               side_effect=exception.NovaException):
+            self.assertRaises(exception.NovaException,
+                              self.kvmha._evacuate, 'failed')
+        self.assertTrue(db.kvmha_host_claim(context.get_admin_context(),
+                                            'failed', 'other-kvmha', 3600))
 
-    @mock.patch('nova.kvmha.manager.KvmhaManager._sum_instances_memory')
-    def test_sum_instances_memory(self, sum_instances_memory):
-        fake_host = 'fake-host'
-        fake_memory = 1024
-        sum_instances_memory.return_value = fake_memory
-        total_memory = self.kvmha._sum_instances_memory(fake_host)
-        self.assertEqual(fake_memory, total_memory)
-
-    @mock.patch('nova.kvmha.manager.KvmhaManager._get_hosts')
-    def test_get_hosts(self, get_hosts):
-        fake_hosts = ['fake1', 'fake2']
-        get_hosts.return_value = fake_hosts
-        host_list = self.kvmha._get_hosts()
-        self.assertEqual(host_list, fake_hosts)
-
-    @mock.patch('nova.kvmha.manager.KvmhaManager._get_available_memory')
-    def test_get_available_memory(self, get_available_memory):
-        fake_host = 'fake-host'
-        fake_memory = 1024
-        get_available_memory.return_value = fake_memory
-        current_memory = self.kvmha._get_available_memory(fake_host)
-        self.assertEqual(current_memory, fake_memory)
-
-    @mock.patch('nova.kvmha.manager.KvmhaManager._lookup_available_node')
-    def test_lookup_available_node(self, lookup_available_node):
-        fake_host = 'fake-host'
-        expected_host = 'expected_host'
-        lookup_available_node.return_value = expected_host
-        target_host = self.kvmha._lookup_available_node(fake_host)
-        self.assertEqual(expected_host, target_host)
+    def test_handle_failure_hosts_owned_only(self):
+        with contextlib.nested(
+            mock.patch.object(self.kvmha.partitioner, 'owns',
+                              side_effect=lambda host: host == 'host1'),
+            mock.patch.object(self.kvmha, '_evacuate')
+        ) as (owns, evacuate):
+            self.kvmha._handle_failure_hosts(['host1', 'host2'])
+            self.kvmha._recovery_pool.waitall()
+            evacuate.assert_called_once_with('host1')
 
+    def test_handle_failure_hosts_does_not_wait(self):
+        evacuated = event.Event()
+        with mock.patch.object(self.kvmha, '_evacuate',
+                               side_effect=lambda host: evacuated.wait()
+                               ) as evacuate:
+            self.kvmha._handle_failure_hosts(['host1'])
+            # A host still being evacuated is not evacuated twice.
+            self.kvmha._handle_failure_hosts(['host1'])
+            greenthread.sleep(0)
+            self.assertEqual(set(['host1']), self.kvmha._recovering)
+            evacuated.send()
+            self.kvmha._recovery_pool.waitall()
+            evacuate.assert_called_once_with('host1')
+        self.assertEqual(set(), self.kvmha._recovering)
@@ -0,0 +1,105 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Unit Tests for nova.kvmha.partition
+"""
+
+import mock
+
+from nova.kvmha import partition
+from nova import test
+
+
+class HashRingTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(HashRingTestCase, self).setUp()
+        self.hosts = ['compute%d' % i for i in xrange(100)]
+
+    def _owners(self, ring):
+        return dict((host, ring.get_owner(host)) for host in self.hosts)
+
+    def test_empty_ring(self):
+        self.assertIsNone(partition.HashRing([], 8).get_owner('compute1'))
+
+    def test_every_member_owns_hosts(self):
+        ring = partition.HashRing(['kvmha1', 'kvmha2', 'kvmha3'], 32)
+        self.assertEqual(set(['kvmha1', 'kvmha2', 'kvmha3']),
+                         set(self._owners(ring).values()))
+
+    def test_removing_member_only_moves_its_hosts(self):
+        before = self._owners(partition.HashRing(['kvmha1', 'kvmha2',
+                                                  'kvmha3'], 32))
+        after = self._owners(partition.HashRing(['kvmha1', 'kvmha2'], 32))
+        for host, owner in before.iteritems():
+            if owner != 'kvmha3':
+                self.assertEqual(owner, after[host])
+
+
+class FakeServiceGroupAPI(object):
+    members = []
+
+    def get_all(self, group_id):
+        return self.members
+
+
+class PartitionerTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(PartitionerTestCase, self).setUp()
+        self.servicegroup_api = FakeServiceGroupAPI()
+        patcher = mock.patch('nova.servicegroup.API',
+                             return_value=self.servicegroup_api)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.partitioners = [partition.Partitioner('kvmha1'),
+                             partition.Partitioner('kvmha2')]
+
+    def _owners(self, host):
+        return [p.host for p in self.partitioners if p.owns(host)]
+
+    def test_single_worker_owns_all(self):
+        self.assertTrue(self.partitioners[0].owns('compute1'))
+
+    def test_hosts_owned_by_one_worker(self):
+        self.servicegroup_api.members = ['kvmha1', 'kvmha2']
+        owners = [self._owners('compute%d' % i) for i in xrange(20)]
+        self.assertTrue(all(len(owner) == 1 for owner in owners))
+        self.assertEqual(set(['kvmha1', 'kvmha2']),
+                         set(owner[0] for owner in owners))
+
+    def test_membership_cached(self):
+        self.servicegroup_api.members = ['kvmha1', 'kvmha2']
+        partitioner = self.partitioners[0]
+        partitioner.owns('compute1')
+        self.servicegroup_api.members = ['kvmha1']
+        self.assertEqual(set(['kvmha1', 'kvmha2']),
+                         partitioner.ring.members)
+        partitioner.refresh(force=True)
+        self.assertEqual(set(['kvmha1']), partitioner.ring.members)
+
+    def test_membership_error_keeps_ring(self):
+        partitioner = self.partitioners[0]
+        self.servicegroup_api.members = ['kvmha1', 'kvmha2']
+        partitioner.refresh(force=True)
+        with mock.patch.object(self.servicegroup_api, 'get_all',
+                               side_effect=test.TestingException()):
+            partitioner.refresh(force=True)
+        self.assertEqual(set(['kvmha1', 'kvmha2']),
+                         partitioner.ring.members)
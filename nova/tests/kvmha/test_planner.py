@@ -0,0 +1,141 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Unit Tests for nova.kvmha.planner
+"""
+
+import mock
+
+from nova.compute import flavors
+from nova import context
+from nova.kvmha import capacity
+from nova.kvmha import planner
+from nova.scheduler import host_manager
+from nova import test
+
+
+def _fake_host_state(host, ram_mb, vcpus, disk_gb):
+    host_state = host_manager.HostState(host, host)
+    host_state.total_usable_ram_mb = ram_mb
+    host_state.free_ram_mb = ram_mb
+    host_state.vcpus_total = vcpus
+    host_state.total_usable_disk_gb = disk_gb
+    host_state.free_disk_mb = disk_gb * 1024
+    return host_state
+
+
+def _fake_instance(uuid, memory_mb, vcpus=1, root_gb=1):
+    flavor = {'id': 1, 'name': 'fake', 'memory_mb': memory_mb,
+              'vcpus': vcpus, 'root_gb': root_gb, 'ephemeral_gb': 0,
+              'flavorid': 'fake', 'swap': 0, 'rxtx_factor': 1.0,
+              'vcpu_weight': None}
+    return {'uuid': uuid, 'memory_mb': memory_mb, 'vcpus': vcpus,
+            'root_gb': root_gb, 'ephemeral_gb': 0, 'project_id': 'fake',
+            'os_type': 'linux',
+            'system_metadata': flavors.save_flavor_info({}, flavor)}
+
+
+class FakeGroup(object):
+    def __init__(self, members, policies, hosts):
+        self.members = members
+        self.policies = policies
+        self.hosts = hosts
+
+    def get_hosts(self, context, exclude=None):
+        return self.hosts
+
+
+class EvacuationPlannerTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(EvacuationPlannerTestCase, self).setUp()
+        self.flags(kvmha_evacuate_filters=['RamFilter', 'CoreFilter',
+                                           'DiskFilter',
+                                           'ServerGroupAffinityFilter'],
+                   ram_allocation_ratio=1.0,
+                   cpu_allocation_ratio=1.0)
+        self.context = context.get_admin_context()
+        self.capacity = capacity.CapacitySnapshot()
+        self.planner = planner.EvacuationPlanner(self.capacity)
+        self.host_states = [_fake_host_state('failed', 8192, 8, 100),
+                            _fake_host_state('host1', 2048, 4, 100),
+                            _fake_host_state('host2', 3072, 4, 100)]
+        self.stubs.Set(self.capacity.host_manager, 'get_all_host_states',
+                       lambda ctxt: iter(self.host_states))
+        self.groups = []
+        patcher = mock.patch('nova.objects.instance_group.'
+                             'InstanceGroupList.get_all',
+                             side_effect=lambda ctxt: self.groups)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _plan(self, instances, **kwargs):
+        placements, unplaced = self.planner.plan(self.context, 'failed',
+                                                 instances, **kwargs)
+        return (dict((inst['uuid'], host) for inst, host in placements),
+                [inst['uuid'] for inst in unplaced])
+
+    def test_plan_spreads_over_several_hosts(self):
+        # No single host can take all 4096MB.
+        instances = [_fake_instance('small', 1024),
+                     _fake_instance('large', 2048),
+                     _fake_instance('medium', 1024)]
+        placed, unplaced = self._plan(instances)
+        self.assertEqual([], unplaced)
+        self.assertEqual(set(['host1', 'host2']), set(placed.values()))
+        self.assertEqual([0, 0],
+                         [h.free_ram_mb for h in self.host_states[1:]])
+
+    def test_plan_pack(self):
+        self.flags(kvmha_placement_strategy='pack')
+        placed, unplaced = self._plan([_fake_instance('inst1', 1024),
+                                       _fake_instance('inst2', 1024)])
+        self.assertEqual({'inst1': 'host1', 'inst2': 'host1'}, placed)
+
+    def test_plan_reports_unplaced(self):
+        placed, unplaced = self._plan([_fake_instance('huge', 4096)])
+        self.assertEqual({}, placed)
+        self.assertEqual(['huge'], unplaced)
+
+    def test_plan_never_targets_failure_host(self):
+        placed, unplaced = self._plan([_fake_instance('inst1', 512)])
+        self.assertNotEqual('failed', placed['inst1'])
+
+    def test_plan_honours_affinity_group(self):
+        self.groups = [FakeGroup(['inst1', 'inst2'], ['affinity'],
+                                 ['host1'])]
+        placed, unplaced = self._plan([_fake_instance('inst1', 512),
+                                       _fake_instance('inst2', 512)])
+        self.assertEqual({'inst1': 'host1', 'inst2': 'host1'}, placed)
+
+    def test_plan_by_priority(self):
+        # Only one of the instances fits, the one with a higher priority
+        # is placed first although it is smaller.
+        self.host_states = self.host_states[:2]
+        placed, unplaced = self._plan([_fake_instance('large', 2048),
+                                       _fake_instance('critical', 1024)],
+                                      priorities={'critical': 10})
+        self.assertEqual({'critical': 'host1'}, placed)
+        self.assertEqual(['large'], unplaced)
+
+    def test_plan_prefers_hosts(self):
+        # host1 has less capacity left but shares storage.
+        placed, unplaced = self._plan([_fake_instance('inst1', 512)],
+                                      preferred_hosts=set(['host1']))
+        self.assertEqual({'inst1': 'host1'}, placed)
@@ -0,0 +1,72 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Unit Tests for nova.kvmha.priority
+"""
+
+import mock
+
+from nova.compute import flavors
+from nova import context
+from nova.kvmha import priority
+from nova import test
+
+
+FAKE_FLAVOR = {'id': 1, 'name': 'fake', 'memory_mb': 512, 'vcpus': 1,
+               'root_gb': 1, 'ephemeral_gb': 0, 'flavorid': 'fake',
+               'swap': 0, 'rxtx_factor': 1.0, 'vcpu_weight': None}
+
+
+def _fake_instance(uuid, metadata=None, image_priority=None):
+    sys_meta = flavors.save_flavor_info({}, FAKE_FLAVOR)
+    if image_priority is not None:
+        sys_meta['image_ha_priority'] = image_priority
+    return {'uuid': uuid, 'metadata': metadata or {},
+            'system_metadata': sys_meta}
+
+
+@mock.patch('nova.db.flavor_extra_specs_get',
+            return_value={'ha_priority': '3'})
+class PriorityTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(PriorityTestCase, self).setUp()
+        self.context = context.get_admin_context()
+
+    def test_get_priorities(self, extra_specs_get):
+        instances = [_fake_instance('meta', metadata={'ha_priority': '10'}),
+                     _fake_instance('image', image_priority='5'),
+                     _fake_instance('flavor1'),
+                     _fake_instance('flavor2')]
+        self.assertEqual({'meta': 10, 'image': 5, 'flavor1': 3,
+                          'flavor2': 3},
+                         priority.get_priorities(self.context, instances))
+        # Extra specs are loaded once per flavor.
+        self.assertEqual(1, extra_specs_get.call_count)
+
+    def test_invalid_priority(self, extra_specs_get):
+        instances = [_fake_instance('bad', metadata={'ha_priority': 'high'})]
+        self.assertEqual({'bad': priority.DEFAULT_PRIORITY},
+                         priority.get_priorities(self.context, instances))
+
+    def test_default_priority(self, extra_specs_get):
+        extra_specs_get.return_value = {}
+        self.assertEqual({'none': priority.DEFAULT_PRIORITY},
+                         priority.get_priorities(self.context,
+                                                 [_fake_instance('none')]))
@@ -0,0 +1,53 @@
+#
+#    KVM HA in OpenStack
+#
+#    Copyright HP, Corp. 2014
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Unit Tests for nova.kvmha.storage
+"""
+
+import mock
+
+from nova.kvmha import storage
+from nova import test
+
+
+@mock.patch('nova.virt.storage_users.get_storage_users',
+            return_value=['host1', 'host2'])
+class SharedStorageTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(SharedStorageTestCase, self).setUp()
+        self.flags(kvmha_instances_path='/fake/instances')
+        self.shared_storage = storage.SharedStorage()
+
+    def test_is_shared(self, get_storage_users):
+        self.assertTrue(self.shared_storage.is_shared('host1', 'host2'))
+        self.assertFalse(self.shared_storage.is_shared('host1', 'host3'))
+        self.assertFalse(self.shared_storage.is_shared('host3', 'host1'))
+        self.assertFalse(self.shared_storage.is_shared('host1', 'host1'))
+        get_storage_users.assert_called_once_with('/fake/instances')
+
+    def test_detection_disabled(self, get_storage_users):
+        self.flags(kvmha_detect_shared_storage=False)
+        self.assertFalse(self.shared_storage.is_shared('host1', 'host2'))
+        self.assertFalse(get_storage_users.called)
+
+    def test_registry_not_readable(self, get_storage_users):
+        get_storage_users.side_effect = IOError()
+        self.assertEqual(frozenset(),
+                         self.shared_storage.get_hosts_sharing('host1'))
@@ -0,0 +1,341 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Throughput benchmark of the scheduler drivers.
+
+Builds a synthetic fleet of compute nodes in the sqlite test database,
+with availability zone and host aggregates, metrics and PCI device pools,
+then replays a reproducible mix of boot requests through
+FilterScheduler.select_destinations() or CachingScheduler for each of
+the filter and weigher configurations in CONFIGURATIONS. The report
+gives the requests per second, the p50/p99 request latencies, the peak
+memory of the process and the per filter and weigher timings recorded
+by nova.scheduler.profiler, so changes to the scheduler can be compared
+before they land.
+
+The fleet is a fixture to be used from a test case, which provides the
+database and configuration. nova.tests.scheduler.test_benchmark runs
+it, set SCHEDULER_BENCHMARK=1 to run the full size benchmark:
+
+    SCHEDULER_BENCHMARK=1 SCHEDULER_BENCHMARK_HOSTS=100,1000,10000 \\
+        python -m testtools.run nova.tests.scheduler.test_benchmark
+"""
+
+import random
+import resource
+import time
+
+import fixtures
+from oslo.config import cfg
+
+from nova import context
+from nova import db
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import models
+from nova import exception
+from nova.openstack.common import importutils
+from nova.openstack.common import jsonutils
+from nova.openstack.common import timeutils
+from nova.scheduler import profiler
+from nova.tests import utils as test_utils
+
+CONF = cfg.CONF
+CONF.import_opt('pci_alias', 'nova.pci.pci_request')
+CONF.import_opt('scheduler_default_filters', 'nova.scheduler.host_manager')
+CONF.import_opt('scheduler_weight_classes', 'nova.scheduler.host_manager')
+CONF.import_opt('service_down_time', 'nova.service')
+CONF.import_opt('weight_setting', 'nova.scheduler.weights.metrics',
+                group='metrics')
+
+SCHEDULERS = {
+    'filter': 'nova.scheduler.filter_scheduler.FilterScheduler',
+    'caching': 'nova.scheduler.caching_scheduler.CachingScheduler',
+}
+
+_RESOURCE_FILTERS = ['RetryFilter', 'AvailabilityZoneFilter', 'RamFilter',
+                     'CoreFilter', 'DiskFilter', 'ComputeFilter',
+                     'IoOpsFilter', 'NumInstancesFilter']
+
+# Filter and weigher configurations, as options to override.
+CONFIGURATIONS = {
+    'default': {},
+    'resources': {
+        'scheduler_default_filters': _RESOURCE_FILTERS,
+        'scheduler_weight_classes': ['nova.scheduler.weights.ram.RAMWeigher'],
+    },
+    'aggregates': {
+        'scheduler_default_filters': [
+            'RetryFilter', 'AvailabilityZoneFilter', 'AggregateRamFilter',
+            'AggregateCoreFilter', 'ComputeFilter',
+            'AggregateInstanceExtraSpecsFilter',
+            'AggregateMultiTenancyIsolation',
+            'AggregateImagePropertiesIsolation',
+            'AggregateTypeAffinityFilter'],
+    },
+    'metrics_pci': {
+        'scheduler_default_filters': _RESOURCE_FILTERS + [
+            'MetricsFilter', 'PciPassthroughFilter'],
+        'scheduler_weight_classes': ['nova.scheduler.weights.all_weighers'],
+        ('metrics', 'weight_setting'): ['cpu.percent=-1.0'],
+    },
+}
+
+PCI_ALIAS = {'name': 'bench_nic', 'vendor_id': '8086', 'product_id': '1520'}
+
+FLAVORS = {
+    'small': {'id': 1, 'name': 'bench.small', 'memory_mb': 2048,
+              'vcpus': 1, 'root_gb': 20, 'ephemeral_gb': 0, 'swap': 0,
+              'extra_specs': {}},
+    'large': {'id': 2, 'name': 'bench.large', 'memory_mb': 16384,
+              'vcpus': 8, 'root_gb': 160, 'ephemeral_gb': 0, 'swap': 0,
+              'extra_specs': {'aggregate_instance_extra_specs:ssd': 'true'}},
+    'pci': {'id': 3, 'name': 'bench.pci', 'memory_mb': 4096,
+            'vcpus': 2, 'root_gb': 40, 'ephemeral_gb': 0, 'swap': 0,
+            'extra_specs': {'pci_passthrough:alias': 'bench_nic:1'}},
+}
+
+# (relative frequency, flavor, availability zone, number of instances)
+BOOT_MIX = [
+    (60, 'small', None, 1),
+    (15, 'small', 'az1', 1),
+    (10, 'large', None, 1),
+    (10, 'pci', None, 1),
+    (5, 'small', None, 4),
+]
+
+
+def _max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class SchedulerBenchmark(fixtures.Fixture):
+    """Synthetic fleet of compute nodes to replay boot requests on.
+
+    :param hosts: number of compute nodes.
+    :param aggregates: number of host aggregates, the first one being the
+                       az1 availability zone and every other one having
+                       ssd=true in its metadata.
+    :param pci_ratio: fraction of the hosts with PCI devices.
+    :param seed: seed of the random fleet and request mix.
+
+    The fleet is deleted from the database at cleanup.
+    """
+
+    def __init__(self, hosts=100, aggregates=8, pci_ratio=0.1, seed=0):
+        super(SchedulerBenchmark, self).__init__()
+        self.num_hosts = hosts
+        self.num_aggregates = aggregates
+        self.pci_ratio = pci_ratio
+        self.seed = seed
+
+    def setUp(self):
+        super(SchedulerBenchmark, self).setUp()
+        self.context = context.get_admin_context()
+        self._override('pci_alias', [jsonutils.dumps(PCI_ALIAS)])
+        # The services do not report while the benchmark runs.
+        self._override('service_down_time', 86400)
+        self._override('scheduler_profiling', True)
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.scheduler.profiler.STATS', profiler.SchedulerStats()))
+
+        rss = _max_rss_kb()
+        start = time.time()
+        self.addCleanup(self._delete_fleet)
+        self._create_fleet(random.Random(self.seed))
+        self.build_time = time.time() - start
+        self.build_rss_kb = _max_rss_kb() - rss
+
+    def _override(self, name, value, group=None):
+        CONF.set_override(name, value, group)
+        self.addCleanup(CONF.clear_override, name, group)
+
+    def _create_fleet(self, rng):
+        """Bulk insert the services, compute nodes and aggregates."""
+        now = timeutils.utcnow()
+        engine = sqlalchemy_api.get_engine()
+        services = []
+        nodes = []
+        for i in xrange(self.num_hosts):
+            host = 'host%d' % i
+            services.append({'id': i + 1, 'host': host,
+                             'binary': 'nova-compute', 'topic': 'compute',
+                             'report_count': 1, 'disabled': False,
+                             'updated_at': now})
+            nodes.append(self._node_values(rng, i + 1, host, now))
+        engine.execute(models.Service.__table__.insert(), services)
+        engine.execute(models.ComputeNode.__table__.insert(), nodes)
+
+        aggregate_hosts = []
+        for i in xrange(self.num_aggregates):
+            metadata = {'cpu_allocation_ratio': '4.0',
+                        'ram_allocation_ratio': '1.0'}
+            if i == 0:
+                metadata['availability_zone'] = 'az1'
+            if i % 2:
+                metadata['ssd'] = 'true'
+            aggregate = db.aggregate_create(
+                self.context, {'name': 'aggregate%d' % i}, metadata)
+            aggregate_hosts.extend(
+                {'host': 'host%d' % host, 'aggregate_id': aggregate['id']}
+                for host in xrange(i, self.num_hosts, self.num_aggregates))
+        if aggregate_hosts:
+            engine.execute(models.AggregateHost.__table__.insert(),
+                           aggregate_hosts)
+
+    def _delete_fleet(self):
+        engine = sqlalchemy_api.get_engine()
+        for model in (models.AggregateHost, models.AggregateMetadata,
+                      models.Aggregate, models.ComputeNode, models.Service):
+            engine.execute(model.__table__.delete())
+
+    def _node_values(self, rng, service_id, host, now):
+        vcpus = rng.choice([16, 32, 64])
+        memory_mb = vcpus * 4096
+        local_gb = vcpus * 100
+        vcpus_used = rng.randint(0, vcpus)
+        memory_mb_used = rng.randint(512, memory_mb)
+        local_gb_used = rng.randint(0, local_gb)
+        instances = vcpus_used // 2
+        metrics = [{'name': 'cpu.percent', 'value': rng.random(),
+                    'timestamp': timeutils.isotime(now),
+                    'source': 'libvirt.LibvirtDriver'}]
+        pci_pools = []
+        if rng.random() < self.pci_ratio:
+            pci_pools.append({'vendor_id': '8086', 'product_id': '1520',
+                              'extra_info': {}, 'count': rng.randint(1, 8)})
+        return {
+            'service_id': service_id,
+            'hypervisor_hostname': host,
+            'hypervisor_type': 'QEMU',
+            'hypervisor_version': 1000000,
+            'cpu_info': '{}',
+            'host_ip': '10.%d.%d.%d' % (service_id >> 16,
+                                        (service_id >> 8) & 255,
+                                        service_id & 255),
+            'vcpus': vcpus,
+            'vcpus_used': vcpus_used,
+            'memory_mb': memory_mb,
+            'memory_mb_used': memory_mb_used,
+            'free_ram_mb': memory_mb - memory_mb_used,
+            'local_gb': local_gb,
+            'local_gb_used': local_gb_used,
+            'free_disk_gb': local_gb - local_gb_used,
+            'disk_available_least': local_gb - local_gb_used,
+            'current_workload': rng.randint(0, 4),
+            'running_vms': instances,
+            'supported_instances': jsonutils.dumps(
+                [['x86_64', 'qemu', 'hvm']]),
+            'metrics': jsonutils.dumps(metrics),
+            'pci_stats': jsonutils.dumps(pci_pools),
+            'stats': jsonutils.dumps({'num_instances': instances,
+                                      'io_workload': rng.randint(0, 8),
+                                      'num_proj_benchmark': instances}),
+            'updated_at': now}
+
+    def boot_requests(self, count):
+        """Return count (request_spec, filter_properties) of the mix."""
+        rng = random.Random(self.seed)
+        mix = []
+        for frequency, flavor, zone, num_instances in BOOT_MIX:
+            mix.extend([(FLAVORS[flavor], zone, num_instances)] * frequency)
+        requests = []
+        for i in xrange(count):
+            flavor, zone, num_instances = rng.choice(mix)
+            instance_properties = {
+                'project_id': 'benchmark', 'user_id': 'benchmark',
+                'os_type': 'linux', 'availability_zone': zone,
+                'memory_mb': flavor['memory_mb'], 'vcpus': flavor['vcpus'],
+                'root_gb': flavor['root_gb'],
+                'ephemeral_gb': flavor['ephemeral_gb']}
+            request_spec = {'instance_properties': instance_properties,
+                            'instance_type': flavor,
+                            'image': {'properties': {}},
+                            'num_instances': num_instances}
+            requests.append((request_spec, {}))
+        return requests
+
+    def configure(self, configuration):
+        """Override the options of a filter and weigher configuration."""
+        for name, value in CONFIGURATIONS[configuration].iteritems():
+            group = None
+            if isinstance(name, tuple):
+                group, name = name
+            self._override(name, value, group)
+
+    def run(self, scheduler='filter', configuration='default', requests=100):
+        """Replay boot requests through a scheduler driver.
+
+        :param scheduler: key of SCHEDULERS.
+        :param configuration: key of CONFIGURATIONS.
+        :param requests: number of boot requests.
+        :returns: the benchmark report, see report().
+        """
+        self.configure(configuration)
+        profiler.STATS.reset()
+        driver = importutils.import_object(SCHEDULERS[scheduler])
+        boot_requests = self.boot_requests(requests)
+
+        latencies = []
+        failures = 0
+        rss = _max_rss_kb()
+        start = time.time()
+        for request_spec, filter_properties in boot_requests:
+            request_start = time.time()
+            try:
+                driver.select_destinations(self.context, request_spec,
+                                           filter_properties)
+            except exception.NoValidHost:
+                failures += 1
+            latencies.append(time.time() - request_start)
+        elapsed = time.time() - start
+        return {'scheduler': scheduler,
+                'configuration': configuration,
+                'hosts': self.num_hosts,
+                'requests': requests,
+                'failures': failures,
+                'elapsed': elapsed,
+                'requests_per_second': requests / elapsed if elapsed else 0,
+                'latency': test_utils.latency_stats(latencies),
+                'memory': {'build_kb': self.build_rss_kb,
+                           'run_kb': _max_rss_kb() - rss,
+                           'max_rss_kb': _max_rss_kb()},
+                'profile': profiler.STATS.to_dict()}
+
+
+def format_report(report):
+    """Format a benchmark report as a table."""
+    lines = ['%(scheduler)s scheduler, %(configuration)s configuration, '
+             '%(hosts)d host(s): %(requests)d request(s) in %(elapsed).2fs, '
+             '%(requests_per_second).1f req/s, %(failures)d failure(s)' %
+             report]
+    latency = report['latency']
+    if latency['count']:
+        lines.append('latency (ms): mean %.1f p50 %.1f p99 %.1f max %.1f' %
+                     tuple(latency[key] * 1000 for key in
+                           ('mean', 'p50', 'p99', 'max')))
+    lines.append('memory (KB): fleet +%(build_kb)d, run +%(run_kb)d, '
+                 'max RSS %(max_rss_kb)d' % report['memory'])
+    histograms = report['profile']['histograms']
+    lines.append('%-45s %6s %9s %9s' % ('step', 'count', 'total (s)',
+                                        'max (ms)'))
+    for name, histogram in sorted(histograms.iteritems(),
+                                  key=lambda item: -item[1]['total']):
+        lines.append('%-45s %6d %9.3f %9.1f' % (name, histogram['count'],
+                                                histogram['total'],
+                                                histogram['max'] * 1000))
+    lines.append('DB queries: %d' %
+                 report['profile']['counters'].get('db_queries', 0))
+    return '\n'.join(lines)
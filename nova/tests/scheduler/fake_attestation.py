@@ -0,0 +1,96 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Fake OpenAttestation server for the trusted filter tests.
+"""
+
+import httplib
+import socket
+
+import fixtures
+
+from nova.openstack.common import jsonutils
+from nova.openstack.common import timeutils
+
+
+class FakeResponse(object):
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeAttestationConnection(object):
+    """HTTPS connection to a FakeAttestationServer."""
+
+    def __init__(self, server):
+        self.server = server
+        self.open = False
+        self.response = None
+
+    def request(self, method, url, body, headers):
+        if not self.server.available:
+            raise socket.error('Connection refused')
+        if not self.open:
+            self.server.connections += 1
+            self.open = True
+        self.response = self.server.handle(method, url, body, headers)
+
+    def getresponse(self):
+        response, self.response = self.response, None
+        return response
+
+    def close(self):
+        self.open = False
+
+
+class FakeAttestationServer(fixtures.Fixture):
+    """In-process fake of the PollHosts API of an OpenAttestation server.
+
+    The connections of the trusted filter are replaced by connections to
+    this server. Hosts are reported with the trust level set in
+    trust_levels, 'untrusted' by default, and attested now.
+    """
+
+    def __init__(self, trust_levels=None):
+        super(FakeAttestationServer, self).__init__()
+        self.trust_levels = trust_levels or {}
+        self.available = True
+        self.connections = 0
+        # Lists of the hosts polled by each request.
+        self.requests = []
+
+    def setUp(self):
+        super(FakeAttestationServer, self).setUp()
+        self.useFixture(fixtures.MonkeyPatch(
+            'nova.scheduler.filters.trusted_filter.'
+            'HTTPSClientAuthConnection', self.connect))
+
+    def connect(self, host, port, key_file=None, cert_file=None,
+                ca_file=None, timeout=None):
+        return FakeAttestationConnection(self)
+
+    def handle(self, method, url, body, headers):
+        if method != 'POST' or not url.endswith('/PollHosts'):
+            return FakeResponse(httplib.NOT_FOUND, '')
+        hosts = jsonutils.loads(body)['hosts']
+        self.requests.append(hosts)
+        states = [{'host_name': host,
+                   'trust_lvl': self.trust_levels.get(host, 'untrusted'),
+                   'vtime': timeutils.isotime()}
+                  for host in hosts]
+        return FakeResponse(httplib.OK, jsonutils.dumps({'hosts': states}))
@@ -0,0 +1,56 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Throughput benchmark of the scheduler, see nova.tests.scheduler.benchmark
+"""
+
+import os
+
+import testtools
+
+from nova import test
+from nova.tests.scheduler import benchmark
+
+
+class SchedulerBenchmarkTestCase(test.TestCase):
+
+    def test_configurations(self):
+        bench = self.useFixture(benchmark.SchedulerBenchmark(hosts=20))
+        for scheduler in sorted(benchmark.SCHEDULERS):
+            for configuration in sorted(benchmark.CONFIGURATIONS):
+                report = bench.run(scheduler, configuration, requests=10)
+                self.assertEqual(10, report['latency']['count'])
+                self.assertTrue(report['failures'] < 10)
+                self.assertEqual(
+                    10, report['profile']['histograms']['request']['count'])
+                benchmark.format_report(report)
+
+    def test_fleet_is_reproducible(self):
+        bench = self.useFixture(benchmark.SchedulerBenchmark(hosts=5))
+        self.assertEqual(bench.boot_requests(20), bench.boot_requests(20))
+
+    @testtools.skipUnless(os.environ.get('SCHEDULER_BENCHMARK'),
+                          'Set SCHEDULER_BENCHMARK=1 to run the benchmark')
+    def test_scheduler_benchmark(self):
+        sizes = os.environ.get('SCHEDULER_BENCHMARK_HOSTS', '100,1000,10000')
+        requests = int(os.environ.get('SCHEDULER_BENCHMARK_REQUESTS', 200))
+        for hosts in [int(size) for size in sizes.split(',')]:
+            bench = benchmark.SchedulerBenchmark(hosts=hosts)
+            with bench:
+                for scheduler in sorted(benchmark.SCHEDULERS):
+                    for configuration in sorted(benchmark.CONFIGURATIONS):
+                        report = bench.run(scheduler, configuration,
+                                           requests)
+                        print(benchmark.format_report(report))
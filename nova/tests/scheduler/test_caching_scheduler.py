@@ -13,9 +13,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+
 import mock
 
 from nova import exception
+from nova.openstack.common import memorycache
 from nova.openstack.common import timeutils
 from nova.scheduler import caching_scheduler
 from nova.scheduler import host_manager
@@ -90,6 +93,81 @@ class CachingSchedulerTestCase(test_scheduler.SchedulerTestCase):
         self.assertEqual(1, len(result))
         self.assertEqual(result[0]["host"], fake_host.host)
 
+    @mock.patch.object(memorycache, 'get_client')
+    def test_claims_shared_between_workers(self, get_client):
+        self.flags(memcached_servers=['localhost:11211'])
+        get_client.return_value = memorycache.Client()
+        worker1 = caching_scheduler.CachingScheduler()
+        worker2 = caching_scheduler.CachingScheduler()
+        worker1.all_host_states = [self._get_fake_host_state()]
+        worker2.all_host_states = [self._get_fake_host_state()]
+        worker2._get_all_host_states(self.context)
+
+        worker1.select_destinations(self.context,
+                                    self._get_fake_request_spec(), {})
+        host_states = worker2._get_all_host_states(self.context)
+
+        self.assertEqual(50000 - 512, host_states[0].free_ram_mb)
+        self.assertEqual(1, host_states[0].num_instances)
+        # Claims are consumed once, and not by the worker which made them.
+        worker2._get_all_host_states(self.context)
+        worker1._get_all_host_states(self.context)
+        self.assertEqual(50000 - 512, host_states[0].free_ram_mb)
+        self.assertEqual(50000 - 512,
+                         worker1.all_host_states[0].free_ram_mb)
+
+    @mock.patch.object(memorycache, 'get_client')
+    def test_claims_older_than_compute_node_dropped(self, get_client):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.flags(memcached_servers=['localhost:11211'])
+        get_client.return_value = memorycache.Client()
+        worker1 = caching_scheduler.CachingScheduler()
+        worker2 = caching_scheduler.CachingScheduler()
+        worker1.all_host_states = [self._get_fake_host_state()]
+        worker2.all_host_states = [self._get_fake_host_state(),
+                                   self._get_fake_host_state(1)]
+        worker2._get_all_host_states(self.context)
+
+        host_states = worker2.all_host_states
+        instance = self._get_fake_request_spec()['instance_properties']
+        worker1.shared_claims.record(host_states[0], instance)
+        worker1.shared_claims.record(host_states[1], instance)
+        timeutils.advance_time_seconds(1)
+        # The host states of host_0 were reloaded after the claim.
+        host_states[0].compute_updated = timeutils.utcnow()
+        host_states[1].compute_updated = (timeutils.utcnow() -
+                                          datetime.timedelta(seconds=2))
+        worker2._get_all_host_states(self.context)
+
+        self.assertEqual(50000, host_states[0].free_ram_mb)
+        self.assertEqual(50000 - 512, host_states[1].free_ram_mb)
+
+    @mock.patch.object(memorycache, 'get_client')
+    def test_lost_claim_reloads_hosts(self, get_client):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.flags(memcached_servers=['localhost:11211'])
+        get_client.return_value = memorycache.Client()
+        driver = caching_scheduler.CachingScheduler()
+        driver.all_host_states = []
+        driver._get_all_host_states(self.context)
+        host_state = self._get_fake_host_state()
+        driver.shared_claims.record(host_state, {'memory_mb': 512})
+        driver.shared_claims.client.delete(
+            driver.shared_claims._claim_key(1))
+
+        with mock.patch.object(driver, '_get_up_hosts',
+                               return_value=[host_state]) as up_hosts:
+            # The claim may still be being written.
+            driver._get_all_host_states(self.context)
+            self.assertFalse(up_hosts.called)
+            timeutils.advance_time_seconds(
+                caching_scheduler.CLAIM_WRITE_TIMEOUT + 1)
+            driver._get_all_host_states(self.context)
+            self.assertTrue(up_hosts.called)
+        self.assertEqual([host_state], driver.all_host_states)
+
     def _test_select_destinations(self, request_spec):
         return self.driver.select_destinations(
                 self.context, request_spec, {})
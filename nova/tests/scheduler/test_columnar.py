@@ -0,0 +1,156 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the columnar evaluation of scheduler filters and weighers.
+"""
+
+import testtools
+
+from nova import exception
+from nova.scheduler import columnar
+from nova.scheduler.filters import core_filter
+from nova.scheduler.filters import disk_filter
+from nova.scheduler.filters import io_ops_filter
+from nova.scheduler.filters import num_instances_filter
+from nova.scheduler.filters import ram_filter
+from nova.scheduler import host_manager
+from nova.scheduler import weights
+from nova.scheduler.weights import metrics
+from nova.scheduler.weights import ram
+from nova import test
+from nova.tests.scheduler import fakes
+
+
+def _fake_host_states():
+    host_states = []
+    for i in range(12):
+        host_states.append(fakes.FakeHostState('host%d' % i, 'node%d' % i, {
+            'total_usable_ram_mb': 2048 * (i % 4),
+            'free_ram_mb': 2048 * (i % 4) - 512 * (i % 5),
+            'vcpus_total': 2 * (i % 3),
+            'vcpus_used': i % 5,
+            'total_usable_disk_gb': 10 * (i % 4),
+            'free_disk_mb': 1024 * (10 * (i % 4) - i % 7),
+            'num_io_ops': i % 6,
+            'num_instances': i}))
+    return host_states
+
+
+@testtools.skipIf(columnar.numpy is None, 'numpy is not installed')
+class ColumnarFiltersTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(ColumnarFiltersTestCase, self).setUp()
+        self.flags(scheduler_columnar_min_hosts=1,
+                   ram_allocation_ratio=1.5, cpu_allocation_ratio=2.0,
+                   disk_allocation_ratio=1.2, max_io_ops_per_host=3,
+                   max_instances_per_host=8)
+        self.filter_properties = {'instance_type': {
+            'memory_mb': 1024, 'vcpus': 2, 'root_gb': 5,
+            'ephemeral_gb': 1, 'swap': 512}}
+
+    def _assertSameAsPerHost(self, filt_cls):
+        expected_hosts = _fake_host_states()
+        self.flags(scheduler_columnar_host_states=False)
+        expected = filt_cls().filter_all(expected_hosts,
+                                         self.filter_properties)
+        host_states = _fake_host_states()
+        self.flags(scheduler_columnar_host_states=True)
+        result = filt_cls().filter_all(host_states, self.filter_properties)
+
+        expected = list(expected)
+        self.assertIsInstance(result, list)
+        self.assertEqual([hs.host for hs in expected],
+                         [hs.host for hs in result])
+        self.assertEqual([hs.limits for hs in expected],
+                         [hs.limits for hs in result])
+
+    def test_ram_filter(self):
+        self._assertSameAsPerHost(ram_filter.RamFilter)
+
+    def test_core_filter(self):
+        self._assertSameAsPerHost(core_filter.CoreFilter)
+
+    def test_core_filter_without_instance_type(self):
+        self.filter_properties = {}
+        self._assertSameAsPerHost(core_filter.CoreFilter)
+
+    def test_disk_filter(self):
+        self._assertSameAsPerHost(disk_filter.DiskFilter)
+
+    def test_io_ops_filter(self):
+        self._assertSameAsPerHost(io_ops_filter.IoOpsFilter)
+
+    def test_num_instances_filter(self):
+        self._assertSameAsPerHost(num_instances_filter.NumInstancesFilter)
+
+    def test_not_enabled_below_min_hosts(self):
+        self.flags(scheduler_columnar_host_states=True,
+                   scheduler_columnar_min_hosts=20)
+        self.assertFalse(columnar.enabled(_fake_host_states()))
+
+
+@testtools.skipIf(columnar.numpy is None, 'numpy is not installed')
+class ColumnarWeighersTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(ColumnarWeighersTestCase, self).setUp()
+        self.flags(scheduler_columnar_min_hosts=1)
+
+    def _get_host_states(self):
+        host_states = _fake_host_states()
+        for i, host_state in enumerate(host_states):
+            host_state.metrics = {
+                'foo': host_manager.MetricItem(value=100 * (i % 7),
+                                               timestamp=None,
+                                               source='fake')}
+            if i % 5:
+                host_state.metrics['bar'] = host_manager.MetricItem(
+                    value=i % 3, timestamp=None, source='fake')
+        return host_states
+
+    def _get_weighed_hosts(self, weigher_cls=ram.RAMWeigher):
+        weight_handler = weights.HostWeightHandler()
+        return [(w.obj.host, w.weight) for w in
+                weight_handler.get_weighed_objects([weigher_cls],
+                                                   self._get_host_states(),
+                                                   {})]
+
+    def _assertSameAsPerHost(self, weigher_cls):
+        expected = self._get_weighed_hosts(weigher_cls)
+        self.flags(scheduler_columnar_host_states=True)
+        self.assertEqual(expected, self._get_weighed_hosts(weigher_cls))
+
+    def test_ram_weigher(self):
+        self._assertSameAsPerHost(ram.RAMWeigher)
+
+    def test_metrics_weigher(self):
+        self.flags(weight_setting=['foo=1.0', 'bar=-2.0'], required=False,
+                   group='metrics')
+        self._assertSameAsPerHost(metrics.MetricsWeigher)
+
+    def test_metrics_weigher_unavailable_zero_ratio(self):
+        self.flags(weight_setting=['foo=1.0', 'bar=0.0'], required=False,
+                   group='metrics')
+        self._assertSameAsPerHost(metrics.MetricsWeigher)
+
+    def test_metrics_weigher_required_metric_missing(self):
+        self.flags(weight_setting=['foo=1.0', 'bar=-2.0'], group='metrics')
+        self.flags(scheduler_columnar_host_states=True)
+        exc = self.assertRaises(exception.ComputeHostMetricNotFound,
+                                self._get_weighed_hosts,
+                                metrics.MetricsWeigher)
+        self.assertEqual('host0', exc.kwargs['host'])
+        self.assertEqual('bar', exc.kwargs['name'])
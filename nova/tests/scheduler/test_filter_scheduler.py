@@ -35,6 +35,7 @@ from nova.scheduler import filter_scheduler
 from nova.scheduler import host_manager
 from nova.scheduler import utils as scheduler_utils
 from nova.scheduler import weights
+from nova.scheduler.weights import ram
 from nova.tests import fake_instance
 from nova.tests.scheduler import fakes
 from nova.tests.scheduler import test_scheduler
@@ -182,7 +183,8 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
         self.next_weight = 1.0
 
-        def _fake_weigh_objects(_self, functions, hosts, options):
+        def _fake_weigh_objects(_self, functions, hosts, options,
+                                bounds=None):
             self.next_weight += 2.0
             host_state = hosts[0]
             return [weights.WeighedHost(host_state, self.next_weight)]
@@ -497,7 +499,8 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
         self.next_weight = 50
 
-        def _fake_weigh_objects(_self, functions, hosts, options):
+        def _fake_weigh_objects(_self, functions, hosts, options,
+                                bounds=None):
             this_weight = self.next_weight
             self.next_weight = 0
             host_state = hosts[0]
@@ -538,7 +541,8 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         selected_hosts = []
         selected_nodes = []
 
-        def _fake_weigh_objects(_self, functions, hosts, options):
+        def _fake_weigh_objects(_self, functions, hosts, options,
+                                bounds=None):
             self.next_weight += 2.0
             host_state = hosts[0]
             selected_hosts.append(host_state.host)
@@ -571,6 +575,59 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         self.assertEqual(host, selected_hosts[0])
         self.assertEqual(node, selected_nodes[0])
 
+    def _schedule_instances(self, num_instances):
+        self.flags(scheduler_default_filters=['RamFilter'],
+                   ram_allocation_ratio=1.0)
+        sched = fakes.FakeFilterScheduler()
+        sched.host_manager.weight_classes = [ram.RAMWeigher]
+        host_states = [fakes.FakeHostState('host%d' % i, 'node%d' % i,
+                                           {'free_ram_mb': 1024 * i,
+                                            'total_usable_ram_mb': 1024 * i})
+                       for i in xrange(1, 5)]
+        self.stubs.Set(sched, '_get_all_host_states',
+                       lambda context: host_states)
+        instance_properties = {'project_id': 1, 'root_gb': 1,
+                               'ephemeral_gb': 0, 'memory_mb': 512,
+                               'vcpus': 1, 'os_type': 'Linux'}
+        request_spec = dict(instance_properties=instance_properties,
+                            instance_type={'memory_mb': 512},
+                            num_instances=num_instances)
+        hosts = sched._schedule(self.context, request_spec, {})
+        return [host.obj.host for host in hosts]
+
+    def test_schedule_batch_placement(self):
+        # 20 instances fit on the hosts.
+        expected = self._schedule_instances(22)
+        self.assertEqual(20, len(expected))
+        self.flags(scheduler_batch_placement=True)
+        self.assertEqual(expected, self._schedule_instances(22))
+
+    @mock.patch.object(weights.HostWeightHandler, '_weigher_done')
+    def test_schedule_batch_placement_weighers_timed(self, weigher_done):
+        self.flags(scheduler_batch_placement=True)
+        self._schedule_instances(3)
+        # All the hosts are weighed once, then the chosen host after each
+        # of the first two instances.
+        self.assertEqual(3, weigher_done.call_count)
+        self.assertEqual(('RAMWeigher', 4),
+                         (weigher_done.call_args_list[0][0][0],
+                          weigher_done.call_args_list[0][0][2]))
+        weigher_done.assert_called_with('RAMWeigher', mock.ANY, 1)
+
+    @mock.patch('nova.scheduler.batch.BatchPlacement.place')
+    def test_schedule_batch_placement_not_for_groups(self, place):
+        self.flags(scheduler_batch_placement=True)
+        sched = fakes.FakeFilterScheduler()
+        self.stubs.Set(sched, '_setup_instance_group',
+                       lambda context, filter_properties: True)
+        self.stubs.Set(sched, '_get_all_host_states', lambda context: [])
+        request_spec = dict(instance_properties={'project_id': 1,
+                                                 'os_type': 'Linux'},
+                            instance_type={}, num_instances=2)
+        self.assertEqual([], sched._schedule(self.context, request_spec,
+                                             {}))
+        self.assertFalse(place.called)
+
     def test_select_destinations_no_valid_host(self):
 
         def _return_no_host(*args, **kwargs):
@@ -17,6 +17,7 @@ Tests For Scheduler Host Filters.
 
 import httplib
 
+import mox
 from oslo.config import cfg
 import stubout
 
@@ -28,6 +29,7 @@ from nova.pci import pci_stats
 from nova.scheduler import filters
 from nova.scheduler.filters import extra_specs_ops
 from nova.scheduler.filters import trusted_filter
+from nova.scheduler import host_manager
 from nova import servicegroup
 from nova import test
 from nova.tests.scheduler import fakes
@@ -251,6 +253,7 @@ class HostFiltersTestCase(test.NoDBTestCase):
         self.stubs = stubout.StubOutForTesting()
         self.stubs.Set(trusted_filter.AttestationService, '_request',
                 self.fake_oat_request)
+        self.stubs.Set(trusted_filter, '_attestation_cache', None)
         self.context = context.RequestContext('fake', 'fake')
         self.json_query = jsonutils.dumps(
                 ['and', ['>=', '$free_ram_mb', 1024],
@@ -401,6 +404,32 @@ class HostFiltersTestCase(test.NoDBTestCase):
 
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
 
+    def test_affinity_different_filter_single_query(self):
+        filt_cls = self.class_map['DifferentHostFilter']()
+        instance1 = fakes.FakeInstance(context=self.context,
+                                       params={'host': 'host1'})
+        instance2 = fakes.FakeInstance(context=self.context,
+                                       params={'host': 'host2'})
+        hosts = [fakes.FakeHostState('host%d' % i, 'node%d' % i, {})
+                 for i in xrange(1, 5)]
+        calls = []
+        get_all = filt_cls.compute_api.get_all
+
+        def fake_get_all(*args, **kwargs):
+            calls.append(args)
+            return get_all(*args, **kwargs)
+
+        self.stubs.Set(filt_cls.compute_api, 'get_all', fake_get_all)
+        filter_properties = {'context': self.context.elevated(),
+                             'scheduler_hints': {
+                                 'different_host': [instance1.uuid,
+                                                    instance2.uuid]}}
+
+        passed = filt_cls.filter_all(hosts, filter_properties)
+
+        self.assertEqual(['host3', 'host4'], [host.host for host in passed])
+        self.assertEqual(1, len(calls))
+
     def test_affinity_simple_cidr_filter_passes(self):
         filt_cls = self.class_map['SimpleCIDRAffinityFilter']()
         host = fakes.FakeHostState('host1', 'node1', {})
@@ -1451,6 +1480,28 @@ class HostFiltersTestCase(test.NoDBTestCase):
         self.assertTrue(filt_cls.host_passes(host, filter_properties))
         self.assertEqual(4 * 3, host.limits['vcpu'])
 
+    def test_aggregate_core_filter_aggregate_index(self):
+        filt_cls = self.class_map['AggregateCoreFilter']()
+        filter_properties = {'context': self.context,
+                             'instance_type': {'vcpus': 1}}
+        self.flags(cpu_allocation_ratio=2)
+        index = host_manager.AggregateMetadataIndex()
+        hosts = [fakes.FakeHostState('host%d' % i, 'node%d' % i,
+                                     {'vcpus_total': 4, 'vcpus_used': 8,
+                                      'aggregate_index': index})
+                 for i in xrange(1, 4)]
+        self.mox.StubOutWithMock(db, 'aggregate_metadata_get_by_host')
+        self.mox.StubOutWithMock(db, 'aggregate_get_all')
+        db.aggregate_get_all(mox.IgnoreArg()).AndReturn(
+            [{'hosts': ['host1'],
+              'metadetails': {'cpu_allocation_ratio': '3'}}])
+        self.mox.ReplayAll()
+        # Aggregates are only loaded once for all the hosts.
+        self.assertEqual([True, False, False],
+                         [filt_cls.host_passes(host, filter_properties)
+                          for host in hosts])
+        self.assertEqual(4 * 3, hosts[0].limits['vcpu'])
+
     def test_aggregate_core_filter_conflict_values(self):
         filt_cls = self.class_map['AggregateCoreFilter']()
         filter_properties = {'context': self.context,
@@ -15,8 +15,13 @@
 """
 Tests For HostManager
 """
+import datetime
+
+import mock
+
 from nova.compute import task_states
 from nova.compute import vm_states
+from nova import context
 from nova import db
 from nova import exception
 from nova.openstack.common import jsonutils
@@ -314,6 +319,45 @@ class HostManagerTestCase(test.NoDBTestCase):
         self.assertEqual(host_states_map[('host4', 'node4')].free_disk_mb,
                          8388608)
 
+    @mock.patch.object(db, 'compute_node_get_all',
+                       return_value=fakes.COMPUTE_NODES)
+    def test_get_all_host_states_share_aggregate_index(self, compute_get):
+        host_states = list(self.host_manager.get_all_host_states('fake'))
+        index = host_states[0].aggregate_index
+        self.assertIsNotNone(index)
+        for host_state in host_states:
+            self.assertIs(index, host_state.aggregate_index)
+        # A new request gets a new index.
+        host_states = list(self.host_manager.get_all_host_states('fake'))
+        self.assertIsNot(index, host_states[0].aggregate_index)
+
+
+class AggregateMetadataIndexTestCase(test.NoDBTestCase):
+
+    @mock.patch.object(db, 'aggregate_get_all')
+    def test_get(self, aggregate_get_all):
+        aggregate_get_all.return_value = [
+            {'hosts': ['host1', 'host2'],
+             'metadetails': {'availability_zone': 'az1',
+                             'cpu_allocation_ratio': '2.0'}},
+            {'hosts': ['host1'],
+             'metadetails': {'cpu_allocation_ratio': '4.0'}},
+            {'hosts': ['host3'], 'metadetails': {}}]
+        ctxt = context.RequestContext('fake', 'fake')
+        index = host_manager.AggregateMetadataIndex()
+
+        self.assertEqual({'availability_zone': set(['az1']),
+                          'cpu_allocation_ratio': set(['2.0', '4.0'])},
+                         index.get(ctxt, 'host1'))
+        self.assertEqual({'availability_zone': set(['az1']),
+                          'cpu_allocation_ratio': set(['2.0'])},
+                         index.get(ctxt, 'host2'))
+        self.assertEqual({}, index.get(ctxt, 'host3'))
+        self.assertEqual({}, index.get(ctxt, 'unknown'))
+        # Aggregates are loaded once, with an admin context.
+        aggregate_get_all.assert_called_once_with(mock.ANY)
+        self.assertTrue(aggregate_get_all.call_args[0][0].is_admin)
+
 
 class HostManagerChangedNodesTestCase(test.NoDBTestCase):
     """Test case for HostManager class."""
@@ -373,6 +417,103 @@ class HostManagerChangedNodesTestCase(test.NoDBTestCase):
         self.assertEqual(len(host_states_map), 0)
 
 
+class HostManagerIncrementalTestCase(test.NoDBTestCase):
+    """Test case for the incremental loading of compute nodes."""
+
+    def setUp(self):
+        super(HostManagerIncrementalTestCase, self).setUp()
+        self.flags(scheduler_incremental_host_states=True)
+        self.host_manager = host_manager.HostManager()
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.created_at = timeutils.utcnow()
+        self.compute_nodes = [dict(node, created_at=self.created_at,
+                                   updated_at=self.created_at)
+                              for node in fakes.COMPUTE_NODES]
+
+    def _unchanged(self, node):
+        return dict(id=node['id'], service_id=None, service=node['service'],
+                    unchanged=True)
+
+    @mock.patch.object(host_manager.HostState, 'update_from_compute_node')
+    def test_only_changed_nodes_updated(self, update):
+        updated_node = dict(self.compute_nodes[1],
+                            updated_at=timeutils.utcnow() +
+                            datetime.timedelta(seconds=1))
+        delta = ([self.compute_nodes[0], updated_node] +
+                 [self._unchanged(node) for node in self.compute_nodes[2:]])
+        with mock.patch.object(db, 'compute_node_get_all',
+                               side_effect=[self.compute_nodes,
+                                            delta]) as compute_get:
+            self.host_manager.get_all_host_states('fake_context')
+            self.assertEqual(4, update.call_count)
+            update.reset_mock()
+            host_states = list(
+                self.host_manager.get_all_host_states('fake_context'))
+
+        compute_get.assert_called_with(
+            'fake_context',
+            updated_since=self.created_at - datetime.timedelta(seconds=60))
+        # node1 was updated at the previous load and is not updated again.
+        update.assert_called_once_with(updated_node)
+        self.assertEqual(4, len(host_states))
+
+    @mock.patch.object(host_manager.HostState, 'update_from_compute_node')
+    def test_late_commit_within_margin_updated(self, update):
+        self.flags(scheduler_host_states_since_margin=30)
+        newer_node = dict(self.compute_nodes[0],
+                          updated_at=self.created_at +
+                          datetime.timedelta(seconds=20))
+        initial = [newer_node] + self.compute_nodes[1:]
+        # node2 was updated before node1 but committed after the load.
+        late_node = dict(self.compute_nodes[1],
+                         updated_at=self.created_at +
+                         datetime.timedelta(seconds=10))
+        delta = ([newer_node, late_node] +
+                 [self._unchanged(node) for node in self.compute_nodes[2:]])
+        with mock.patch.object(db, 'compute_node_get_all',
+                               side_effect=[initial, delta]) as compute_get:
+            self.host_manager.get_all_host_states('fake_context')
+            update.reset_mock()
+            self.host_manager.get_all_host_states('fake_context')
+
+        compute_get.assert_called_with(
+            'fake_context',
+            updated_since=self.created_at - datetime.timedelta(seconds=10))
+        update.assert_called_once_with(late_node)
+
+    def test_deleted_node_removed(self):
+        delta = [self._unchanged(node) for node in self.compute_nodes[:3]]
+        with mock.patch.object(db, 'compute_node_get_all',
+                               side_effect=[self.compute_nodes, delta]):
+            self.host_manager.get_all_host_states('fake_context')
+            self.host_manager.get_all_host_states('fake_context')
+        self.assertEqual(3, len(self.host_manager.host_state_map))
+        self.assertEqual(
+            3072, self.host_manager.host_state_map[('host3',
+                                                    'node3')].free_ram_mb)
+
+    def test_full_load_after_resync_interval(self):
+        self.flags(scheduler_host_states_resync_interval=60)
+        with mock.patch.object(db, 'compute_node_get_all',
+                               return_value=self.compute_nodes) as compute_get:
+            self.host_manager.get_all_host_states('fake_context')
+            timeutils.advance_time_seconds(61)
+            self.host_manager.get_all_host_states('fake_context')
+        self.assertEqual([mock.call('fake_context'),
+                          mock.call('fake_context')],
+                         compute_get.call_args_list)
+
+    def test_unknown_node_triggers_full_load(self):
+        delta = [self._unchanged(node) for node in self.compute_nodes]
+        with mock.patch.object(db, 'compute_node_get_all',
+                               side_effect=[self.compute_nodes[:3], delta,
+                                            self.compute_nodes]):
+            self.host_manager.get_all_host_states('fake_context')
+            self.host_manager.get_all_host_states('fake_context')
+        self.assertEqual(4, len(self.host_manager.host_state_map))
+
+
 class HostStateTestCase(test.NoDBTestCase):
     """Test case for HostState class."""
 
@@ -425,6 +566,31 @@ class HostStateTestCase(test.NoDBTestCase):
         self.assertEqual({}, host.supported_instances)
         self.assertEqual(hyper_ver_int, host.hypervisor_version)
 
+    def test_stats_decoded_when_used(self):
+        stats = jsonutils.dumps({'num_instances': '2', 'num_proj_12345': '2',
+                                 'num_os_type_linux': '2'})
+        compute = dict(stats=stats, memory_mb=0, free_disk_gb=0, local_gb=0,
+                       local_gb_used=0, free_ram_mb=0, vcpus=0, vcpus_used=0,
+                       updated_at=None, host_ip='127.0.0.1',
+                       hypervisor_version=0)
+        host = host_manager.HostState("fakehost", "fakenode")
+        self.assertFalse(hasattr(host, '__dict__'))
+        host.update_from_compute_node(compute)
+        self.assertIsNone(host._num_instances_by_project)
+        self.assertIsNone(host._num_instances_by_os_type)
+
+        self.assertEqual({'12345': 2}, host.num_instances_by_project)
+        self.assertIsNone(host._num_instances_by_os_type)
+        host.consume_from_instance(dict(root_gb=0, ephemeral_gb=0,
+                                        memory_mb=0, vcpus=0,
+                                        project_id='12345', os_type='linux'))
+        self.assertEqual({'12345': 3}, host.num_instances_by_project)
+        self.assertEqual({'linux': 3}, host.num_instances_by_os_type)
+
+        # A new update of the compute node replaces the consumed counts.
+        host.update_from_compute_node(compute)
+        self.assertEqual({'12345': 2}, host.num_instances_by_project)
+
     def test_stat_consumption_from_compute_node_non_pci(self):
         stats = {
             'num_instances': '5',
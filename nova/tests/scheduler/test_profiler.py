@@ -0,0 +1,106 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the scheduler profiler.
+"""
+
+from nova import context
+from nova import db
+from nova.scheduler import filters
+from nova.scheduler import manager
+from nova.scheduler import profiler
+from nova.scheduler import weights
+from nova.scheduler.weights import ram
+from nova import test
+from nova.tests.scheduler import fakes
+
+
+class OddHostFilter(filters.BaseHostFilter):
+    def host_passes(self, host_state, filter_properties):
+        return int(host_state.host[-1]) % 2 == 1
+
+
+def _fake_host_states():
+    return [fakes.FakeHostState('host%d' % i, 'node', {'free_ram_mb': i})
+            for i in range(4)]
+
+
+class HistogramTestCase(test.NoDBTestCase):
+
+    def test_add(self):
+        histogram = profiler.Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.add(value)
+        stats = histogram.to_dict()
+        self.assertEqual(4, stats['count'])
+        self.assertAlmostEqual(2.65, stats['total'])
+        self.assertEqual(2.0, stats['max'])
+        self.assertEqual([[0.1, 2], [1.0, 1], ['inf', 1]], stats['buckets'])
+        self.assertEqual(0.1, histogram.percentile(50))
+        self.assertEqual(2.0, histogram.percentile(99))
+
+
+class ProfilerTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ProfilerTestCase, self).setUp()
+        self.flags(scheduler_profiling=True)
+        self.stubs.Set(profiler, 'STATS', profiler.SchedulerStats())
+
+    def _schedule(self):
+        with profiler.profile_request() as profile:
+            hosts = filters.HostFilterHandler().get_filtered_objects(
+                [OddHostFilter], _fake_host_states(), {})
+            weights.HostWeightHandler().get_weighed_objects(
+                [ram.RAMWeigher], hosts, {})
+            with profiler.timed('host_manager', 'get_all_host_states'):
+                db.compute_node_get_all(context.get_admin_context())
+        return profile
+
+    def test_request_profile(self):
+        profile = self._schedule()
+        self.assertEqual([('filter', 'OddHostFilter', 4, 2),
+                          ('weigher', 'RAMWeigher', 2, None),
+                          ('host_manager', 'get_all_host_states', None, None)],
+                         [(step['kind'], step['name'], step['hosts_in'],
+                           step['hosts_out']) for step in profile.steps])
+        self.assertTrue(profile.db_queries >= 1)
+        self.assertIsNotNone(profile.elapsed)
+
+    def test_stats(self):
+        db_queries = self._schedule().db_queries
+        db_queries += self._schedule().db_queries
+        stats = manager.SchedulerManager().get_scheduler_stats(None)
+        self.assertEqual(2, stats['counters']['requests'])
+        self.assertEqual(db_queries, stats['counters']['db_queries'])
+        self.assertEqual(8, stats['counters']['filter.OddHostFilter.hosts_in'])
+        self.assertEqual(4,
+                         stats['counters']['filter.OddHostFilter.hosts_out'])
+        self.assertEqual(2, stats['histograms']['weigher.RAMWeigher']['count'])
+        self.assertEqual(2, stats['histograms']['request']['count'])
+        self.assertIn('filter.OddHostFilter: count=2',
+                      profiler.STATS.summary())
+
+    def test_nested_requests(self):
+        with profiler.profile_request() as profile:
+            with profiler.profile_request() as nested:
+                profiler.record('filter', 'OddHostFilter', 0.1)
+        self.assertIs(profile, nested)
+        self.assertEqual(1, profiler.STATS.counters['requests'])
+
+    def test_disabled(self):
+        self.flags(scheduler_profiling=False)
+        self.assertIsNone(self._schedule())
+        self.assertEqual(0, profiler.STATS.counters['requests'])
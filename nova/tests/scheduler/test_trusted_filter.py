@@ -0,0 +1,115 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the attestation cache of the trusted filter.
+"""
+
+import mock
+
+from nova.openstack.common import timeutils
+from nova.scheduler.filters import trusted_filter
+from nova import test
+from nova.tests.scheduler import fake_attestation
+from nova.tests.scheduler import fakes
+
+
+class TrustedFilterTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(TrustedFilterTestCase, self).setUp()
+        self.flags(attestation_auth_timeout=60, attestation_max_stale=300,
+                   group='trusted_computing')
+        self.server = self.useFixture(fake_attestation.FakeAttestationServer(
+            {'host1': 'trusted'}))
+        self.stubs.Set(trusted_filter, '_attestation_cache', None)
+        patcher = mock.patch('nova.db.compute_node_get_all',
+                             return_value=fakes.COMPUTE_NODES)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.spawned = []
+        self.stubs.Set(trusted_filter.utils, 'spawn_n',
+                       lambda func, *args: self.spawned.append(func))
+
+    def _passes(self, host, trust='trusted'):
+        filter_properties = {'instance_type': {
+            'memory_mb': 1024,
+            'extra_specs': {'trust:trusted_host': trust}}}
+        host_state = fakes.FakeHostState(host, 'node', {})
+        return trusted_filter.TrustedFilter().host_passes(host_state,
+                                                          filter_properties)
+
+    def test_cache_shared_between_requests(self):
+        self.assertTrue(self._passes('host1'))
+        self.assertFalse(self._passes('host2'))
+        self.assertTrue(self._passes('host2', 'untrusted'))
+        # All the compute hosts are attested by the first request.
+        self.assertEqual([sorted(['host1', 'host2', 'host3', 'host4'])],
+                         [sorted(hosts) for hosts in self.server.requests])
+
+    def test_connection_kept_alive(self):
+        self._passes('host1')
+        timeutils.advance_time_seconds(61)
+        self._passes('host1')
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual(1, self.server.connections)
+
+    def test_only_expired_hosts_polled(self):
+        self._passes('host1')
+        timeutils.advance_time_seconds(30)
+        self._passes('host5')
+        timeutils.advance_time_seconds(31)
+        self._passes('host5')
+        self.assertEqual([['host5'], ['host1', 'host2', 'host3', 'host4']],
+                         [sorted(hosts) for hosts in self.server.requests[1:]])
+
+    def test_unreachable_server_fails_closed(self):
+        self._passes('host1')
+        self.server.available = False
+        timeutils.advance_time_seconds(61)
+        self.assertFalse(self._passes('host1'))
+        self.assertFalse(self._passes('host2', 'untrusted'))
+
+    def test_async_refresh_never_waits(self):
+        self.flags(attestation_async_refresh=True, group='trusted_computing')
+        # Unknown until the first background refresh.
+        self.assertFalse(self._passes('host1'))
+        self.assertEqual([], self.server.requests)
+        self.assertEqual(1, len(self.spawned))
+        self.assertFalse(self._passes('host1'))
+        self.assertEqual(1, len(self.spawned))
+        self.spawned.pop()()
+        self.assertTrue(self._passes('host1'))
+
+    def test_async_refresh_serves_stale(self):
+        self.flags(attestation_async_refresh=True, group='trusted_computing')
+        self._passes('host1')
+        self.spawned.pop()()
+        self.server.trust_levels['host1'] = 'untrusted'
+
+        timeutils.advance_time_seconds(61)
+        self.assertTrue(self._passes('host1'))
+        self.spawned.pop()()
+        self.assertFalse(self._passes('host1'))
+
+    def test_async_refresh_max_stale(self):
+        self.flags(attestation_async_refresh=True, group='trusted_computing')
+        self._passes('host1')
+        self.spawned.pop()()
+        self.server.available = False
+
+        timeutils.advance_time_seconds(61 + 300)
+        self.assertFalse(self._passes('host1'))
@@ -1966,6 +1966,31 @@ class DbQuotaDriverTestCase(test.TestCase):
                 ])
         self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
 
+    def test_reserve_optimistic(self):
+        self.driver = quota.OptimisticDbQuotaDriver()
+        self._stub_get_project_quotas()
+        self._stub_quota_reserve()
+
+        def fake_quota_reserve_optimistic(context, resources, quotas,
+                                          user_quotas, deltas, expire,
+                                          until_refresh, max_age,
+                                          project_id=None, user_id=None):
+            self.calls.append(('quota_reserve_optimistic', expire,
+                               until_refresh, max_age))
+            return ['resv-1']
+        self.stubs.Set(db, 'quota_reserve_optimistic',
+                       fake_quota_reserve_optimistic)
+        expire = timeutils.utcnow() + datetime.timedelta(seconds=120)
+        result = self.driver.reserve(FakeContext('test_project', 'test_class'),
+                                     quota.QUOTAS._resources,
+                                     dict(instances=2), expire=expire)
+
+        self.assertEqual(self.calls, [
+                'get_project_quotas',
+                ('quota_reserve_optimistic', expire, 0, 0),
+                ])
+        self.assertEqual(result, ['resv-1'])
+
     def test_usage_reset(self):
         calls = []
 
@@ -52,3 +52,21 @@ class TestWeigher(test.NoDBTestCase):
         for seq, result, minval, maxval in map_:
             ret = weights.normalize(seq, minval=minval, maxval=maxval)
             self.assertEqual(tuple(ret), result)
+
+    def test_weighed_objects_bounds(self):
+        class FakeWeigher(weights.BaseWeigher):
+            def _weigh_object(self, obj, weight_properties):
+                return obj
+
+        handler = weights.BaseWeightHandler(weights.BaseWeigher)
+        bounds = []
+        weighed = handler.get_weighed_objects([FakeWeigher], [20.0, 50.0],
+                                              {}, bounds)
+        self.assertEqual([(50.0, 1.0), (20.0, 0.0)],
+                         [(w.obj, w.weight) for w in weighed])
+        self.assertEqual([(20.0, 50.0)], bounds)
+
+        weighed = handler.get_weighed_objects([FakeWeigher], [35.0], {},
+                                              bounds)
+        self.assertEqual(0.5, weighed[0].weight)
+        self.assertEqual([(20.0, 50.0)], bounds)
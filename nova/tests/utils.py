@@ -206,3 +206,24 @@ def is_ipv6_supported():
             has_ipv6_support = False
 
     return has_ipv6_support
+
+
+def latency_stats(values):
+    """Return count, min, mean, p50, p95, p99 and max of a list of numbers.
+
+    Used by the benchmark harnesses to summarize their latencies.
+    """
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def percentile(p):
+        return values[int(round(p * (len(values) - 1)))]
+
+    return {'count': len(values),
+            'min': values[0],
+            'mean': sum(values) / len(values),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+            'max': values[-1]}
@@ -18,6 +18,7 @@ Pluggable Weighing support
 """
 
 import abc
+import time
 
 import six
 
@@ -121,25 +122,46 @@ class BaseWeigher(object):
 class BaseWeightHandler(loadables.BaseLoader):
     object_class = WeighedObject
 
+    def _weigher_done(self, cls_name, elapsed, num_objs):
+        """Called after each weigher run with its timing.
+
+        Override in a subclass to instrument the weighers.
+        """
+        pass
+
     def get_weighed_objects(self, weigher_classes, obj_list,
-            weighing_properties):
-        """Return a sorted (descending), normalized list of WeighedObjects."""
+            weighing_properties, bounds=None):
+        """Return a sorted (descending), normalized list of WeighedObjects.
+
+        :param bounds: optional list of the (minval, maxval) of each
+                       weigher. The bounds missing from the list are
+                       appended to it, the others are used to normalize
+                       the weights instead of the bounds of obj_list.
+        """
 
         if not obj_list:
             return []
 
         weighed_objs = [self.object_class(obj, 0.0) for obj in obj_list]
-        for weigher_cls in weigher_classes:
+        for i, weigher_cls in enumerate(weigher_classes):
+            start = time.time()
             weigher = weigher_cls()
             weights = weigher.weigh_objects(weighed_objs, weighing_properties)
 
+            if bounds is None:
+                minval, maxval = weigher.minval, weigher.maxval
+            elif i < len(bounds):
+                minval, maxval = bounds[i]
+            else:
+                minval, maxval = weigher.minval, weigher.maxval
+                bounds.append((minval, maxval))
+
             # Normalize the weights
-            weights = normalize(weights,
-                                minval=weigher.minval,
-                                maxval=weigher.maxval)
+            weights = normalize(weights, minval=minval, maxval=maxval)
 
-            for i, weight in enumerate(weights):
-                obj = weighed_objs[i]
+            for obj, weight in zip(weighed_objs, weights):
                 obj.weight += weigher.weight_multiplier() * weight
+            self._weigher_done(weigher_cls.__name__, time.time() - start,
+                               len(weighed_objs))
 
         return sorted(weighed_objs, key=lambda x: x.weight, reverse=True)